@@ -0,0 +1,125 @@
+from math import ceil
+from threading import Condition
+from time import monotonic
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class AdmissionController:
+    """
+    Admission of the requests of a worker by their estimated cost (see estimate_cost):
+     - every client (authenticated user or address) spends its own token bucket,
+       the requests above it are rejected (429), so a bulk sync client doesn't take the whole worker
+     - requests run while the sum of their costs is within the capacity, the rest wait for up to queue_timeout
+       and then are rejected (503). Cheap requests (object GETs, writes) only wait for the tokens,
+       so interactive users aren't queued behind the listings
+    """
+    cheap_cost = 1
+
+    def __init__(self, capacity, queue_timeout=5, client_rate=0, client_burst=0, route_costs=None,
+                 default_limit=100, max_limit=1000, route_opt_fields=None, max_buckets=10000, trusted_proxies=0):
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst or client_rate
+        self.route_costs = route_costs or {}
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.route_opt_fields = route_opt_fields or {}
+        self.max_buckets = max_buckets
+        self.trusted_proxies = trusted_proxies
+        self.buckets = {}
+        self.in_progress = 0
+        self.condition = Condition()
+
+    def estimate_cost(self, route_name, params):
+        """
+        Route cost (route_costs, 1 by default) multiplied by the page size relative to the default one
+        and by the number of optional fields, as every one of them makes the page bigger.
+        The page size is capped at max_limit and only the distinct fields the route allows (route_opt_fields)
+        are counted, as the listing ignores the rest
+        """
+        cost = self.route_costs.get(route_name, 1)
+        if not cost:
+            return 0
+        try:
+            limit = min(int(params.get("limit", self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        cost *= max(1, limit / self.default_limit)
+        opt_fields = {f for f in params.get("opt_fields", "").split(",") if f}
+        if route_name in self.route_opt_fields:
+            opt_fields &= self.route_opt_fields[route_name]
+        cost *= 1 + len(opt_fields) / 2
+        return cost
+
+    def get_client_address(self, remote_addr, forwarded_for=None):
+        """
+        The address anonymous clients are told apart by. Every one of trusted_proxies in front of the service
+        appends the address it's got the request from to X-Forwarded-For, the entries before them are sent
+        by the client and can be anything, so the client address is the one added by the farthest proxy.
+        Without trusted proxies (or without the header) it's the address of the connection
+        """
+        if self.trusted_proxies and forwarded_for:
+            hops = [hop.strip() for hop in forwarded_for.split(",")]
+            if len(hops) >= self.trusted_proxies:
+                return hops[-self.trusted_proxies]
+        return remote_addr
+
+    def take_tokens(self, client, cost):
+        """
+        :return: seconds to wait before the client has enough tokens, None if they are taken
+        """
+        if not self.client_rate:
+            return None
+        now = monotonic()
+        with self.condition:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    self.drop_full_buckets(now)
+                bucket = self.buckets[client] = TokenBucket(self.client_burst, now)
+            bucket.tokens = min(self.client_burst, bucket.tokens + (now - bucket.updated) * self.client_rate)
+            bucket.updated = now
+            # a request that costs more than the burst is let through with a full bucket and empties it
+            cost = min(cost, self.client_burst)
+            if bucket.tokens < cost:
+                return ceil((cost - bucket.tokens) / self.client_rate)
+            bucket.tokens -= cost
+        return None
+
+    def drop_full_buckets(self, now):
+        for client, bucket in list(self.buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * self.client_rate >= self.client_burst:
+                del self.buckets[client]
+
+    def acquire(self, cost):
+        """
+        :return: False if the cost hasn't fitted the capacity for queue_timeout
+        """
+        if cost <= self.cheap_cost or not self.capacity:
+            return True
+        # a request that costs more than the capacity runs alone
+        cost = min(cost, self.capacity)
+        deadline = monotonic() + self.queue_timeout
+        with self.condition:
+            while self.in_progress + cost > self.capacity:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.in_progress += cost
+        return True
+
+    def release(self, cost):
+        if cost <= self.cheap_cost or not self.capacity:
+            return
+        with self.condition:
+            self.in_progress -= min(cost, self.capacity)
+            self.condition.notify_all()
@@ -9,6 +9,7 @@ if not is_test():
 
 import os
 import simplejson
+from bson.raw_bson import RawBSONDocument
 from nacl.encoding import HexEncoder
 from nacl.signing import SigningKey, VerifyKey
 from pkg_resources import iter_entry_points
@@ -16,10 +17,15 @@ from pyramid.authorization import ACLAuthorizationPolicy as AuthorizationPolicy
 from pyramid.config import Configurator
 from pyramid.renderers import JSON, JSONP
 from pyramid.settings import asbool
+from pymongo.errors import ExecutionTimeout
 from openprocurement.audit.api.auth import AuthenticationPolicy, authenticated_role, check_accreditation
 from openprocurement.audit.api.constants import ROUTE_PREFIX
-from openprocurement.audit.api.database import MongodbStore
-from openprocurement.audit.api.utils import forbidden, request_params
+from openprocurement.audit.api.database import get_store, raw_document_json_adapter
+from openprocurement.audit.api.metrics import MULTIPROCESS, timed
+from openprocurement.audit.api.admission import AdmissionController
+from openprocurement.audit.api.timeouts import QueryBudgetExceeded
+from openprocurement.audit.api.utils import forbidden, parse_route_values, query_timeout, request_params
+from openprocurement.audit.api.views.base import MongodbResourceListing, get_listing_opt_fields
 from sentry_sdk.integrations.logging import LoggingIntegration
 from sentry_sdk.integrations.pyramid import PyramidIntegration
 import sentry_sdk
@@ -49,13 +55,22 @@ def main(global_config, **settings):
     config.include('pyramid_exclog')
     config.include("cornice")
     config.add_forbidden_view(forbidden)
+    config.add_exception_view(query_timeout, context=ExecutionTimeout)
+    config.add_exception_view(query_timeout, context=QueryBudgetExceeded)
     config.add_request_method(request_params, 'params', reify=True)
     config.add_request_method(authenticated_role, reify=True)
     config.add_request_method(check_accreditation)
-    config.add_renderer('json', JSON(serializer=simplejson.dumps))
-    config.add_renderer('prettyjson', JSON(indent=4, serializer=simplejson.dumps))
-    config.add_renderer('jsonp', JSONP(param_name='opt_jsonp', serializer=simplejson.dumps))
-    config.add_renderer('prettyjsonp', JSONP(indent=4, param_name='opt_jsonp', serializer=simplejson.dumps))
+    serializer = timed("render")(simplejson.dumps)
+    renderers = {
+        'json': JSON(serializer=serializer),
+        'prettyjson': JSON(indent=4, serializer=serializer),
+        'jsonp': JSONP(param_name='opt_jsonp', serializer=serializer),
+        'prettyjsonp': JSONP(indent=4, param_name='opt_jsonp', serializer=serializer),
+    }
+    for name, renderer in renderers.items():
+        # listings return encoded documents that are decoded only at rendering
+        renderer.add_adapter(RawBSONDocument, raw_document_json_adapter)
+        config.add_renderer(name, renderer)
 
     # search for plugins
     plugins = settings.get('plugins') and settings['plugins'].split(',')
@@ -65,8 +80,13 @@ def main(global_config, **settings):
             plugin(config)
             pass
 
+    # the directory the workers share their metrics in, see MultiprocessValues
+    metrics_dir = os.environ.get('METRICS_DIR', settings.get('metrics_dir'))
+    if metrics_dir:
+        MULTIPROCESS.set_directory(metrics_dir)
+
     # mongodb
-    config.registry.mongodb = MongodbStore(settings)
+    config.registry.mongodb = get_store(settings)
 
     # Document Service key
     config.registry.docservice_url = settings.get('docservice_url')
@@ -87,11 +107,7 @@ def main(global_config, **settings):
         if key:
             config.registry.keyring[key[:8]] = VerifyKey(key, encoder=HexEncoder)
 
-    # migrate data
-    if not os.environ.get('MIGRATION_SKIP'):
-        for entry_point in iter_entry_points('openprocurement.audit.api.migrations'):
-            plugin = entry_point.load()
-            plugin(config.registry)
+    # data migrations are run by openprocurement.audit.api.migrate, the workers start without them
 
     config.registry.server_id = settings.get('id', '')
 
@@ -109,6 +125,36 @@ def main(global_config, **settings):
     config.registry.health_threshold_func = settings.get('health_threshold_func', 'all')
     config.registry.update_after = asbool(settings.get('update_after', True))
     config.registry.disable_opt_fields_filter = asbool(settings.get('disable_opt_fields_filter', False))
+    config.registry.longpoll_timeout = float(settings.get('longpoll_timeout', 25))
+    config.registry.server_timing = asbool(settings.get('server_timing', True))
+    config.registry.single_flight = asbool(settings.get('single_flight', False))
+    config.registry.single_flight_timeout = float(settings.get('single_flight_timeout', 30))
+    # seconds, 0 means no limit
+    config.registry.query_timeout = float(settings.get('query_timeout', 0))
+    config.registry.query_timeouts = parse_route_values(settings.get('query_timeouts', ''))
+    # cost units, see AdmissionController
+    admission_capacity = float(settings.get('admission.capacity', 0))
+    admission_client_rate = float(settings.get('admission.client_rate', 0))
+    if admission_capacity or admission_client_rate:
+        config.registry.admission = AdmissionController(
+            capacity=admission_capacity,
+            queue_timeout=float(settings.get('admission.queue_timeout', 5)),
+            client_rate=admission_client_rate,
+            client_burst=float(settings.get('admission.client_burst', 0)),
+            route_costs=parse_route_values(settings.get('admission.route_costs', '')),
+            default_limit=MongodbResourceListing.default_limit,
+            max_limit=MongodbResourceListing.max_limit,
+            route_opt_fields=get_listing_opt_fields(),
+            trusted_proxies=int(settings.get('admission.trusted_proxies', 0)),
+        )
+    else:
+        config.registry.admission = None
 
+    # the tween added last is the outermost one; coalesced requests are admitted, timed
+    # and have their db session the same way as the others, so single flight is the innermost
+    config.add_tween("openprocurement.audit.api.middlewares.SingleFlightMiddleware")
     config.add_tween("openprocurement.audit.api.middlewares.DBSessionCookieMiddleware")
+    config.add_tween("openprocurement.audit.api.middlewares.ServerTimingMiddleware")
+    config.add_tween("openprocurement.audit.api.middlewares.AdmissionControlMiddleware")
+    config.add_tween("openprocurement.audit.api.middlewares.QueryBudgetMiddleware")
     return config.make_wsgi_app()
@@ -0,0 +1,450 @@
+"""
+Read-only ASGI app for the hot public paths: feed listings, object GETs, counts and health
+
+It uses the same settings, models, masking and rendering as the pyramid app,
+but the pymongo async client instead of gevent patched blocking I/O, so one process serves
+many more concurrent feed clients. Writes and all the other routes stay with the WSGI app,
+the proxy sends only GETs of the routes registered here:
+
+    AUDIT_API_CONFIG=etc/service.ini#api uvicorn --factory openprocurement.audit.api.asgi:main
+
+Plugins add their collections and routes with openprocurement.audit.api.asgi_plugins entry points
+(see openprocurement.audit.monitoring.asgi, the inspection and request plugins add only their listings).
+Requires openprocurement.audit.api[asgi]
+"""
+import asyncio
+import os
+import re
+from base64 import b64decode, b64encode
+from binascii import a2b_base64
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from logging import getLogger
+from urllib.parse import parse_qsl, quote
+
+import simplejson
+from bson.json_util import dumps, loads
+from nacl.encoding import HexEncoder
+from nacl.signing import SigningKey
+from pkg_resources import iter_entry_points
+from pymongo import AsyncMongoClient, DESCENDING, ASCENDING
+from pymongo.errors import ExecutionTimeout, OperationFailure, PyMongoError
+from pyramid.encode import urlencode
+from pyramid.paster import get_appsettings
+from pyramid.renderers import JSONP_VALID_CALLBACK
+from pyramid.security import Authenticated, Everyone
+from webob.headers import ResponseHeaders
+from webob.multidict import MultiDict
+
+from openprocurement.audit.api.auth import AuthenticationPolicy, authenticated_role, check_accreditation
+from openprocurement.audit.api.constants import ROUTE_PREFIX
+from openprocurement.audit.api.database import (
+    MEMORY_URI_SCHEME, READ_CLASSES, READ_PROJECTION, ChangeWaiters, MongodbStore,
+    get_client_settings, get_resume_token_time, get_listing_index, get_max_staleness, get_query_hints, get_read_preference,
+    raw_codec_options, without_hint,
+)
+from openprocurement.audit.api.utils import fix_url, iter_json_chunks, stream_json_default
+
+LOGGER = getLogger(__name__)
+
+# the causally consistent session of the current request (see ReadOnlyApp.start_session)
+DB_SESSION = ContextVar("db_session", default=None)
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, location, name, description, headers=()):
+        super().__init__(description)
+        self.status = status
+        self.errors = [{"location": location, "name": name, "description": description}]
+        self.headers = list(headers)
+
+
+class AsyncCollection:
+    """
+    The reads of BaseCollection the asgi app routes use
+    """
+
+    def __init__(self, store, object_name, settings, listing_queries=(), change_fields=()):
+        self.store = store
+        self.object_name = object_name
+        self.listing_queries = listing_queries
+        self.change_fields = change_fields
+        self.change_waiters = None
+        self.change_stream_task = None
+        collection_name = os.environ.get(f"{object_name.upper()}_COLLECTION",
+                                         settings[f"mongodb.{object_name}_collection"])
+        collection = store.database.get_collection(collection_name)
+        self.read_collections = {
+            read_class: collection.with_options(
+                read_preference=get_read_preference(collection.read_preference, store.max_staleness[read_class])
+            )
+            for read_class in READ_CLASSES
+        }
+
+    async def get(self, uid, projection=None):
+        return await self.read_collections["object"].find_one(
+            {"_id": uid},
+            projection=projection or READ_PROJECTION,
+            session=DB_SESSION.get(),
+            **self.store.get_query_options()
+        )
+
+    async def list(self, fields, offset_field="_id", offset_value=None, descending=False, limit=0, filters=None,
+                   raw=True):
+        """
+        The same as MongodbStore.list with raw=True
+        """
+        filters = filters or {}
+        query_options = self.store.get_query_options()
+        hint = get_listing_index(self.listing_queries, filters, offset_field) if self.store.query_hints else None
+        if hint:
+            query_options["hint"] = hint
+        if offset_value:
+            filters[offset_field] = {"$lt" if descending else "$gt": offset_value}
+        collection = self.read_collections["feed"].with_options(codec_options=raw_codec_options)
+
+        async def find(options):
+            cursor = collection.find(
+                filter=filters,
+                projection=MongodbStore.get_list_projection(fields, offset_field, raw=True),
+                limit=limit,
+                sort=((offset_field, DESCENDING if descending else ASCENDING),),
+                session=DB_SESSION.get(),
+                **options
+            )
+            return await cursor.to_list()
+
+        try:
+            return await find(query_options)
+        except OperationFailure as e:
+            options = without_hint(query_options, e, collection)
+        return await find(options)
+
+    async def wait_for_changes(self, filters=None, timeout=0):
+        """
+        BaseCollection.wait_for_changes on the change stream shared by the waiters of the event loop
+        """
+        operation_time = getattr(DB_SESSION.get(), "operation_time", None)
+        if self.change_waiters is None:
+            self.change_waiters = ChangeWaiters(asyncio.Event, operation_time)
+            self.change_stream_task = asyncio.create_task(self.watch_changes(self.change_waiters))
+        event = self.change_waiters.add(filters or {}, operation_time)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.change_waiters.remove(event)
+
+    async def watch_changes(self, waiters):
+        """
+        BaseCollection.watch_changes
+        """
+        pipeline = MongodbStore.get_changes_pipeline(self.change_fields)
+        start_time = waiters.start_time
+        while True:
+            try:
+                async with await self.read_collections["feed"].watch(
+                    pipeline, max_await_time_ms=1000, start_at_operation_time=start_time,
+                ) as stream:
+                    if start_time is None:
+                        waiters.restart(get_resume_token_time(stream.resume_token))
+                    while stream.alive:
+                        change = await stream.try_next()
+                        if change is not None:
+                            waiters.notify(change)
+            except PyMongoError as e:
+                LOGGER.warning(f"Change stream of {self.object_name} failed: {e}")
+                await asyncio.sleep(1)
+            start_time = None
+
+    async def count_documents(self, filters):
+        return await self.read_collections["listing"].count_documents(
+            filter=filters,
+            session=DB_SESSION.get(),
+            **self.store.get_query_options(max_time_key="maxTimeMS")
+        )
+
+    async def estimated_document_count(self):
+        return await self.read_collections["listing"].estimated_document_count()
+
+
+class AsyncMongodbStore:
+
+    def __init__(self, settings):
+        self.settings = settings
+        mongodb_uri, client_options, db_name, database_options = get_client_settings(settings)
+        if mongodb_uri.startswith(MEMORY_URI_SCHEME):
+            raise ValueError("The in-process store can't be shared with the asgi app, it needs mongodb")
+        self.connection = AsyncMongoClient(mongodb_uri, **client_options)
+        self.database = self.connection.get_database(db_name, **database_options)
+        self.max_staleness = get_max_staleness(settings)
+        self.query_hints = get_query_hints(settings)
+        # there is no request time budget here, every query gets the whole query_timeout
+        self.query_timeout = float(settings.get("query_timeout", 0))
+
+    def add_collection(self, object_name, collection_class=None):
+        """
+        :param collection_class: BaseCollection subclass the listing_queries hints and change_fields are taken from
+        """
+        listing_queries = getattr(collection_class, "listing_queries", ())
+        change_fields = getattr(collection_class, "change_fields", ())
+        setattr(self, object_name, AsyncCollection(self, object_name, self.settings, listing_queries, change_fields))
+
+    def get_query_options(self, max_time_key="max_time_ms"):
+        if not self.query_timeout:
+            return {}
+        return {max_time_key: int(self.query_timeout * 1000)}
+
+
+class ReadRequest:
+    """
+    The part of the pyramid request the listings, models, masking and rendering use
+    """
+
+    def __init__(self, app, scope, route_name, matchdict):
+        self.registry = app
+        self.scope = scope
+        # HEAD is processed as GET, only the body isn't sent
+        self.method = "GET"
+        self.path = scope["path"]
+        self.matched_route_name = route_name
+        self.matchdict = matchdict
+        self.validated = {}
+        self.headers = ResponseHeaders([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+        self.params = MultiDict(parse_qsl(scope["query_string"].decode(), keep_blank_values=True))
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        self.cookies = {name: morsel.value for name, morsel in cookies.items()}
+        scheme = scope.get("scheme", "http")
+        host = self.headers.get("Host") or "{}:{}".format(*scope["server"])
+        # the default port is dropped, as webob does
+        host = re.sub({"http": r":80$", "https": r":443$"}.get(scheme, "$^"), "", host)
+        self.application_url = f"{scheme}://{host}{scope.get('root_path', '')}"
+        self.effective_principals = app.get_principals(self)
+        self.authenticated_role = authenticated_role(self)
+
+    def check_accreditation(self, level):
+        return check_accreditation(self, level)
+
+    def route_path(self, route_name, _query=None, **kw):
+        return self.registry.route_path(route_name, _query, **kw)
+
+    def route_url(self, route_name, _query=None, **kw):
+        return self.application_url + self.route_path(route_name, _query, **kw)
+
+
+class AsyncListingMixin:
+    """
+    Makes a MongodbResourceListing view class raise its parameter errors the asgi app way
+    """
+
+    def listing_error(self, message, status, name):
+        raise HTTPError(status, "querystring", name, message)
+
+
+async def get_listing(resource):
+    """
+    MongodbResourceListing.get with the async collection methods
+    :return: listing data and items
+    """
+    params, prev_params, keys, list_kwargs = resource.get_listing_query()
+    results = await resource.db_listing_method(**list_kwargs)
+    if not results and params.get("feed") == "longpoll" and not params.get("descending"):
+        if await resource.db_wait_method(filters=list_kwargs["filters"], timeout=resource.request.registry.longpoll_timeout):
+            results = await resource.db_listing_method(**list_kwargs)
+    data = resource.get_listing_pages(results, keys, params, prev_params)
+    return data, (resource.prepare_result(r) for r in results)
+
+
+async def get_health(request):
+    return {}, None
+
+
+class ReadOnlyApp:
+    cookie_name = "SESSION"  # the same cookie DBSessionCookieMiddleware uses
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.auth = AuthenticationPolicy(settings["auth.file"])
+        self.mongodb = AsyncMongodbStore(settings)
+        self.longpoll_timeout = float(settings.get("longpoll_timeout", 25))
+        # document urls of the serialized objects (see models.Document.download_url)
+        self.docservice_url = settings.get("docservice_url")
+        signing_key = settings.get("dockey", "")
+        self.docservice_key = SigningKey(signing_key, encoder=HexEncoder) if signing_key else SigningKey.generate()
+
+        self.routes = []
+        self.route_patterns = {}
+        self.add_route("health", "/health", get_health)
+        plugins = settings.get("plugins") and settings["plugins"].split(",")
+        for entry_point in iter_entry_points("openprocurement.audit.api.asgi_plugins"):
+            if not plugins or entry_point.name in plugins:
+                plugin = entry_point.load()
+                plugin(self)
+
+    def add_route(self, name, pattern, handler):
+        """
+        :param pattern: pyramid route pattern without the prefix, routes are matched in the order they're added
+        :param handler: async function of ReadRequest that returns the response data and the listing items
+        (or None if it's not a listing)
+        """
+        pattern = ROUTE_PREFIX + pattern
+        regex = re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", pattern)
+        self.routes.append((name, re.compile(f"^{regex}$"), handler))
+        self.route_patterns[name] = pattern
+
+    def route_path(self, route_name, _query=None, **kw):
+        path = self.route_patterns[route_name].format(**{k: quote(str(v), safe="") for k, v in kw.items()})
+        if _query:
+            path = f"{path}?{urlencode(_query)}"
+        return path
+
+    def match(self, path):
+        for name, regex, handler in self.routes:
+            match = regex.match(path)
+            if match:
+                return name, match.groupdict(), handler
+        return None
+
+    def get_principals(self, request):
+        """
+        The same principals AuthenticationPolicy gives for the basic auth credentials
+        """
+        principals = [Everyone]
+        authorization = request.headers.get("Authorization", "")
+        scheme, _, credentials = authorization.partition(" ")
+        if scheme.lower() != "basic" or not credentials:
+            return principals
+        try:
+            username, _, password = a2b_base64(credentials.strip()).decode("utf-8").partition(":")
+        except (ValueError, UnicodeDecodeError):
+            return principals
+        groups = self.auth.check(username, password, request)
+        if groups is not None:
+            principals += [Authenticated, username, *groups]
+        return principals
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        route = self.match(scope["path"])
+        if route is None:
+            return await self.send_error(send, scope, 404, "url", "", "Not Found")
+        if scope["method"] not in ("GET", "HEAD"):
+            return await self.send_error(send, scope, 405, "url", "method", "Method not allowed")
+
+        route_name, matchdict, handler = route
+        request = ReadRequest(self, scope, route_name, matchdict)
+        jsonp = request.params.get("opt_jsonp")
+        if jsonp and not JSONP_VALID_CALLBACK.match(jsonp):
+            return await self.send_error(send, scope, 400, "querystring", "opt_jsonp", "Invalid JSONP callback function name.")
+        status, value, items, headers = await self.handle(request, handler)
+        content_type, chunks = self.render(request, value, items)
+        await self.send_response(send, scope, status, content_type, headers, chunks)
+
+    async def handle(self, request, handler):
+        """
+        :return: status, data, listing items, headers
+        """
+        session, warning = self.start_session(request)
+        token = DB_SESSION.set(session)
+        try:
+            status, headers = 200, []
+            try:
+                value, items = await handler(request)
+            except HTTPError as e:
+                status, value, items, headers = e.status, {"status": "error", "errors": e.errors}, None, e.headers
+            except ExecutionTimeout:
+                status, items = 504, None
+                value = self.get_error_data("url", "timeout", "Database query timed out")
+                headers = [("Retry-After", "1")]
+            session_data = {
+                "operation_time": session.operation_time,
+                "cluster_time": session.cluster_time,
+            }
+        finally:
+            DB_SESSION.reset(token)
+            await session.end_session()
+        headers.append(("Set-Cookie", f"{self.cookie_name}={b64encode(dumps(session_data).encode()).decode()}; Path=/"))
+        if warning:
+            headers.append(("X-Warning", f"199 - \"{warning}\""))
+        return status, value, items, headers
+
+    def start_session(self, request):
+        session = self.mongodb.connection.start_session(causal_consistency=True)
+        warning = None
+        cookie = request.cookies.get(self.cookie_name)
+        if cookie:
+            try:
+                values = loads(b64decode(cookie))
+                session.advance_cluster_time(values["cluster_time"])
+                session.advance_operation_time(values["operation_time"])
+            except Exception as exc:
+                warning = f"Error on {self.cookie_name} cookie parsing: {exc}"
+                LOGGER.debug(warning)
+        return session, warning
+
+    @staticmethod
+    def get_error_data(location, name, description):
+        return {"status": "error", "errors": [{"location": location, "name": name, "description": description}]}
+
+    @staticmethod
+    def render(request, value, items=None):
+        """
+        The same output the pyramid renderers give (opt_pretty and opt_jsonp included),
+        listing items are streamed the way stream_json_response does
+        :return: content type, body chunks
+        """
+        pretty = request.params.get("opt_pretty")
+        jsonp = request.params.get("opt_jsonp")
+        if items is not None:
+            if not pretty and not jsonp:
+                return "application/json", iter_json_chunks(value, items, request.application_url)
+            value = dict(data=list(items), **value)
+        if "data" in value:
+            fix_url(value["data"], request.application_url)
+        body = simplejson.dumps(value, indent=4 if pretty else None, default=stream_json_default)
+        if jsonp:
+            return "application/javascript", [f"/**/{jsonp}({body});".encode()]
+        return "application/json", [body.encode()]
+
+    async def send_error(self, send, scope, status, location, name, description):
+        body = simplejson.dumps(self.get_error_data(location, name, description)).encode()
+        await self.send_response(send, scope, status, "application/json", [], [body])
+
+    @staticmethod
+    async def send_response(send, scope, status, content_type, headers, chunks):
+        headers = [("Content-Type", content_type), *headers]
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+        if scope["method"] != "HEAD":
+            for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.mongodb.connection.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def main(config_uri=None):
+    """
+    :param config_uri: ini file path with the app section name, e.g. "etc/service.ini#api",
+    AUDIT_API_CONFIG by default
+    """
+    settings = get_appsettings(config_uri or os.environ["AUDIT_API_CONFIG"])
+    return ReadOnlyApp(settings)
@@ -0,0 +1,285 @@
+"""
+Benchmarks of the API hot paths
+
+Seeds monitorings, inspections and requests through the API (so through the models and validation)
+and times listings, single GETs with masking, status transitions and document uploads.
+Results are printed (or saved with -o) as json, every scenario has timings in milliseconds:
+
+    python -m openprocurement.audit.api.benchmark -p etc/service.ini -n 200 -o benchmark.json
+
+The app from the given ini file is called in-process (webtest), so no server is needed,
+but data is written to the configured mongodb.db_name, use a separate database
+or MONGODB_URI=memory:// to run without mongodb (see openprocurement.audit.api.memory).
+Credentials are the ones from etc/auth.ini by default.
+webtest is required, it comes with the benchmark (or test) extra: pip install openprocurement.audit.api[benchmark]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from base64 import b64encode
+from datetime import datetime
+from statistics import mean, median
+from time import perf_counter
+from unittest import mock
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from nacl.encoding import HexEncoder
+from paste.deploy.loadwsgi import loadapp
+
+from openprocurement.audit.api.choices import VIOLATION_TYPE_CHOICES
+from openprocurement.audit.api.constants import ROUTE_PREFIX
+from openprocurement.audit.api.database import COLLECTION_CLASSES
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+class Benchmark:
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.registry = app.app.registry
+        self.results = {}
+        self.monitoring_ids = []
+        self.restricted_monitoring_ids = []
+        self.tender_ids = [uuid4().hex for _ in range(args.tenders)]
+        if not self.registry.docservice_url:
+            self.registry.docservice_url = "http://localhost"
+
+    @staticmethod
+    def auth(credentials):
+        return ("Basic", tuple(credentials.split(":", 1))) if credentials else None
+
+    def request(self, method, path, credentials=None, **kwargs):
+        self.app.authorization = self.auth(credentials)
+        return getattr(self.app, method)(ROUTE_PREFIX + path, **kwargs)
+
+    def measure(self, name, func, repeat=None):
+        timings = []
+        for i in range(repeat or self.args.repeat):
+            start = perf_counter()
+            func(i)
+            timings.append((perf_counter() - start) * 1000)
+        timings.sort()
+        self.results[name] = {
+            "count": len(timings),
+            "min": timings[0],
+            "mean": mean(timings),
+            "median": median(timings),
+            "p95": timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0],
+            "max": timings[-1],
+        }
+        logger.info(f"{name}: median {self.results[name]['median']:.2f}ms")
+
+    def generate_docservice_url(self):
+        uid = uuid4().hex
+        signer = self.registry.docservice_key
+        keyid = signer.verify_key.encode(encoder=HexEncoder)[:8].decode()
+        signature = b64encode(signer.sign(f"{uid}\0{'0' * 32}".encode()).signature)
+        query = {"Signature": signature, "KeyID": keyid}
+        return f"{self.registry.docservice_url}/get/{uid}?{urlencode(query)}"
+
+    def document(self):
+        return {
+            "title": "Висновок.pdf",
+            "url": self.generate_docservice_url(),
+            "hash": "md5:" + "0" * 32,
+            "format": "application/pdf",
+        }
+
+    # seed
+
+    def create_monitoring(self, tender_id, restricted=False):
+        with mock.patch("openprocurement.audit.monitoring.utils.TendersClient") as client:
+            client.return_value.get_tender.return_value = {"config": {"restricted": restricted}}
+            response = self.request("post_json", "/monitorings", self.args.sas, params={"data": {
+                "tender_id": tender_id,
+                "reasons": ["indicator"],
+                "procuringStages": ["planning"],
+            }})
+        return response.json["data"]["id"]
+
+    def activate_monitoring(self, monitoring_id):
+        self.request("patch_json", f"/monitorings/{monitoring_id}", self.args.sas, params={"data": {
+            "decision": {
+                "description": "Опис рішення " * 20,
+                "date": datetime.now().isoformat(),
+                "documents": [self.document()],
+            },
+            "status": "active",
+        }})
+
+    def seed(self):
+        logger.info(f"Seeding {self.args.n} monitorings")
+        for i in range(self.args.n):
+            restricted = i % 2 == 0
+            monitoring_id = self.create_monitoring(self.tender_ids[i % len(self.tender_ids)], restricted)
+            self.activate_monitoring(monitoring_id)
+            for _ in range(self.args.posts):
+                self.request("post_json", f"/monitorings/{monitoring_id}/posts", self.args.sas, params={"data": {
+                    "title": "Запит на роз'яснення",
+                    "description": "Текст запиту " * 50,
+                    "documents": [self.document()],
+                }})
+            self.monitoring_ids.append(monitoring_id)
+            if restricted:
+                self.restricted_monitoring_ids.append(monitoring_id)
+
+        if "inspection" in COLLECTION_CLASSES:
+            logger.info(f"Seeding {self.args.n} inspections")
+            for i in range(self.args.n):
+                with mock.patch(
+                    "openprocurement.audit.inspection.views.inspection.extract_restricted_config_from_monitoring"
+                ) as restricted_config:
+                    restricted_config.return_value = i % 2 == 0
+                    self.request("post_json", "/inspections", self.args.sas, params={"data": {
+                        "monitoring_ids": [self.monitoring_ids[i]],
+                        "description": "Опис інспекції " * 20,
+                        "documents": [self.document()],
+                    }})
+
+        if "request" in COLLECTION_CLASSES:
+            logger.info(f"Seeding {self.args.n} requests")
+            for i in range(self.args.n):
+                self.request("post_json", "/requests", self.args.public, params={"data": {
+                    "tenderId": self.tender_ids[i % len(self.tender_ids)],
+                    "description": "Опис звернення " * 20,
+                    "violationType": list(VIOLATION_TYPE_CHOICES),
+                    "parties": [{
+                        "name": "party name",
+                        "address": {
+                            "streetAddress": "street address",
+                            "locality": "locality",
+                            "region": "region",
+                            "postalCode": "01001",
+                            "countryName": "Україна",
+                        },
+                        "contactPoint": {"email": "test@example.com"},
+                    }],
+                    "documents": [self.document()],
+                }})
+
+    # scenarios
+
+    def walk_feed(self, path, credentials=None):
+        def walk(_):
+            url = path
+            while True:
+                response = self.request("get", url, credentials)
+                if not response.json["data"]:
+                    break
+                url = response.json["next_page"]["path"][len(ROUTE_PREFIX):]
+        return walk
+
+    def run(self):
+        args = self.args
+        feed_fields = "opt_fields=status,documents,posts,decision&limit=100"
+        self.measure("monitorings_feed", self.walk_feed(f"/monitorings?{feed_fields}"), repeat=3)
+        self.measure("monitorings_feed_masked", self.walk_feed(f"/monitorings?{feed_fields}", args.broker), repeat=3)
+        self.measure("monitorings_feed_page", lambda i: self.request("get", f"/monitorings?{feed_fields}"))
+        self.measure("monitorings_count", lambda i: self.request("get", "/monitorings/count"))
+        self.measure(
+            "tender_monitorings",
+            lambda i: self.request(
+                "get",
+                f"/tenders/{self.tender_ids[i % len(self.tender_ids)]}/monitorings?opt_fields=decision,posts",
+                args.broker,
+            ),
+        )
+        self.measure(
+            "get_monitoring",
+            lambda i: self.request("get", f"/monitorings/{self.monitoring_ids[i % len(self.monitoring_ids)]}"),
+        )
+        if self.restricted_monitoring_ids:
+            self.measure(
+                "get_monitoring_masked",
+                lambda i: self.request(
+                    "get",
+                    f"/monitorings/{self.restricted_monitoring_ids[i % len(self.restricted_monitoring_ids)]}",
+                    args.broker,
+                ),
+            )
+
+        drafts = [self.create_monitoring(self.tender_ids[0]) for _ in range(args.repeat)]
+        self.measure("patch_monitoring_status", lambda i: self.activate_monitoring(drafts[i]))
+        self.measure(
+            "post_monitoring_document",
+            lambda i: self.request(
+                "post_json",
+                f"/monitorings/{self.monitoring_ids[i % len(self.monitoring_ids)]}/documents",
+                args.sas,
+                params={"data": self.document()},
+            ),
+        )
+
+        if "inspection" in COLLECTION_CLASSES:
+            self.measure("inspections_feed", self.walk_feed("/inspections?opt_fields=documents&limit=100"), repeat=3)
+            self.measure(
+                "monitoring_inspections",
+                lambda i: self.request(
+                    "get", f"/monitorings/{self.monitoring_ids[i % len(self.monitoring_ids)]}/inspections", args.broker,
+                ),
+            )
+        if "request" in COLLECTION_CLASSES:
+            self.measure("requests_feed", self.walk_feed("/requests?opt_fields=description&limit=100"), repeat=3)
+            self.measure(
+                "tender_requests",
+                lambda i: self.request("get", f"/tenders/{self.tender_ids[i % len(self.tender_ids)]}/requests"),
+            )
+        return self.results
+
+
+def flush(registry):
+    for name in COLLECTION_CLASSES:
+        collection = getattr(registry.mongodb, name, None)
+        if collection:
+            collection.flush()
+    registry.mongodb.flush_sequences()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the API hot paths")
+    parser.add_argument("-p", required=True, help="Path to an ini file with the app")
+    parser.add_argument("--app-name", default="main", help="Name of the app in the ini file")
+    parser.add_argument("-n", type=int, default=100, help="Number of monitorings, inspections and requests to seed")
+    parser.add_argument("--posts", type=int, default=2, help="Number of posts in every monitoring")
+    parser.add_argument("--tenders", type=int, default=10, help="Number of tenders to spread monitorings over")
+    parser.add_argument("--repeat", type=int, default=50, help="Number of calls of every scenario")
+    parser.add_argument("--flush", action="store_true", help="Delete all the data before and after the run")
+    parser.add_argument("--sas", default="test_sas:test_sas_token")
+    parser.add_argument("--broker", default="broker:broker", help="A broker without restricted data access")
+    parser.add_argument("--public", default="public:public")
+    parser.add_argument("-o", help="Path to save results json to (stdout by default)")
+    args = parser.parse_args()
+
+    try:
+        import webtest
+    except ImportError:
+        parser.error("webtest is required, install openprocurement.audit.api[benchmark]")
+    app = webtest.TestApp(loadapp(f"config:{os.path.abspath(args.p)}", name=args.app_name))
+    benchmark = Benchmark(app, args)
+    if args.flush:
+        flush(benchmark.registry)
+    try:
+        benchmark.seed()
+        results = {
+            "params": {"n": args.n, "posts": args.posts, "tenders": args.tenders, "repeat": args.repeat},
+            "results": benchmark.run(),
+        }
+    finally:
+        if args.flush:
+            flush(benchmark.registry)
+
+    if args.o:
+        with open(args.o, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
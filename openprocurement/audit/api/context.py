@@ -44,3 +44,19 @@ def get_db_session() -> Request:
 
 def set_db_session(db_session):
     thread_context.db_session = db_session
+
+
+def get_timings():
+    return getattr(thread_context, "timings", None)
+
+
+def set_timings(timings):
+    thread_context.timings = timings
+
+
+def get_query_deadline():
+    return getattr(thread_context, "query_deadline", None)
+
+
+def set_query_deadline(deadline):
+    thread_context.query_deadline = deadline
@@ -1,21 +1,55 @@
 import os
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from time import time, sleep
 from uuid import uuid4
 from logging import getLogger
+from gevent import iwait
+from gevent.local import local
 from pymongo import MongoClient, ReturnDocument, DESCENDING, ASCENDING, ReadPreference, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+from pymongo.monitoring import CommandListener
 from pymongo.write_concern import WriteConcern
 from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest
+from pymongo.server_type import SERVER_TYPE
+from pyramid.settings import asbool, aslist
+from bson import decode, encode
+from bson.binary import Binary
 from bson.codec_options import TypeRegistry, TypeCodec, CodecOptions
 from bson.decimal128 import Decimal128
+from bson.timestamp import Timestamp
 from decimal import Decimal
-from openprocurement.audit.api.context import get_now, get_db_session, get_request
-from pprint import pprint
+from openprocurement.audit.api.context import get_now, get_db_session, get_request, set_db_session
+from openprocurement.audit.api.metrics import (
+    timed, spawn, CONFLICTS, CONNECTION_POOL_METRICS, DOCUMENT_CACHE_READS, DOCUMENT_CACHES, HEDGED_READS,
+    REPLICATION_LAG,
+)
+from openprocurement.audit.api.timeouts import check_client_disconnected, get_query_options, get_remaining_time
+from pprint import pformat, pprint
 from bson.raw_bson import RawBSONDocument
 
 
 LOGGER = getLogger("{}.init".format(__name__))
 
+NOT_SET = object()
 
-def print_cursor_explain(cursor):
+DEFAULT_PROJECTION = {"is_public": False, "is_test": False, "revisions": False}
+# legacy couchdb attachments are kept in the stored documents on save, but they are never shown
+READ_PROJECTION = {**DEFAULT_PROJECTION, "_attachments": False}
+# reads that can have their own max staleness (see MongodbStore.get_read_preference):
+# object - documents loaded by GET requests, listing - paging_list, feed - MongodbStore.list
+READ_CLASSES = ("object", "listing", "feed")
+# mongodb.uri of the in-process store (see openprocurement.audit.api.memory)
+MEMORY_URI_SCHEME = "memory://"
+# servers the commands of the current greenlet are sent to (only) or not sent to (excluded), see select_servers,
+# and the set that collects the servers they have been sent to (used), see ReadServers
+SERVER_SELECTION = local()
+
+
+def get_cursor_explain(cursor):
     def to_native(data):
         if isinstance(data, dict):
             data = {k: to_native(v) for k, v in data.items()}
@@ -25,10 +59,28 @@ def print_cursor_explain(cursor):
             data = {k: to_native(v) for k, v in data.items()}
         return data
 
-    explain_data = cursor.explain()
-    pprint(
-        to_native(explain_data)
-    )
+    return to_native(cursor.explain())
+
+
+def print_cursor_explain(cursor):
+    pprint(get_cursor_explain(cursor))
+
+
+def get_plan_stages(plan):
+    """
+    :return: (stage, index name) of every stage of an explain winning plan
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append((plan["stage"], plan.get("indexName")))
+        for key in ("inputStage", "queryPlan"):  # queryPlan is the plan of the slot based engine
+            stages.extend(get_plan_stages(plan.get(key)))
+        for child in plan.get("inputStages", []):
+            stages.extend(get_plan_stages(child))
+        for shard in plan.get("shards", []):
+            stages.extend(get_plan_stages(shard.get("winningPlan")))
+    return stages
 
 
 #  mongodb
@@ -42,6 +94,78 @@ class MongodbResourceConflict(Exception):
     """
 
 
+class QueryPlanError(Exception):
+    """
+    A listing query doesn't use the index it's pinned to (see BaseCollection.listing_queries)
+    or its shape isn't registered at all.
+    Only raised with mongodb.query_checks, so a changed filter fails the tests instead of becoming a COLLSCAN
+    """
+
+
+class ListingQuery:
+    """
+    Shape of a listing query pinned to the index it's meant to use.
+    A partial index is only used by the queries that have its partialFilterExpression,
+    so the query has to have exactly these filter values, the fields (index keys)
+    and no other filters than optional_fields (the sort field and _id can always be filtered)
+    """
+
+    def __init__(self, index, sort, filters=None, fields=(), optional_fields=()):
+        self.index = index
+        self.sort = sort
+        self.filters = filters or {}
+        self.fields = set(self.filters) | set(fields)
+        self.optional_fields = set(optional_fields)
+
+    def matches(self, filters, sort):
+        names = set(filters) - {self.sort, "_id"}
+        return (
+            sort == self.sort
+            and self.fields <= names <= self.fields | self.optional_fields
+            and all(
+                filters[name] == value and type(filters[name]) is type(value)
+                for name, value in self.filters.items()
+            )
+        )
+
+
+def get_listing_index(listing_queries, filters, sort):
+    """
+    :return: the index the query shape is pinned to, None if the shape isn't registered
+    """
+    for query in listing_queries:
+        if query.matches(filters, sort):
+            return query.index
+    return None
+
+
+def get_query_hints(settings):
+    """
+    Listing queries are sent with the hint of their index (see ListingQuery),
+    it's enabled once the indexes of a release have been applied
+    """
+    return asbool(os.environ.get("QUERY_HINTS", settings.get("mongodb.query_hints", False)))
+
+
+def is_bad_hint(error):
+    """
+    True if the query has failed because the index of its hint doesn't exist on the server
+    """
+    message = str(error)
+    return isinstance(error, OperationFailure) and "planner returned error" in message and "hint" in message
+
+
+def without_hint(query_options, error, collection):
+    """
+    :return: query_options without the hint if the error is caused by it, otherwise the error is raised
+    """
+    if "hint" not in query_options or not is_bad_hint(error):
+        raise error
+    LOGGER.warning(f"Index {query_options['hint']} of {collection.name} is missing, "
+                   f"the query is repeated without the hint: {error}")
+    return {k: v for k, v in query_options.items() if k != "hint"}
+
+
 class DecimalCodec(TypeCodec):
     python_type = Decimal    # the Python type acted upon by this type codec
     bson_type = Decimal128   # the BSON type acted upon by this type codec
@@ -57,65 +181,430 @@ class DecimalCodec(TypeCodec):
         return value.to_decimal()
 
 
+COMPRESSED_TEXT_SUBTYPE = 0x80  # the first user defined binary subtype
+
+
+class CompressedText:
+    """
+    A large text that is stored zlib compressed (see MongodbStore.compress_text).
+    Equals to its str value, so it can be compared with the loaded documents
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedText):
+            other = other.value
+        return self.value == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+class CompressedTextCodec(TypeCodec):
+    """
+    Compressed texts are decoded back to str on every read (including raw listings, on render),
+    other binary values are left as they are
+    """
+    python_type = CompressedText
+    bson_type = Binary
+
+    def transform_python(self, value):
+        return Binary(zlib.compress(value.value.encode()), COMPRESSED_TEXT_SUBTYPE)
+
+    def transform_bson(self, value):
+        if value.subtype == COMPRESSED_TEXT_SUBTYPE:
+            return zlib.decompress(value).decode()
+        return value
+
+
 type_registry = TypeRegistry([
     DecimalCodec(),
+    CompressedTextCodec(),
 ])
 codec_options = CodecOptions(type_registry=type_registry)
+raw_codec_options = codec_options.with_options(document_class=RawBSONDocument)
 COLLECTION_CLASSES = {}
 
 
+def decode_raw_document(doc):
+    """
+    Decodes RawBSONDocument (with all the nested ones) into a dict
+    """
+    return decode(doc.raw, codec_options=codec_options)
+
+
+def raw_document_json_adapter(doc, request):
+    return decode_raw_document(doc)
+
+
 def get_public_modified():
     public_modified = {"$divide": [{"$toLong": "$$NOW"}, 1000]}
     return public_modified
 
 
+def get_client_settings(settings):
+    """
+    Connection settings (environment variables take precedence over the ini ones)
+    :return: uri, MongoClient options, db name, get_database options
+    """
+    db_name = os.environ.get("DB_NAME", settings["mongodb.db_name"])
+    mongodb_uri = os.environ.get("MONGODB_URI", settings["mongodb.uri"])
+    max_pool_size = int(os.environ.get("MONGODB_MAX_POOL_SIZE", settings["mongodb.max_pool_size"]))
+    min_pool_size = int(os.environ.get("MONGODB_MIN_POOL_SIZE", settings["mongodb.min_pool_size"]))
+
+    # https://docs.mongodb.com/manual/core/causal-consistency-read-write-concerns/#causal-consistency-and-read-and-write-concerns
+    raw_read_preference = os.environ.get(
+        "READ_PREFERENCE",
+        settings.get("mongodb.read_preference", "SECONDARY_PREFERRED")
+    )
+    raw_w_concert = os.environ.get(
+        "WRITE_CONCERN",
+        settings.get("mongodb.write_concern", "majority")
+    )
+    raw_r_concern = os.environ.get(
+        "READ_CONCERN",
+        settings.get("mongodb.read_concern", "majority")
+    )
+    client_options = {
+        "maxPoolSize": max_pool_size,
+        "minPoolSize": min_pool_size,
+    }
+    # wire compression, e.g. "zstd,snappy,zlib" (zstd and snappy require the compression extra)
+    compressors = os.environ.get("MONGODB_COMPRESSORS", settings.get("mongodb.compressors"))
+    if compressors:
+        client_options["compressors"] = compressors
+    database_options = {
+        "read_preference": getattr(ReadPreference, raw_read_preference),
+        "write_concern": WriteConcern(w=int(raw_w_concert) if raw_w_concert.isnumeric() else raw_w_concert),
+        "read_concern": ReadConcern(level=raw_r_concern),
+        "codec_options": codec_options,
+    }
+    return mongodb_uri, client_options, db_name, database_options
+
+
+def select_servers(server_descriptions):
+    """
+    server_selector of the client, it's applied after the read preference.
+    Leaves only SERVER_SELECTION.only if it's set (see MongodbStore.kill_queries)
+    and drops SERVER_SELECTION.excluded (see MongodbStore.hedged_read)
+    """
+    only = getattr(SERVER_SELECTION, "only", None)
+    if only is not None:
+        return [server for server in server_descriptions if server.address == only]
+    excluded = getattr(SERVER_SELECTION, "excluded", None)
+    if excluded:
+        return [server for server in server_descriptions if server.address not in excluded]
+    return server_descriptions
+
+
+class ReadServers(CommandListener):
+    """
+    Adds the servers the commands of the current greenlet are sent to to SERVER_SELECTION.used if it's set.
+    Commands are published by the greenlet that sends them
+    """
+
+    def started(self, event):
+        used = getattr(SERVER_SELECTION, "used", None)
+        if used is not None:
+            used.add(event.connection_id)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+READ_SERVERS = ReadServers()
+
+
+def get_max_staleness(settings):
+    """
+    Max seconds a secondary can be behind the primary to be read from, by the read class,
+    mongodb requires at least 90 (0 means no limit)
+    """
+    return {
+        read_class: int(os.environ.get(
+            f"MAX_STALENESS_{read_class.upper()}",
+            settings.get(f"mongodb.max_staleness.{read_class}", settings.get("mongodb.max_staleness", 0))
+        ))
+        for read_class in READ_CLASSES
+    }
+
+
+def get_read_preference(read_preference, max_staleness):
+    if not max_staleness or read_preference.mode == ReadPreference.PRIMARY.mode:
+        return read_preference
+    return type(read_preference)(tag_sets=read_preference.tag_sets, max_staleness=max_staleness)
+
+
+def wait_for_replication(mongodb, max_lag):
+    """
+    Blocks while the secondaries are behind the primary more than max_lag seconds,
+    used by the bulk writes (migrations, index builds) to not make the secondary reads stale
+    """
+    while True:
+        lag = mongodb.get_replication_lag()
+        if lag is None or lag <= max_lag:
+            return
+        LOGGER.info(f"Replication lag {lag}s is more than {max_lag}s, waiting")
+        sleep(max(1, lag / 2))
+
+
+def get_store(settings):
+    """
+    :return: MongodbStore or MemoryStore if mongodb.uri is memory://
+    """
+    mongodb_uri = os.environ.get("MONGODB_URI", settings["mongodb.uri"])
+    if mongodb_uri.startswith(MEMORY_URI_SCHEME):
+        from openprocurement.audit.api.memory import MemoryStore
+        return MemoryStore(settings)
+    return MongodbStore(settings)
+
+
 class MongodbStore:
 
     def __init__(self, settings):
-        db_name = os.environ.get("DB_NAME", settings["mongodb.db_name"])
-        mongodb_uri = os.environ.get("MONGODB_URI", settings["mongodb.uri"])
-        max_pool_size = int(os.environ.get("MONGODB_MAX_POOL_SIZE", settings["mongodb.max_pool_size"]))
-        min_pool_size = int(os.environ.get("MONGODB_MIN_POOL_SIZE", settings["mongodb.min_pool_size"]))
-
-        # https://docs.mongodb.com/manual/core/causal-consistency-read-write-concerns/#causal-consistency-and-read-and-write-concerns
-        raw_read_preference = os.environ.get(
-            "READ_PREFERENCE",
-            settings.get("mongodb.read_preference", "SECONDARY_PREFERRED")
-        )
-        raw_w_concert = os.environ.get(
-            "WRITE_CONCERN",
-            settings.get("mongodb.write_concern", "majority")
-        )
-        raw_r_concern = os.environ.get(
-            "READ_CONCERN",
-            settings.get("mongodb.read_concern", "majority")
-        )
-        self.connection = MongoClient(
-            mongodb_uri,
-            maxPoolSize=max_pool_size,
-            minPoolSize=min_pool_size,
-        )
-        self.database = self.connection.get_database(
-            db_name,
-            read_preference=getattr(ReadPreference, raw_read_preference),
-            write_concern=WriteConcern(w=int(raw_w_concert) if raw_w_concert.isnumeric() else raw_w_concert),
-            read_concern=ReadConcern(level=raw_r_concern),
-            codec_options=codec_options,
-        )
+        # 1 means every id is taken from the db, so numbering has no gaps
+        # with N every worker reserves N ids in one request and hands them out locally,
+        # unused ids of a block are lost on restart and ids of different workers interleave
+        self.sequence_block_size = int(os.environ.get(
+            "SEQUENCE_BLOCK_SIZE",
+            settings.get("mongodb.sequence_block_size", 1)
+        ))
+        self.sequence_blocks = {}
+        self.sequence_lock = Lock()
+        # update only the changed fields instead of replacing the whole document
+        # (see get_update_pipeline)
+        self.partial_updates = asbool(os.environ.get(
+            "PARTIAL_UPDATES",
+            settings.get("mongodb.partial_updates", False)
+        ))
+        # documents loaded by write requests are read with the read preference (usually from a secondary)
+        # instead of the primary, see BaseCollection.get
+        self.secondary_reads_for_writes = asbool(os.environ.get(
+            "SECONDARY_READS_FOR_WRITES",
+            settings.get("mongodb.secondary_reads_for_writes", False)
+        ))
+        # large text fields are stored compressed, they can't be queried or indexed then
+        self.compressed_text_fields = set(aslist(os.environ.get(
+            "COMPRESSED_TEXT_FIELDS",
+            settings.get("mongodb.compressed_text_fields", "")
+        )))
+        self.compressed_text_min_size = int(os.environ.get(
+            "COMPRESSED_TEXT_MIN_SIZE",
+            settings.get("mongodb.compressed_text_min_size", 4096)
+        ))
+        self.max_staleness = get_max_staleness(settings)
+        # seconds after which a listing read from a secondary is sent to the nearest member as well,
+        # the first result is used (0 disables hedged reads)
+        self.hedge_delay = float(os.environ.get(
+            "HEDGE_DELAY",
+            settings.get("mongodb.hedge_delay", 0)
+        ))
+        self.query_hints = get_query_hints(settings)
+        # development check of the plan of every listing query (an explain before the query, see check_query)
+        self.query_checks = asbool(os.environ.get(
+            "QUERY_CHECKS",
+            settings.get("mongodb.query_checks", False)
+        ))
+        self.connection, self.database = self.connect(settings)
+
+        REPLICATION_LAG.func = self.get_members_lag
 
         # code related to specific packages, like:
         # store.plans.get(uid) or store.tenders.save(doc) or store.tenders.count(filters)
         for name, cls in COLLECTION_CLASSES.items():
             setattr(self, name, cls(self, settings))
 
+    @staticmethod
+    def connect(settings):
+        """
+        :return: client, database
+        """
+        mongodb_uri, client_options, db_name, database_options = get_client_settings(settings)
+        connection = MongoClient(
+            mongodb_uri,
+            event_listeners=[CONNECTION_POOL_METRICS, READ_SERVERS],
+            server_selector=select_servers,
+            **client_options
+        )
+        return connection, connection.get_database(db_name, **database_options)
+
+    def get_replication_lag(self):
+        """
+        :return: seconds the most lagging secondary is behind the primary,
+        None if the replica set status is not available
+        """
+        try:
+            status = self.connection.admin.command("replSetGetStatus")
+        except PyMongoError as e:
+            LOGGER.debug(f"Can't get replica set status: {e}")
+            return None
+        optimes = {}
+        for member in status["members"]:
+            optimes.setdefault(member["stateStr"], []).append(member["optimeDate"])
+        if not optimes.get("PRIMARY") or not optimes.get("SECONDARY"):
+            return 0
+        primary = optimes["PRIMARY"][0]
+        return max((primary - secondary).total_seconds() for secondary in optimes["SECONDARY"])
+
+    def get_members_lag(self):
+        """
+        Unlike get_replication_lag, doesn't send any commands: the lag is estimated by the client
+        from the last heartbeats the same way it's done for maxStalenessSeconds
+        :return: {(address,): seconds} for every secondary
+        """
+        servers = self.connection.topology_description.server_descriptions().values()
+        primary = next((s for s in servers if s.server_type == SERVER_TYPE.RSPrimary), None)
+        if primary is None or primary.last_write_date is None:
+            return {}
+        return {
+            ("{}:{}".format(*server.address),): max(0, (primary.last_write_date - server.last_write_date).total_seconds())
+            for server in servers
+            if server.server_type == SERVER_TYPE.RSSecondary and server.last_write_date is not None
+        }
+
+    def get_read_preference(self, read_class):
+        return get_read_preference(self.database.read_preference, self.max_staleness.get(read_class))
+
+    def hinted_read(self, collection, read, query_options):
+        """
+        hedged_read of read(collection, session, query_options). If the index of the hint doesn't exist
+        (the indexes of the release haven't been applied), the read is repeated without the hint,
+        so a missing index makes the listing slower instead of failing it
+        """
+        try:
+            return self.hedged_read(collection, lambda c, session: read(c, session, query_options))
+        except OperationFailure as e:
+            options = without_hint(query_options, e, collection)
+        return self.hedged_read(collection, lambda c, session: read(c, session, options))
+
+    def hedged_read(self, collection, read):
+        """
+        Runs read(collection, session). If it hasn't finished in hedge_delay, the same read is sent
+        to the nearest member with the same tags and max staleness (see get_hedge_read_preference)
+        except the one the first read has been sent to, and the result that comes first is returned.
+        The read isn't hedged if there is no other member to send it to.
+        Every read has its own session advanced to the request one, as a session can't be used concurrently,
+        the slower read is left to finish in background (it's limited by the query max_time_ms)
+        """
+        session = get_db_session()
+        if not self.hedge_delay or collection.read_preference.mode == ReadPreference.PRIMARY.mode:
+            return read(collection, session)
+
+        used = set()
+        reads = [spawn(self.read_in_session, read, collection, session, used=used)]
+        reads[0].join(self.hedge_delay)
+        if not reads[0].ready():
+            excluded = frozenset(used)
+            hedge = collection.with_options(read_preference=self.get_hedge_read_preference(collection.read_preference))
+            if self.get_hedge_servers(hedge.read_preference, excluded):
+                HEDGED_READS.inc("sent")
+                reads.append(spawn(self.read_in_session, read, hedge, session, excluded=excluded))
+        for greenlet in iwait(reads):
+            if greenlet.successful():
+                break
+        else:
+            return reads[0].get()  # both have failed, raises the error of the first one
+        if greenlet is not reads[0]:
+            HEDGED_READS.inc("won")
+        result, read_session = greenlet.value
+        if session is not None:
+            session.advance_cluster_time(read_session.cluster_time)
+            session.advance_operation_time(read_session.operation_time)
+        return result
+
+    @staticmethod
+    def get_hedge_read_preference(read_preference):
+        """
+        Any member that the first read could use, or the primary, is picked by latency, so the slow reads
+        are spread over the replica set instead of all of them being moved to the primary,
+        and the data isn't staler than the first read allows
+        """
+        return Nearest(tag_sets=read_preference.tag_sets, max_staleness=read_preference.max_staleness)
+
+    def get_hedge_servers(self, read_preference, excluded):
+        """
+        :return: the members a hedged read can be sent to, as the client waits for a server that can be selected
+        """
+        return self.connection.topology_description.apply_selector(
+            read_preference,
+            custom_selector=lambda servers: [server for server in servers if server.address not in excluded],
+        )
+
+    @staticmethod
+    def check_query(collection, filters, sort, index, hint=None):
+        """
+        Raises QueryPlanError if the query isn't sent to the index (sorted by it) it's pinned to.
+        Without the hint this is the index the planner chooses
+        """
+        if index is None:
+            raise QueryPlanError(
+                f"{collection.name} query with {sorted(filters)} filters sorted by {sort} "
+                f"isn't pinned to an index, add it to the listing_queries"
+            )
+        try:
+            explain = get_cursor_explain(collection.find(filters, sort=((sort, ASCENDING),), hint=hint))
+        except PyMongoError as e:
+            raise QueryPlanError(f"{collection.name} query pinned to {index} has failed: {e}")
+        plan = explain["queryPlanner"]["winningPlan"]
+        stages = get_plan_stages(plan)
+        if ("IXSCAN", index) not in stages or any(stage in ("COLLSCAN", "SORT") for stage, _ in stages):
+            raise QueryPlanError(
+                f"{collection.name} query with {sorted(filters)} filters sorted by {sort} "
+                f"doesn't use {index}:\n{pformat(plan)}"
+            )
+
+    def read_in_session(self, read, collection, session, used=None, excluded=None):
+        """
+        Runs read in its own greenlet, its servers are added to used and it isn't sent to the excluded ones
+        """
+        SERVER_SELECTION.used = used
+        SERVER_SELECTION.excluded = excluded
+        try:
+            if session is None:
+                return read(collection, None), None
+            with self.connection.start_session(causal_consistency=True) as read_session:
+                if session.cluster_time is not None:
+                    read_session.advance_cluster_time(session.cluster_time)
+                if session.operation_time is not None:
+                    read_session.advance_operation_time(session.operation_time)
+                result = read(collection, read_session)
+            return result, read_session
+        finally:
+            SERVER_SELECTION.used = None
+            SERVER_SELECTION.excluded = None
+
     def get_sequences_collection(self):
         return self.database.sequences
 
     def get_next_sequence_value(self, uid):
+        if self.sequence_block_size <= 1:
+            return self.allocate_sequence_values(uid, 1)
+
+        with self.sequence_lock:
+            block = self.sequence_blocks.get(uid)
+            if block is None or block[0] > block[1]:
+                last = self.allocate_sequence_values(uid, self.sequence_block_size)
+                block = self.sequence_blocks[uid] = [last - self.sequence_block_size + 1, last]
+            value = block[0]
+            block[0] += 1
+            return value
+
+    @timed("db")
+    def allocate_sequence_values(self, uid, count):
+        """
+        Reserves count values of the sequence
+        :return: the last reserved value
+        """
         collection = self.get_sequences_collection()
         result = collection.find_one_and_update(
             {'_id': uid},
-            {"$inc": {"value": 1}},
+            {"$inc": {"value": count}},
             return_document=ReturnDocument.AFTER,
             upsert=True,
             session=get_db_session(),
@@ -125,6 +614,8 @@ class MongodbStore:
     def flush_sequences(self):
         collection = self.get_sequences_collection()
         self.flush(collection)
+        with self.sequence_lock:
+            self.sequence_blocks.clear()
 
     @staticmethod
     def get_next_rev(current_rev=None):
@@ -143,44 +634,146 @@ class MongodbStore:
         return next_rev
 
     @staticmethod
-    def get(collection, uid):
+    @timed("db")
+    def get(collection, uid, projection=None):
         res = collection.find_one(
             {'_id': uid},
-            projection={"is_public": False, "is_test": False},
+            projection=projection or DEFAULT_PROJECTION,
             session=get_db_session(),
+            **get_query_options()
         )
         return res
 
-    def list(self, collection, fields, offset_field="_id", offset_value=None, descending=False, limit=0, filters=None):
+    @timed("db")
+    def list(self, collection, fields, offset_field="_id", offset_value=None, descending=False, limit=0, filters=None,
+             raw=False, hint=None):
+        """
+        :param raw: if True, every result is a RawBSONDocument
+        with "data" (built by projection from "id" and fields), offset_field and "restricted".
+        "data" is not decoded here, it's left for the renderer (see raw_document_json_adapter)
+        """
         filters = filters or {}
         if offset_value:
             filters[offset_field] = {"$lt" if descending else "$gt": offset_value}
-        results = list(collection.find(
+        if raw:
+            collection = collection.with_options(codec_options=raw_codec_options)
+        projection = self.get_list_projection(fields, offset_field, raw)
+        # read options are taken here, as the context isn't available in hedged reads greenlets
+        query_options = get_query_options()
+        if hint:
+            query_options["hint"] = hint
+        results = self.hinted_read(collection, lambda c, session, options: list(c.find(
             filter=filters,
-            projection={f: 1 for f in fields | {offset_field}},
+            projection=projection,
             limit=limit,
             sort=((offset_field, DESCENDING if descending else ASCENDING),),
-            session=get_db_session(),
-        ))
-        for e in results:
-            self.rename_id(e)
+            session=session,
+            **options
+        )), query_options)
+        if not raw:
+            for e in results:
+                self.rename_id(e)
         return results
 
-    def save_data(self, collection, data, insert=False, modified=True):
-        uid = data.pop("id" if "id" in data else "_id")
-        revision = data.pop("rev" if "rev" in data else "_rev", None)
+    @staticmethod
+    def get_list_projection(fields, offset_field, raw=False):
+        if raw:
+            return {
+                "_id": 0,
+                "restricted": 1,
+                offset_field: 1,
+                "data": {"id": "$_id", **{f: f"${f}" for f in fields}},
+            }
+        return {f: 1 for f in fields | {offset_field}}
 
-        data['_id'] = uid
-        data["_rev"] = self.get_next_rev(revision)
-        data["is_test"] = data.get("mode") == "test"
-        if "is_masked" in data and data.get("is_masked") is not True:
-            data.pop("is_masked")
+    @staticmethod
+    def get_changes_pipeline(fields=()):
+        """
+        Inserts and updates with only the fields the long-poll waiters are matched by (see ChangeWaiters),
+        the documents aren't looked up
+        """
+        return [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {
+                "operationType": 1,
+                "clusterTime": 1,
+                "documentKey": 1,
+                **{f"fullDocument.{f}": 1 for f in fields},
+                **{f"updateDescription.updatedFields.{f}": 1 for f in fields},
+            }},
+        ]
 
+    def kill_queries(self, comment):
+        """
+        Kills the running operations of a request by their comment (see timeouts.get_query_comment)
+        on every member, as reads can be sent to any of them. It's run by another greenlet on other
+        pooled connections, the killed operation fails on its own connection, that stays usable
+        :return: the number of killed operations
+        """
+        admin = self.connection.get_database("admin", read_preference=ReadPreference.NEAREST)
         pipeline = [
-            {"$replaceWith": {"$literal": data}},
+            {"$currentOp": {}},
+            {"$match": {"$or": [{"command.comment": comment}, {"cursor.originatingCommand.comment": comment}]}},
+            {"$project": {"opid": 1}},
         ]
+        killed = 0
+        for server in self.connection.topology_description.server_descriptions().values():
+            if not server.is_readable:
+                continue
+            SERVER_SELECTION.only = server.address
+            try:
+                for operation in admin.aggregate(pipeline):
+                    admin.command("killOp", op=operation["opid"], read_preference=ReadPreference.NEAREST)
+                    killed += 1
+            except PyMongoError as e:
+                LOGGER.warning(f"Queries {comment} on {server.address} weren't killed: {e}")
+            finally:
+                SERVER_SELECTION.only = None
+        return killed
+
+    @contextmanager
+    def transaction(self, collection):
+        """
+        Runs the writes of the block in one transaction of the request session
+        (or of a new one outside of requests), they are all applied on exit or none of them.
+        A write conflict with another transaction is MongodbResourceConflict, the same as a changed _rev
+        :param collection: the collection a conflict is counted for
+        """
+        session = get_db_session()
+        if session is None:
+            with self.connection.start_session(causal_consistency=True) as session:
+                set_db_session(session)
+                try:
+                    with self.transaction(collection):
+                        yield
+                finally:
+                    set_db_session(None)
+            return
+        try:
+            with session.start_transaction(write_concern=self.database.write_concern):
+                yield
+        except PyMongoError as e:
+            if e.has_error_label("TransientTransactionError"):
+                CONFLICTS.inc(collection.name)
+                raise MongodbResourceConflict("Conflict while updating document. Please, retry")
+            raise
+
+    @timed("db")
+    def save_data(self, collection, data, insert=False, modified=True, src=None):
+        """
+        :param src: the stored version of the document (with the _rev that data is based on).
+        If passed, only the changed fields are sent instead of the whole document
+        """
+        uid, revision, stored = self.prepare_data(data, modified=modified)
+        if src is not None and not insert:
+            pipeline = self.get_update_pipeline(src, stored)
+        else:
+            pipeline = [
+                # revisions are stored in the revisions collection and aren't read with the document,
+                # the ones that haven't been moved there yet by the migration are kept as is
+                {"$replaceWith": {"$mergeObjects": [{"revisions": "$revisions"}, {"$literal": stored}]}},
+            ]
         if modified:
-            data["dateModified"] = get_now().isoformat()
             pipeline.append(
                 {"$set": {
                     "public_modified": get_public_modified()
@@ -199,15 +792,94 @@ class MongodbStore:
             if insert:
                 pass  # it's fine, when upsert=True works and document is created it's not returned by default
             else:
+                CONFLICTS.inc(collection.name)
                 raise MongodbResourceConflict("Conflict while updating document. Please, retry")
         return data
 
+    def prepare_data(self, data, modified=True):
+        """
+        Sets _id, the next _rev, is_test and dateModified of data in place
+        :return: id, the revision data is based on, the document to store
+        """
+        uid = data.pop("id" if "id" in data else "_id")
+        revision = data.pop("rev" if "rev" in data else "_rev", None)
+
+        data['_id'] = uid
+        data["_rev"] = self.get_next_rev(revision)
+        data["is_test"] = data.get("mode") == "test"
+        if "is_masked" in data and data.get("is_masked") is not True:
+            data.pop("is_masked")
+        if modified:
+            data["dateModified"] = get_now().isoformat()
+
+        stored = self.compress_text(data) if self.compressed_text_fields else data
+        return uid, revision, stored
+
+    def compress_text(self, data):
+        """
+        :return: a copy of data with the long values of compressed_text_fields (at any level) as CompressedText
+        """
+        if isinstance(data, dict):
+            return {
+                k: CompressedText(v)
+                if k in self.compressed_text_fields and isinstance(v, str) and len(v) >= self.compressed_text_min_size
+                else self.compress_text(v)
+                for k, v in data.items()
+            }
+        if isinstance(data, list):
+            return [self.compress_text(i) for i in data]
+        return data
+
+    @classmethod
+    def get_update_pipeline(cls, src, data):
+        """
+        Update of the fields that differ between src and data.
+        Lists that only have new items appended (like posts or documents) are extended with them,
+        changed items of a list are replaced one by one.
+        The update is guarded by _rev, so the document being updated is exactly src
+        """
+        changes = {}
+        for name, value in data.items():
+            if name not in ("_id", "public_modified") and src.get(name, NOT_SET) != value:
+                changes[name] = cls.get_field_update(name, src.get(name, NOT_SET), value)
+        pipeline = [{"$set": changes}]
+        removed = [name for name in src if name not in data and name not in ("_id", "public_modified")]
+        if removed:
+            pipeline.append({"$unset": removed})
+        return pipeline
+
+    @staticmethod
+    def get_field_update(name, old, new):
+        if not isinstance(old, list) or not isinstance(new, list) or len(old) > len(new):
+            return {"$literal": new}
+        changed = [i for i, item in enumerate(old) if item != new[i]]
+        if len(changed) > len(old) // 2:
+            return {"$literal": new}
+        value = f"${name}"
+        if changed:
+            value = {"$map": {
+                "input": {"$range": [0, len(old)]},
+                "as": "i",
+                "in": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$$i", i]}, "then": {"$literal": new[i]}}
+                        for i in changed
+                    ],
+                    "default": {"$arrayElemAt": [value, "$$i"]},
+                }},
+            }}
+        appended = new[len(old):]
+        if appended:
+            value = {"$concatArrays": [value, {"$literal": appended}]}
+        return value
+
     @staticmethod
     def flush(collection):
         result = collection.delete_many({})
         return result
 
     @staticmethod
+    @timed("db")
     def delete(collection, uid):
         result = collection.delete_one({"_id": uid}, session=get_db_session())
         return result
@@ -219,9 +891,259 @@ class MongodbStore:
         return obj
 
 
+def get_resume_token_time(token):
+    """
+    :return: cluster time of a change stream resume token (the position of the stream), None if it's unknown.
+    The token data is a hex KeyString that starts with the Timestamp type byte (130) and its 8 bytes
+    """
+    data = token.get("_data") if isinstance(token, dict) else None
+    if not isinstance(data, str) or len(data) < 18 or not data.startswith("82"):
+        return None
+    value = int(data[2:18], 16)
+    return Timestamp(value >> 32, value & 0xFFFFFFFF)
+
+
+class CountCache:
+    """
+    Counts by key kept for ttl seconds (0 disables the cache). After that the stale count is still returned
+    while the new one is being counted, only the first request that finds it stale refreshes it,
+    so only the very first count of a key waits for the db.
+    Shared by the blocking and the asyncio counts (see MonitoringCollection.count and the monitoring asgi plugin)
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.data = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        :return: the count (None if it hasn't been counted yet)
+        and True if the caller has to refresh it in background
+        """
+        cached = self.data.get(key)
+        if cached is None:
+            return None, False
+        count, updated = cached
+        if time() - updated <= self.ttl:
+            return count, False
+        with self.lock:
+            if self.data.get(key) is not cached:  # being refreshed by another request
+                return count, False
+            # the next requests don't start another refresh
+            self.data[key] = (count, time())
+        return count, True
+
+    def set(self, key, count):
+        self.data[key] = (count, time())
+
+    def clear(self):
+        self.data.clear()
+
+
+class DocumentCache:
+    """
+    LRU cache of encoded documents by _id, kept valid by the change stream of the collection
+    (see BaseCollection.watch_cache_invalidations) instead of checking the document in db on every read:
+     - an entry is dropped when the stream or a save of this process reports a change of the document
+     - documents are only cached while the stream runs, the cache is cleared whenever it stops or restarts
+     - an entry is stored only if the document hasn't changed since its read has started (see start_read)
+     - stream_time is the cluster time all the changes up to have been applied,
+       misses are read at least at that time, so no change between the two is missed
+
+    The cost is that a change made through another process is seen after the stream delivers it.
+    The requests of a session that is newer than stream_time (its client has just written,
+    maybe through another worker) aren't served from the cache, so they still read their writes
+    """
+
+    def __init__(self, size, name=""):
+        self.size = size
+        self.name = name
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.active = False
+        self.stream_time = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def is_fresh_for(self, operation_time):
+        """
+        :return: True if a session that has seen operation_time can be served from the cache
+        """
+        if not self.active:
+            return False
+        if operation_time is None:
+            return True
+        stream_time = self.stream_time
+        return stream_time is not None and operation_time <= stream_time
+
+    def get(self, uid):
+        with self.lock:
+            entry = self.data.get(uid)
+            if not isinstance(entry, bytes):  # missing or being read
+                DOCUMENT_CACHE_READS.inc(self.name, "miss")
+                return None
+            self.data.move_to_end(uid)
+        DOCUMENT_CACHE_READS.inc(self.name, "hit")
+        return entry
+
+    def start_read(self, uid):
+        """
+        :return: a lease that is dropped, as an entry would be, if the document is changed before set
+        """
+        lease = object()
+        with self.lock:
+            if not self.active:
+                return None
+            self.data[uid] = lease
+            self.evict()
+        return lease
+
+    def set(self, uid, lease, raw):
+        with self.lock:
+            if lease is not None and self.data.get(uid) is lease:
+                self.data[uid] = raw
+
+    def evict(self):
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def invalidate(self, uid):
+        with self.lock:
+            self.data.pop(uid, None)
+
+    def advance(self, stream_time):
+        if stream_time is not None and (self.stream_time is None or stream_time > self.stream_time):
+            self.stream_time = stream_time
+
+    def activate(self, stream_time):
+        with self.lock:
+            self.data.clear()  # the leases of the reads that have started before the stream
+            self.stream_time = stream_time
+            self.active = True
+
+    def deactivate(self):
+        with self.lock:
+            self.active = False
+            self.stream_time = None
+            self.data.clear()  # changes could have been missed
+
+
+CHANGE_OPERATORS = {
+    "$gt": lambda value, limit: value > limit,
+    "$gte": lambda value, limit: value >= limit,
+    "$lt": lambda value, limit: value < limit,
+    "$lte": lambda value, limit: value <= limit,
+}
+
+
+def change_matches(change, filters):
+    """
+    :return: False only if a field of the change (see MongodbStore.get_changes_pipeline) doesn't match filters.
+    The fields that aren't in the change and the conditions that can't be checked are taken as matching,
+    a false wake up costs one listing query
+    """
+    fields = change.get("fullDocument") or change.get("updateDescription", {}).get("updatedFields") or {}
+    for key, condition in filters.items():
+        if key not in fields:
+            continue
+        value = fields[key]
+        conditions = condition.items() if isinstance(condition, dict) else (("$eq", condition),)
+        for operator, expected in conditions:
+            try:
+                if operator == "$eq":
+                    matches = expected in value if isinstance(value, list) else value == expected
+                elif operator in CHANGE_OPERATORS:
+                    matches = CHANGE_OPERATORS[operator](value, expected)
+                else:
+                    continue
+            except TypeError:
+                continue
+            if not matches:
+                return False
+    return True
+
+
+class ChangeWaiters:
+    """
+    Long-poll requests waiting for changes of a collection. They're woken by the one change stream
+    of the collection per process (see BaseCollection.watch_changes and AsyncCollection.watch_changes)
+    instead of a stream per waiting request.
+
+    A waiter's listing has been read at the operation time of its session, the changes since then
+    have to wake it even if the stream has delivered them before the waiter is added. So the recent changes
+    are kept, and a waiter that is older than all of them (or than the stream) is woken right away
+    """
+
+    def __init__(self, event_class, start_time=None, size=1000):
+        """
+        :param event_class: threading.Event or asyncio.Event, depending on who waits
+        :param start_time: the cluster time the stream starts at
+        """
+        self.event_class = event_class
+        self.waiters = {}
+        self.recent = deque(maxlen=size)
+        self.start_time = start_time
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.waiters)
+
+    def add(self, filters, operation_time=None):
+        """
+        :return: the event that's set when a change matching filters happens
+        """
+        event = self.event_class()
+        with self.lock:
+            if self.missed(filters, operation_time):
+                event.set()
+            self.waiters[event] = filters
+        return event
+
+    def remove(self, event):
+        with self.lock:
+            self.waiters.pop(event, None)
+
+    def missed(self, filters, operation_time):
+        if operation_time is None or self.start_time is None:
+            return False
+        if operation_time < self.start_time:
+            return True
+        if len(self.recent) == self.recent.maxlen and self.recent[0].get("clusterTime", operation_time) > operation_time:
+            return True
+        return any(
+            change.get("clusterTime", operation_time) > operation_time and change_matches(change, filters)
+            for change in self.recent
+        )
+
+    def notify(self, change):
+        with self.lock:
+            self.recent.append(change)
+            for event, filters in self.waiters.items():
+                if change_matches(change, filters):
+                    event.set()
+
+    def restart(self, start_time):
+        """
+        The stream has been reopened, the changes in between could have been missed, so everybody is woken
+        """
+        with self.lock:
+            self.recent.clear()
+            self.start_time = start_time
+            for event in self.waiters:
+                event.set()
+
+
 class BaseCollection:
 
     object_name = "dummy"
+    cacheable = True
+    # ListingQuery of every shape of list and paging_list queries, see get_hint
+    listing_queries = ()
+    # the fields of the changes long-poll waiters are matched by (see ChangeWaiters),
+    # a change that has none of them wakes everybody
+    change_fields = ("is_test", "public_modified")
 
     def __init__(self, store, settings):
         self.store = store
@@ -232,43 +1154,240 @@ class BaseCollection:
             self.collection_primary = self.collection
         else:
             self.collection_primary = self.collection.with_options(read_preference=ReadPreference.PRIMARY)
-        self.create_indexes()
+        self.read_collections = {
+            read_class: self.collection.with_options(read_preference=store.get_read_preference(read_class))
+            for read_class in READ_CLASSES
+        }
+        # indexes are managed by openprocurement.audit.api.indexes,
+        # creating them at every worker start is only for development and tests
+        if asbool(os.environ.get("CREATE_INDEXES", settings.get("mongodb.create_indexes", False))):
+            self.create_indexes()
+
+        self.change_waiters = None
+        self.change_waiters_lock = Lock()
+
+        cache_size = int(os.environ.get("DOCUMENT_CACHE_SIZE", settings.get("mongodb.document_cache_size", 0)))
+        self.cache = None
+        if cache_size and self.cacheable:
+            self.start_cache(DocumentCache(cache_size, self.object_name))
+
+    def start_cache(self, cache):
+        self.cache = DOCUMENT_CACHES[self.object_name] = cache
+        Thread(target=self.watch_cache_invalidations, args=(cache,), daemon=True).start()
+
+    def stop_cache(self):
+        self.cache = None
+        DOCUMENT_CACHES.pop(self.object_name, None)
+
+    def watch_cache_invalidations(self, cache):
+        """
+        Evicts changed documents from the cache as soon as they're saved by any process
+        and moves cache.stream_time along the stream (empty batches move it too), see DocumentCache.
+        Runs until the cache is replaced
+        """
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}},
+            {"$project": {"documentKey": 1}},
+        ]
+        while self.cache is cache:
+            try:
+                with self.collection.watch(pipeline, max_await_time_ms=1000) as stream:
+                    cache.activate(get_resume_token_time(getattr(stream, "resume_token", None)))
+                    while stream.alive and self.cache is cache:
+                        change = stream.try_next()
+                        if change is not None:
+                            cache.invalidate(change["documentKey"]["_id"])
+                        cache.advance(get_resume_token_time(getattr(stream, "resume_token", None)))
+            except PyMongoError as e:
+                LOGGER.warning(f"Document cache invalidation stream of {self.object_name} failed: {e}")
+                sleep(1)
+            finally:
+                cache.deactivate()
 
     def get_indexes(self):
         return []
 
     def create_indexes(self):
         indexes = self.get_indexes()
-        # self.collection.drop_indexes()
-        # index management probably shouldn't be a part of api initialization
-        # a command like `migrate_db` could be called once per release
-        # that can manage indexes and data migrations
-        # for now I leave it here
         if indexes:
             self.collection.create_indexes(indexes)
 
+    def get_hint(self, filters, sort):
+        """
+        :return: the index the listing query is pinned to (see listing_queries),
+        None if the shape isn't registered or hints are disabled
+        """
+        index = get_listing_index(self.listing_queries, filters, sort)
+        if self.store.query_checks:
+            hint = index if self.store.query_hints else None
+            self.store.check_query(self.read_collections["listing"], filters, sort, index, hint=hint)
+        return index if self.store.query_hints else None
+
     def save(self, o, insert=False, modified=True):
         data = o.to_primitive()
-        updated = self.store.save_data(self.collection, data, insert=insert, modified=modified)
+        updated = self.save_data(data, insert=insert, modified=modified)
         o.import_data(updated)
 
-    def get(self, uid):
-        # if a client doesn't use SESSION cookie
-        # reading from primary solves the issues
-        # when write operation is allowed because of a state object from a secondary replica
-        # This means more reads from Primary, but at the moment we can't force everybody to use the cookie
-        collection = (
-            self.collection
-            if getattr(get_request(), "method", None) in ("GET", "HEAD")
-            else self.collection_primary
-        )
-        doc = self.store.get(collection, uid)
+    def save_data(self, data, insert=False, modified=True):
+        revisions = data.pop("revisions", None)
+        # a document is compared with the version it's been loaded as only once,
+        # the next save of it in the same request replaces it
+        src = self.get_sources().pop(data.get("id") or data.get("_id"), None) if self.store.partial_updates else None
+        if not revisions:
+            updated = self.store.save_data(self.collection, data, insert=insert, modified=modified, src=src)
+        else:
+            # the document and its revisions are saved together or not at all
+            with self.store.transaction(self.collection):
+                updated = self.store.save_data(self.collection, data, insert=insert, modified=modified, src=src)
+                # documents are read without revisions, so these are only the ones added by the request
+                self.store.revision.insert(self.object_name, updated["_id"], revisions)
+        if self.cache is not None:
+            self.cache.invalidate(updated["_id"])
+        return updated
+
+    @timed("db")
+    def get(self, uid, projection=None):
+        """
+        :param projection: only these fields are loaded by read requests (a document that is going to be saved
+        is always loaded whole). Ignored if the document cache is enabled, the cache keeps whole documents
+        """
+        is_read = getattr(get_request(), "method", None) in ("GET", "HEAD")
+        if is_read or self.store.secondary_reads_for_writes:
+            # reads of the causally consistent session (see DBSessionCookieMiddleware) are sent
+            # with afterClusterTime, so a secondary waits until it has the client's previous writes.
+            # Without the SESSION cookie the document can be stale, then the save fails on the _rev filter
+            # with 409 and the retry comes with the cookie that has the operation time of the failed write
+            collection = self.read_collections["object"] if is_read else self.collection
+        else:
+            # if a client doesn't use SESSION cookie
+            # reading from primary solves the issues
+            # when write operation is allowed because of a state object from a secondary replica
+            # This means more reads from Primary, but at the moment we can't force everybody to use the cookie
+            collection = self.collection_primary
+        doc = self.get_from(collection, uid, projection=(projection or READ_PROJECTION) if is_read else None)
+        if doc is None and not is_read and collection is not self.collection_primary:
+            # created by a previous request without the cookie and not replicated yet
+            doc = self.get_from(self.collection_primary, uid)
+        if doc is not None and not is_read and self.store.partial_updates:
+            self.set_source(doc)
         return doc
 
+    def get_from(self, collection, uid, projection=None):
+        # only reads are served from the cache, a document that is going to be saved is always read from db
+        if self.cache is not None and collection is self.read_collections["object"]:
+            return self.get_cached(collection, uid, projection=projection)
+        return self.store.get(collection, uid, projection=projection)
+
+    @staticmethod
+    def get_sources():
+        request = get_request()
+        if request is None:
+            return {}
+        return request.validated.setdefault("db_sources", {})
+
+    def set_source(self, doc):
+        """
+        Keeps a copy of the loaded document to find out what's changed on save.
+        Bson round trip is the fastest deep copy we have here
+        """
+        self.get_sources()[doc["_id"]] = decode(encode(doc, codec_options=codec_options), codec_options=codec_options)
+
+    def get_cached(self, collection, uid, projection=None):
+        cache = self.cache
+        session = get_db_session()
+        if not cache.is_fresh_for(getattr(session, "operation_time", None)):
+            DOCUMENT_CACHE_READS.inc(cache.name, "bypass")
+            return self.store.get(collection, uid, projection=projection)
+        raw = cache.get(uid)
+        if raw is None:
+            lease = cache.start_read(uid)
+            doc = self.read_after(collection, cache.stream_time, uid)
+            if doc is None:
+                return None
+            raw = doc.raw
+            cache.set(uid, lease, raw)
+        # every caller gets its own copy, as documents are changed in place (masking, patching)
+        return decode(raw, codec_options=codec_options)
+
+    def read_after(self, collection, stream_time, uid):
+        """
+        Reads the whole encoded document at least at stream_time, so it has every change
+        the stream has reported (and the changes the request session has seen, see DocumentCache.is_fresh_for).
+        The primary is used if the stream position is unknown
+        """
+        collection = collection.with_options(codec_options=raw_codec_options)
+        if stream_time is None:
+            return self.store.get(collection.with_options(read_preference=ReadPreference.PRIMARY), uid)
+        with self.store.connection.start_session(causal_consistency=True) as read_session:
+            read_session.advance_operation_time(stream_time)
+            return collection.find_one(
+                {"_id": uid},
+                projection=DEFAULT_PROJECTION,
+                session=read_session,
+                **get_query_options()
+            )
+
     def list(self, **kwargs):
-        result = self.store.list(self.collection, **kwargs)
+        hint = self.get_hint(kwargs.get("filters") or {}, kwargs.get("offset_field", "_id"))
+        result = self.store.list(self.read_collections["feed"], hint=hint, **kwargs)
         return result
 
+    def wait_for_changes(self, filters=None, timeout=0):
+        """
+        Blocks until a document matching filters is inserted or updated
+        or until timeout (seconds) passes. The changes made since the previous read
+        of the request session are not missed (see ChangeWaiters).
+        The wait takes at most a half of the rest of the request query time budget,
+        so there is time left to read the changes
+        :return: True if a matching change has happened
+        """
+        remaining = get_remaining_time()
+        if remaining is not None:
+            timeout = min(timeout, remaining / 2)
+        operation_time = getattr(get_db_session(), "operation_time", None)
+        waiters = self.get_change_waiters(operation_time)
+        event = waiters.add(filters or {}, operation_time)
+        deadline = time() + timeout
+        try:
+            while not event.is_set():
+                left = deadline - time()
+                if left <= 0:
+                    return False
+                event.wait(min(left, 1))
+                check_client_disconnected()
+            return True
+        finally:
+            waiters.remove(event)
+
+    def get_change_waiters(self, start_time=None):
+        with self.change_waiters_lock:
+            if self.change_waiters is None:
+                self.change_waiters = ChangeWaiters(Event, start_time)
+                Thread(target=self.watch_changes, args=(self.change_waiters,), daemon=True).start()
+        return self.change_waiters
+
+    def watch_changes(self, waiters):
+        """
+        The change stream all the long-poll waiters of the collection share. It's started by the first one
+        at the operation time of its session and runs while the process lives
+        """
+        pipeline = self.store.get_changes_pipeline(self.change_fields)
+        start_time = waiters.start_time
+        while True:
+            try:
+                with self.collection.watch(pipeline, max_await_time_ms=1000,
+                                           start_at_operation_time=start_time) as stream:
+                    if start_time is None:
+                        waiters.restart(get_resume_token_time(getattr(stream, "resume_token", None)))
+                    while stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            waiters.notify(change)
+            except PyMongoError as e:
+                LOGGER.warning(f"Change stream of {self.object_name} failed: {e}")
+                sleep(1)
+            start_time = None
+
     def flush(self):
         self.store.flush(self.collection)
 
@@ -276,21 +1395,86 @@ class BaseCollection:
         result = self.store.delete(self.collection, uid)
         return result
 
+    @timed("db")
     def paging_list(
         self, skip=0, limit=1000, fields=None, sort_by="dateCreated", descending=False, filters=None,
+        after=None, count=True,
     ):
+        """
+        :param after: (sort_by value, [_id, ...]) keyset position to continue from instead of skip.
+        Documents that have the same sort_by value and have been already returned are listed in _id,
+        so the index on (..., sort_by) is used as is, without adding _id to the sort
+        :param count: if False, the total count is not calculated and None is returned instead
+        """
         filters = filters or {}
-        result = list(self.collection.find(
+        hint = self.get_hint(filters, sort_by)
+        count_filters = dict(filters)
+        if after:
+            value, ids = after
+            filters[sort_by] = {"$lte" if descending else "$gte": value}
+            filters["_id"] = {"$nin": ids}
+            skip = 0
+        collection = self.read_collections["listing"]
+        query_options = get_query_options()
+        if hint:
+            query_options["hint"] = hint
+        result = self.store.hinted_read(collection, lambda c, session, options: list(c.find(
             filter=filters,
             projection=fields if fields else None,
             sort=((sort_by, DESCENDING if descending else ASCENDING),),
             skip=skip,
             limit=limit,
-            session=get_db_session(),
-        ))
+            session=session,
+            **options
+        )), query_options)
 
-        count = self.collection.count_documents(
-            filter=filters,
+        if count:
+            count_options = get_query_options(max_time_key="maxTimeMS")
+            if hint:
+                count_options["hint"] = hint
+            count = self.store.hinted_read(collection, lambda c, session, options: c.count_documents(
+                filter=count_filters,
+                session=session,
+                **options
+            ), count_options)
+        else:
+            count = None
+        return result, count
+
+
+class RevisionCollection(BaseCollection):
+    """
+    Append-only history of changes of the objects from the other collections,
+    one document per save instead of a growing list inside the object
+    """
+    object_name = "revision"
+    cacheable = False  # revisions are only listed
+    listing_queries = (
+        ListingQuery("by_object_date", "date", fields={"object_id"}),
+    )
+
+    def __init__(self, store, settings):
+        settings = {"mongodb.revision_collection": "revisions", **settings}
+        super().__init__(store, settings)
+
+    def get_indexes(self):
+        by_object_date = IndexModel(
+            [("object_id", ASCENDING),
+             ("date", ASCENDING)],
+            name="by_object_date",
+        )
+        return [by_object_date]
+
+    @timed("db")
+    def insert(self, object_name, object_id, revisions):
+        self.collection.insert_many(
+            [
+                {"_id": uuid4().hex, "object_name": object_name, "object_id": object_id, **revision}
+                for revision in revisions
+            ],
+            ordered=False,
             session=get_db_session(),
         )
-        return result, count
+
+
+COLLECTION_CLASSES["revision"] = RevisionCollection
@@ -0,0 +1,183 @@
+# pylint: disable=wrong-import-position
+
+if __name__ == "__main__":
+    from gevent import monkey
+
+    monkey.patch_all(thread=False, select=False)
+
+# Index management, run once per release instead of creating indexes at every worker start
+#
+#     python -m openprocurement.audit.api.indexes -p etc/service.ini diff
+#     python -m openprocurement.audit.api.indexes -p etc/service.ini apply [--drop]
+#     python -m openprocurement.audit.api.indexes -p etc/service.ini usage
+#
+# diff   - declared (get_indexes) indexes that are missing or differ from the live ones, and live indexes not declared
+# apply  - builds the missing indexes one at a time, waiting for the replication lag to go down between the builds;
+#          with --drop also rebuilds the changed ones and drops the not declared ones
+# usage  - $indexStats of the live indexes: unused ones and the ones that are a prefix of another index
+import argparse
+import logging
+from time import sleep
+
+from pyramid.paster import bootstrap
+
+from openprocurement.audit.api.database import COLLECTION_CLASSES, wait_for_replication
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+IGNORED_OPTIONS = ("v", "ns", "background")
+
+
+def get_spec(index):
+    """
+    :param index: IndexModel.document or a document from list_indexes
+    :return: name, key as a list of pairs, other options
+    """
+    options = {k: v for k, v in index.items() if k not in IGNORED_OPTIONS}
+    name = options.pop("name")
+    key = list(options.pop("key").items())
+    return name, key, options
+
+
+def get_diff(collection, declared):
+    """
+    :return: missing [IndexModel], changed [(IndexModel, live index)], extra [live index]
+    """
+    live = {index["name"]: index for index in collection.list_indexes()}
+    live.pop("_id_", None)
+    missing, changed = [], []
+    for model in declared:
+        name, key, options = get_spec(model.document)
+        if name not in live:
+            missing.append(model)
+        else:
+            index = live.pop(name)
+            if get_spec(index)[1:] != (key, options):
+                changed.append((model, index))
+    extra = list(live.values())
+    return missing, changed, extra
+
+
+def build(mongodb, collection, model, args):
+    wait_for_replication(mongodb, args.max_lag)
+    logger.info(f"Building {collection.name}.{model.document['name']}")
+    # commitQuorum makes the build finish only when it's done on the members that vote,
+    # so the next build doesn't start while the previous one still loads secondaries
+    collection.create_indexes([model], commitQuorum=args.commit_quorum)
+    sleep(args.pause)
+
+
+def diff(mongodb, collections, args):
+    for name, collection in collections.items():
+        missing, changed, extra = get_diff(collection.collection, collection.get_indexes())
+        for model in missing:
+            logger.info(f"{name}: missing {get_spec(model.document)}")
+        for model, live in changed:
+            logger.info(f"{name}: changed {get_spec(live)} -> {get_spec(model.document)}")
+        for live in extra:
+            logger.info(f"{name}: not declared {get_spec(live)}")
+        if not any((missing, changed, extra)):
+            logger.info(f"{name}: up to date")
+
+
+def apply(mongodb, collections, args):
+    for name, collection in collections.items():
+        missing, changed, extra = get_diff(collection.collection, collection.get_indexes())
+        for model in missing:
+            build(mongodb, collection.collection, model, args)
+        for model, live in changed:
+            if args.drop:
+                logger.info(f"Dropping changed {collection.collection.name}.{live['name']}")
+                collection.collection.drop_index(live["name"])
+                build(mongodb, collection.collection, model, args)
+            else:
+                logger.info(f"{name}: {live['name']} differs from the declared one, use --drop to rebuild it")
+        for live in extra:
+            if args.drop:
+                logger.info(f"Dropping not declared {collection.collection.name}.{live['name']}")
+                collection.collection.drop_index(live["name"])
+            else:
+                logger.info(f"{name}: {live['name']} is not declared, use --drop to drop it")
+
+
+def usage(mongodb, collections, args):
+    for name, collection in collections.items():
+        stats = {s["name"]: s for s in collection.collection.aggregate([{"$indexStats": {}}])}
+        indexes = [get_spec(index) for index in collection.collection.list_indexes()]
+        for index_name, key, options in indexes:
+            if index_name == "_id_":
+                continue
+            accesses = stats.get(index_name, {}).get("accesses", {})
+            ops = accesses.get("ops", 0)
+            logger.info(f"{name}.{index_name}: {ops} ops since {accesses.get('since')}")
+            if not ops:
+                logger.info(f"{name}.{index_name}: unused")
+            if options.get("unique"):
+                continue
+            for other_name, other_key, other_options in indexes:
+                if (
+                    other_name != index_name
+                    and other_key[:len(key)] == key
+                    and other_options.get("partialFilterExpression") == options.get("partialFilterExpression")
+                ):
+                    logger.info(f"{name}.{index_name}: redundant, it's a prefix of {other_name}")
+                    break
+
+
+COMMANDS = {
+    "diff": diff,
+    "apply": apply,
+    "usage": usage,
+}
+
+
+def run(env, args):
+    mongodb = env["registry"].mongodb
+    collections = {
+        name: getattr(mongodb, name)
+        for name in COLLECTION_CLASSES
+        if getattr(mongodb, name, None)
+    }
+    COMMANDS[args.command](mongodb, collections, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index management")
+    parser.add_argument(
+        "-p",
+        required=True,
+        help="Path to service.ini file",
+    )
+    parser.add_argument(
+        "command",
+        choices=COMMANDS.keys(),
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Rebuild changed indexes and drop not declared ones",
+    )
+    parser.add_argument(
+        "--commit-quorum",
+        default="votingMembers",
+        help="Members that have to finish an index build before it's ready",
+    )
+    parser.add_argument(
+        "--max-lag",
+        type=float,
+        default=10,
+        help="Replication lag in seconds to wait for before starting an index build",
+    )
+    parser.add_argument(
+        "--pause",
+        type=float,
+        default=5,
+        help="Seconds to wait after an index build",
+    )
+    args = parser.parse_args()
+    env = bootstrap(args.p)
+    try:
+        run(env, args)
+    finally:
+        env['closer']()
@@ -1,19 +1,108 @@
 from jsonpath_ng import parse
+from jsonpath_ng.jsonpath import Root, Child, Fields, Slice
 
 from openprocurement.audit.api.auth import ACCR_RESTRICTED
+from openprocurement.audit.api.metrics import timed
+
+
+NOT_SET = object()
+
+
+class MaskNode:
+    """
+    A node of the mask tree:
+     - values: fields of the current object to replace with the mask value
+     - fields: nodes for the fields of the current object
+     - each: node for every item of the current list
+    """
+    __slots__ = ("values", "fields", "each")
+
+    def __init__(self):
+        self.values = {}
+        self.fields = {}
+        self.each = None
+
+    def apply(self, data):
+        if data is None:
+            return
+        for field, value in self.values.items():
+            if field in data:
+                data[field] = value
+        for field, node in self.fields.items():
+            try:
+                field_value = data.get(field, NOT_SET)
+            except (TypeError, AttributeError):
+                continue
+            if field_value is not NOT_SET:
+                node.apply(field_value)
+        if self.each is not None and data:
+            # jsonpath [*] treats a dict or a constant as a single-element list
+            items = [data] if isinstance(data, (dict, int, str)) else data
+            for item in items:
+                self.each.apply(item)
+
+
+class MaskTree:
+    """
+    JSONPath mask rules compiled into one traversal tree,
+    so the document is walked once for all the rules instead of once per rule.
+    Only "$", ".field" and "[*]" steps are supported (this is what mask mappings use)
+    """
+
+    def __init__(self, mask_mapping):
+        self.rules = []
+        self.root = MaskNode()
+        for path, value in mask_mapping.items():
+            expr = parse(path)
+            self.rules.append((expr, value))
+            self.add(self.root, self.get_steps(expr), value, path)
+
+    @classmethod
+    def get_steps(cls, expr):
+        if isinstance(expr, Root):
+            return []
+        if isinstance(expr, Child):
+            return cls.get_steps(expr.left) + cls.get_steps(expr.right)
+        if isinstance(expr, Fields) and len(expr.fields) == 1 and expr.fields[0] != "*":
+            return [expr.fields[0]]
+        if isinstance(expr, Slice) and expr.start is None and expr.end is None and expr.step is None:
+            return [Slice]
+        raise ValueError(f"Unsupported mask path step: {expr}")
+
+    @staticmethod
+    def add(node, steps, value, path):
+        if not steps or steps[-1] is Slice:
+            raise ValueError(f"Mask path should end with a field: {path}")
+        for step in steps[:-1]:
+            if step is Slice:
+                node.each = node.each or MaskNode()
+                node = node.each
+            else:
+                if step in node.values:
+                    raise ValueError(f"Mask path goes through a masked field: {path}")
+                node = node.fields.setdefault(step, MaskNode())
+        field = steps[-1]
+        if field in node.fields:
+            raise ValueError(f"Mask path masks a field with masked subfields: {path}")
+        node.values[field] = value
+
+    def apply(self, data):
+        self.root.apply(data)
+
+    def apply_jsonpath(self, data):
+        """
+        The rules applied one by one with jsonpath_ng,
+        kept to check and benchmark the tree against
+        """
+        for expr, value in self.rules:
+            expr.update(data, value)
 
 
 def compile_mask_mapping(mask_mapping):
     """
     Pre-compile the JSONPath expressions in the mask mapping for efficient reuse.
     """
-    compiled_mapping = {}
-    for path, value in mask_mapping.items():
-        compiled_mapping[path] = {
-            "value": value,
-            "expr": parse(path),
-        }
-    return compiled_mapping
+    return MaskTree(mask_mapping)
 
 
 EXCLUDED_ROLES = (
@@ -24,23 +113,28 @@ EXCLUDED_ROLES = (
 )
 
 
-def mask_object_data(request, data, mask_mapping):
+def is_masking_required(request, data):
     if not data.get("restricted", False):
         # Masking only enabled if restricted is True
-        return
+        return False
 
     if request.authenticated_role in EXCLUDED_ROLES:
         # Masking is not required for these roles
-        return
+        return False
 
     if request.authenticated_role == "brokers" and request.check_accreditation(ACCR_RESTRICTED):
         # Masking is not required for brokers with accreditation
         # that allows access to restricted data
-        return
+        return False
 
     if request.matchdict and request.params and request.matchdict.get("document_id") and request.params.get("download"):
         # Masking is not required when non-authorized user download document by link
-        return
+        return False
+
+    return True
 
-    for rule in mask_mapping.values():
-        rule["expr"].update(data, rule["value"])
+
+@timed("mask")
+def mask_object_data(request, data, mask_mapping):
+    if is_masking_required(request, data):
+        mask_mapping.apply(data)
@@ -0,0 +1,875 @@
+"""
+In-process store without mongodb
+
+Selected by ``mongodb.uri = memory://`` (or MONGODB_URI=memory://) for benchmarks and local runs
+on a machine with no services, so serialization, masking and traversal can be profiled without the db noise.
+
+MemoryStore is MongodbStore on MemoryClient, that implements the part of pymongo API the app uses:
+ - documents are kept bson encoded, so every read decodes its own copy (raw listings get RawBSONDocument)
+ - saves are guarded by _rev (MongodbResourceConflict), public_modified is the save time in seconds
+ - the declared indexes (BaseCollection.get_indexes) are always built: a partial index is only used
+   by the queries that have its partialFilterExpression, equality prefixes and offsets are bisected
+ - sequences, sessions and change streams (longpoll listings, document cache invalidation) work in-process
+ - transactions are undone on error, but their writes are seen by the others before the end
+
+Only the query and update operators used by the app are supported.
+Data is shared by all the stores of the process and is lost on exit,
+there is no replication, so read preferences and causal consistency don't apply.
+"""
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from queue import Empty, Queue
+from threading import RLock
+from time import time
+from uuid import uuid4
+
+from bson import decode, encode
+from pymongo import ReadPreference, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+from openprocurement.audit.api.database import (
+    COLLECTION_CLASSES, MongodbResourceConflict, MongodbStore, codec_options,
+)
+from openprocurement.audit.api.context import get_db_session
+from openprocurement.audit.api.metrics import timed, CONFLICTS
+
+# databases by name, all the stores of the process see the same data as they would on a server
+DATABASES = {}
+
+MISSING = object()
+# bounds of index keys, less and greater than any sort_key
+MIN_KEY = (-1,)
+MAX_KEY = (100,)
+ID_KEY_RANK = 50
+DEFAULT_CODEC_OPTIONS = codec_options
+
+
+def sort_key(value):
+    """
+    Comparable key of a value in the bson sort order: null, numbers, strings, objects, arrays, booleans, dates
+    """
+    if value is None or value is MISSING:
+        return (0,)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float, Decimal)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, dict):
+        return (3, tuple((k, sort_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (4, tuple(sort_key(v) for v in value))
+    if isinstance(value, datetime):
+        return (9, value)
+    return (5, str(value))
+
+
+def get_value(doc, path):
+    """
+    :return: value of a dotted path, values of the nested documents of an array are collected into a list
+    """
+    value = doc
+    for name in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(name, MISSING)
+        elif isinstance(value, list):
+            value = [i[name] for i in value if isinstance(i, dict) and name in i] or MISSING
+        else:
+            return MISSING
+    return value
+
+
+def equals(value, other):
+    """
+    Query equality: an array matches its items too, a missing field matches null
+    """
+    if value is MISSING:
+        return other is None
+    if isinstance(value, list) and not isinstance(other, list):
+        return any(equals(i, other) for i in value)
+    return value == other and isinstance(value, bool) == isinstance(other, bool)
+
+
+def comparison(compare):
+    def check(value, arg):
+        # only values of the same bson type are compared
+        key = sort_key(arg)
+        return any(
+            i is not MISSING and sort_key(i)[0] == key[0] and compare(sort_key(i), key)
+            for i in (value if isinstance(value, list) else [value])
+        )
+    return check
+
+
+QUERY_OPERATORS = {
+    "$eq": equals,
+    "$ne": lambda value, arg: not equals(value, arg),
+    "$gt": comparison(lambda a, b: a > b),
+    "$gte": comparison(lambda a, b: a >= b),
+    "$lt": comparison(lambda a, b: a < b),
+    "$lte": comparison(lambda a, b: a <= b),
+    "$in": lambda value, arg: any(equals(value, i) for i in arg),
+    "$nin": lambda value, arg: not any(equals(value, i) for i in arg),
+    "$exists": lambda value, arg: (value is not MISSING) == bool(arg),
+}
+
+
+def is_operator_condition(condition):
+    return isinstance(condition, dict) and bool(condition) and all(k.startswith("$") for k in condition)
+
+
+def match(doc, filters):
+    for path, condition in filters.items():
+        if path == "$and":
+            if not all(match(doc, i) for i in condition):
+                return False
+        elif path == "$or":
+            if not any(match(doc, i) for i in condition):
+                return False
+        elif is_operator_condition(condition):
+            value = get_value(doc, path)
+            for operator, arg in condition.items():
+                if operator not in QUERY_OPERATORS:
+                    raise OperationFailure(f"{operator} is not supported by the memory store")
+                if not QUERY_OPERATORS[operator](value, arg):
+                    return False
+        elif not equals(get_value(doc, path), condition):
+            return False
+    return True
+
+
+def get_equality(condition):
+    """
+    :return: the value an equality condition requires or MISSING
+    """
+    if is_operator_condition(condition):
+        return condition["$eq"] if list(condition) == ["$eq"] else MISSING
+    if isinstance(condition, (dict, list)):
+        return MISSING
+    return condition
+
+
+def evaluate(doc, expression):
+    """
+    Projection expressions: "$field" references and documents of them
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        return get_value(doc, expression[1:])
+    if isinstance(expression, dict):
+        result = {}
+        for name, value in expression.items():
+            value = evaluate(doc, value)
+            if value is not MISSING:
+                result[name] = value
+        return result
+    return expression
+
+
+def include_path(result, doc, path):
+    name, _, rest = path.partition(".")
+    if name not in doc:
+        return
+    if not rest:
+        result[name] = doc[name]
+    elif isinstance(doc[name], dict):
+        include_path(result.setdefault(name, {}), doc[name], rest)
+
+
+def exclude_path(doc, path):
+    name, _, rest = path.partition(".")
+    if not rest:
+        doc.pop(name, None)
+    elif isinstance(doc.get(name), dict):
+        doc[name] = dict(doc[name])
+        exclude_path(doc[name], rest)
+
+
+def project(doc, projection):
+    if not projection:
+        return doc
+    if not isinstance(projection, dict):
+        projection = {name: 1 for name in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if not fields or all(not isinstance(v, (dict, str)) and not v for v in fields.values()):
+        result = dict(doc)
+        for path in fields:
+            exclude_path(result, path)
+    else:
+        result = {}
+        for path, spec in fields.items():
+            if isinstance(spec, (dict, str)):
+                value = evaluate(doc, spec)
+                if value is not MISSING:
+                    result[path] = value
+            elif spec:
+                include_path(result, doc, path)
+        if include_id and "_id" in doc:
+            result = {"_id": doc["_id"], **result}
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def apply_update(doc, update):
+    """
+    Update operators on a decoded document (in place), pipeline updates are only done by MemoryStore.save_data
+    """
+    if not isinstance(update, dict):
+        raise OperationFailure("Pipeline updates are not supported by the memory store")
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            *parents, name = path.split(".")
+            target = doc
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            if operator == "$set":
+                target[name] = value
+            elif operator == "$inc":
+                target[name] = target.get(name, 0) + value
+            elif operator == "$unset":
+                target.pop(name, None)
+            else:
+                raise OperationFailure(f"{operator} is not supported by the memory store")
+    return doc
+
+
+class MemoryIndex:
+    """
+    Sorted entries (sort keys of the fields, _id) of the documents that match the partial filter.
+    An array value of a field makes an entry for every item, like a multikey index does.
+    Key directions are ignored, indexes are scanned backwards for descending sorts
+    """
+
+    def __init__(self, name, keys, partial_filter=None):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.partial_filter = partial_filter or {}
+        self.entries = []
+        self.multikey = False
+
+    def get_document(self):
+        document = {"v": 2, "key": dict(self.keys), "name": self.name}
+        if self.partial_filter:
+            document["partialFilterExpression"] = self.partial_filter
+        return document
+
+    def get_entries(self, doc):
+        if not match(doc, self.partial_filter):
+            return []
+        entries = [()]
+        for field in self.fields:
+            value = get_value(doc, field)
+            values = value if isinstance(value, list) and value else [value]
+            if len(values) > 1:
+                self.multikey = True
+            entries = [entry + (sort_key(i),) for entry in entries for i in values]
+        uid = doc["_id"]
+        return [entry + ((ID_KEY_RANK, sort_key(uid), uid),) for entry in entries]
+
+    def add(self, doc):
+        for entry in self.get_entries(doc):
+            self.entries.insert(bisect_left(self.entries, entry), entry)
+
+    def remove(self, doc):
+        for entry in self.get_entries(doc):
+            position = bisect_left(self.entries, entry)
+            if position < len(self.entries) and self.entries[position] == entry:
+                del self.entries[position]
+
+    def is_usable(self, filters):
+        """
+        A partial index only has the documents that match its filter,
+        so it's only used by the queries that require the same values
+        """
+        return all(
+            name in filters and equals(get_equality(filters[name]), value)
+            for name, value in self.partial_filter.items()
+        )
+
+    def get_bounds(self, filters):
+        """
+        :return: number of the leading fields with equality conditions,
+        whether the next field has a range condition, the first and the last entries to scan
+        """
+        prefix = ()
+        for field in self.fields:
+            value = get_equality(filters.get(field, MISSING)) if field in filters else MISSING
+            if value is MISSING:
+                break
+            prefix += (sort_key(value),)
+        low, high = prefix + (MIN_KEY,), prefix + (MAX_KEY,)
+        ranged = False
+        if len(prefix) < len(self.fields) and is_operator_condition(filters.get(self.fields[len(prefix)])):
+            for operator, arg in filters[self.fields[len(prefix)]].items():
+                ranged = ranged or operator in ("$gt", "$gte", "$lt", "$lte")
+                if operator == "$gt":
+                    low = max(low, prefix + (sort_key(arg), MAX_KEY))
+                elif operator == "$gte":
+                    low = max(low, prefix + (sort_key(arg), MIN_KEY))
+                elif operator == "$lt":
+                    high = min(high, prefix + (sort_key(arg), MIN_KEY))
+                elif operator == "$lte":
+                    high = min(high, prefix + (sort_key(arg), MAX_KEY))
+        return len(prefix), ranged, low, high
+
+    def scan(self, low, high, descending=False):
+        """
+        :return: ids of the entries between the bounds, in the index order
+        """
+        positions = range(bisect_left(self.entries, low), bisect_left(self.entries, high))
+        ids = (self.entries[i][-1][2] for i in (reversed(positions) if descending else positions))
+        if self.multikey:
+            seen = set()
+            ids = (uid for uid in ids if not (uid in seen or seen.add(uid)))
+        return ids
+
+
+class MemoryStorage:
+    """
+    Documents and indexes of a collection, shared by all MemoryCollection objects with the same name
+    """
+
+    def __init__(self):
+        # _id: (encoded, decoded), the decoded documents are only used for matching and are never returned
+        self.documents = {}
+        self.indexes = {}
+        self.streams = set()
+        self.lock = RLock()
+
+    def get(self, uid):
+        entry = self.documents.get(uid)
+        return None if entry is None else entry[1]
+
+    def copy(self, doc):
+        return decode(self.documents[doc["_id"]][0], codec_options=codec_options)
+
+    def put(self, doc, operation="update", session=None):
+        encoded = encode(doc, codec_options=codec_options)
+        doc = decode(encoded, codec_options=codec_options)
+        with self.lock:
+            previous = self.documents.get(doc["_id"])
+            if session is not None:
+                session.record(self, doc["_id"], previous)
+            for index in self.indexes.values():
+                if previous is not None:
+                    index.remove(previous[1])
+                index.add(doc)
+            self.documents[doc["_id"]] = (encoded, doc)
+            self.publish(operation if previous is not None else "insert", dict(doc))
+        return doc
+
+    def remove(self, uid, session=None):
+        with self.lock:
+            encoded, doc = self.documents.pop(uid)
+            if session is not None:
+                session.record(self, uid, (encoded, doc))
+            for index in self.indexes.values():
+                index.remove(doc)
+            self.publish("delete", dict(doc))
+
+    def restore(self, uid, entry):
+        """
+        Returns the document to the state before a write (entry is None if it didn't exist)
+        """
+        with self.lock:
+            if uid in self.documents:
+                self.remove(uid)
+            if entry is not None:
+                self.put(entry[1])
+
+    def publish(self, operation, doc):
+        for stream in list(self.streams):
+            stream.push(operation, doc)
+
+    def create_index(self, name, keys, partial_filter=None):
+        with self.lock:
+            index = self.indexes[name] = MemoryIndex(name, keys, partial_filter)
+            for _, doc in self.documents.values():
+                index.add(doc)
+
+    def plan(self, filters, sort=None, hint=None):
+        """
+        Chooses the index for the query the way the mongodb planner mostly does: the one that
+        has the query equality conditions as the leading fields and then the sort field
+        :return: query plan dict (the winning plan of explain), None for the _id lookup
+        """
+        if "_id" in filters and get_equality(filters["_id"]) is not MISSING and hint is None:
+            return None
+        sort_field = sort[0][0] if sort else None
+        if hint is not None:
+            index = self.indexes.get(hint if isinstance(hint, str) else None)
+            if index is None or not index.is_usable(filters):
+                raise OperationFailure(f"error processing query: planner returned error :: bad hint {hint}")
+            candidates = [index]
+        else:
+            candidates = [index for index in self.indexes.values() if index.is_usable(filters)]
+        best, best_score = None, None
+        for index in candidates:
+            equalities, ranged, low, high = index.get_bounds(filters)
+            sorted_by_index = sort_field is None or (
+                equalities < len(index.fields) and index.fields[equalities] == sort_field
+                and all(field == sort_field for field, _ in sort)
+            )
+            bounded = equalities > 0 or ranged or bool(index.partial_filter)
+            if hint is None and not (bounded or sort_field is not None and sorted_by_index):
+                continue  # scanning the whole index is no better than the collection
+            score = (sorted_by_index, equalities, ranged, len(index.partial_filter), -len(index.fields))
+            if best_score is None or score > best_score:
+                best, best_score = (index, sorted_by_index, low, high), score
+        if best is None:
+            return {"stage": "COLLSCAN", "sorted": False}
+        index, sorted_by_index, low, high = best
+        return {
+            "stage": "IXSCAN",
+            "indexName": index.name,
+            "keyPattern": dict(index.keys),
+            "sorted": sorted_by_index,
+            "bounds": (low, high),
+        }
+
+    def find(self, filters, sort=None, skip=0, limit=0, hint=None, stats=None):
+        """
+        :return: matching decoded documents
+        """
+        with self.lock:
+            plan = self.plan(filters, sort, hint)
+            descending = bool(sort) and sort[0][1] < 0
+            if plan is None:
+                doc = self.get(get_equality(filters["_id"]))
+                candidates = [] if doc is None else [doc]
+                sorted_by_index = True
+            elif plan["stage"] == "IXSCAN":
+                index = self.indexes[plan["indexName"]]
+                candidates = (self.documents[uid][1] for uid in index.scan(*plan["bounds"], descending=descending))
+                sorted_by_index = plan["sorted"]
+            else:
+                candidates = (doc for _, doc in self.documents.values())
+                sorted_by_index = not sort
+
+            results = []
+            examined = 0
+            for doc in candidates:
+                examined += 1
+                if match(doc, filters):
+                    results.append(doc)
+                    # an index sorted scan stops as soon as the page is full
+                    if sorted_by_index and limit and len(results) >= skip + limit:
+                        break
+        if not sorted_by_index:
+            for field, direction in reversed(sort):
+                results.sort(key=lambda d: sort_key(get_value(d, field)), reverse=direction < 0)
+        results = results[skip:skip + limit if limit else None]
+        if stats is not None:
+            stats.update(plan=plan, examined=examined, returned=len(results))
+        return results
+
+
+class MemoryCursor:
+    """
+    Find query that is run on iteration, like pymongo Cursor
+    """
+
+    def __init__(self, collection, filters, projection=None, sort=None, skip=0, limit=0, hint=None):
+        self.collection = collection
+        self.filters = filters or {}
+        self.projection = projection
+        self.sort_keys = list(sort or [])
+        self.skip_count = skip
+        self.limit_count = limit
+        self.hint_index = hint
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self.sort_keys = list(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self.skip_count = skip
+        return self
+
+    def limit(self, limit):
+        self.limit_count = limit
+        return self
+
+    def hint(self, index):
+        self.hint_index = index
+        return self
+
+    def run(self, stats=None):
+        return self.collection.storage.find(
+            self.filters, self.sort_keys, self.skip_count, self.limit_count, self.hint_index, stats=stats,
+        )
+
+    def __iter__(self):
+        return iter([self.collection.output(doc, self.projection) for doc in self.run()])
+
+    def explain(self):
+        """
+        The winning plan and execution stats in the mongodb explain format
+        """
+        stats = {}
+        self.run(stats=stats)
+        plan = stats["plan"]
+        if plan is None:
+            winning_plan = {"stage": "IDHACK"}
+        elif plan["stage"] == "IXSCAN":
+            winning_plan = {"stage": "FETCH", "inputStage": {
+                "stage": "IXSCAN",
+                "indexName": plan["indexName"],
+                "keyPattern": plan["keyPattern"],
+                "isPartial": bool(self.collection.storage.indexes[plan["indexName"]].partial_filter),
+            }}
+        else:
+            winning_plan = {"stage": "COLLSCAN"}
+        if plan is not None and not plan["sorted"] and self.sort_keys:
+            winning_plan = {"stage": "SORT", "sortPattern": dict(self.sort_keys), "inputStage": winning_plan}
+        return {
+            "queryPlanner": {
+                "namespace": self.collection.full_name,
+                "parsedQuery": self.filters,
+                "winningPlan": winning_plan,
+                "rejectedPlans": [],
+            },
+            "executionStats": {
+                "nReturned": stats["returned"],
+                "totalDocsExamined": stats["examined"],
+            },
+        }
+
+
+class MemoryChangeStream:
+    """
+    Changes of a collection since the stream is opened, the first $match stage of the pipeline is applied.
+    There is no oplog, so start_at_operation_time can't be supported
+    """
+
+    def __init__(self, storage, pipeline=None, full_document=None, max_await_time_ms=None):
+        self.storage = storage
+        self.filters = next((stage["$match"] for stage in pipeline or [] if "$match" in stage), {})
+        self.full_document = full_document
+        self.max_await_time = (max_await_time_ms or 1000) / 1000
+        self.queue = Queue()
+        self.alive = True
+        storage.streams.add(self)
+
+    def push(self, operation, doc):
+        change = {
+            "_id": {"_data": uuid4().hex},
+            "operationType": operation,
+            "documentKey": {"_id": doc["_id"]},
+        }
+        if operation == "insert" or operation == "update" and self.full_document == "updateLookup":
+            change["fullDocument"] = doc
+        elif operation == "update":
+            # the changed fields aren't known here, all of them are reported
+            change["updateDescription"] = {"updatedFields": doc, "removedFields": []}
+        if match(change, self.filters):
+            self.queue.put(change)
+
+    def try_next(self):
+        try:
+            return self.queue.get(timeout=self.max_await_time)
+        except Empty:
+            return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.alive:
+            change = self.try_next()
+            if change is not None:
+                return change
+        raise StopIteration
+
+    def close(self):
+        self.alive = False
+        self.storage.streams.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MemoryCollection:
+    """
+    The part of pymongo Collection API used by the stores, the migrations and the indexes tool
+    """
+
+    def __init__(self, database, name, storage, codec_options, read_preference):
+        self.database = database
+        self.name = name
+        self.storage = storage
+        self.codec_options = codec_options
+        self.read_preference = read_preference
+
+    @property
+    def full_name(self):
+        return f"{self.database.name}.{self.name}"
+
+    def with_options(self, codec_options=None, read_preference=None, **kwargs):
+        return MemoryCollection(
+            self.database, self.name, self.storage,
+            codec_options or self.codec_options,
+            read_preference or self.read_preference,
+        )
+
+    def output(self, doc, projection=None):
+        """
+        Every result is decoded from bson, so it can be changed by the caller (and can be RawBSONDocument)
+        """
+        return decode(encode(project(doc, projection), codec_options=codec_options), codec_options=self.codec_options)
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, hint=None, session=None, **kwargs):
+        return MemoryCursor(self, filter, projection=projection, sort=sort, skip=skip, limit=limit, hint=hint)
+
+    def find_one(self, filter=None, projection=None, session=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for doc in self.find(filter, projection=projection, limit=1, **kwargs):
+            return doc
+        return None
+
+    def count_documents(self, filter, session=None, hint=None, **kwargs):
+        return len(self.storage.find(filter, hint=hint))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self.storage.documents)
+
+    def insert_one(self, document, session=None, **kwargs):
+        document.setdefault("_id", uuid4().hex)
+        with self.storage.lock:
+            if document["_id"] in self.storage.documents:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name}")
+            self.storage.put(document, session=session)
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, ordered=True, session=None, **kwargs):
+        ids = [self.insert_one(document, session=session).inserted_id for document in documents]
+        return InsertManyResult(ids, True)
+
+    def update_one(self, filter, update, upsert=False, session=None, **kwargs):
+        with self.storage.lock:
+            found = self.storage.find(filter, limit=1)
+            if found:
+                self.storage.put(apply_update(self.storage.copy(found[0]), update), session=session)
+                return UpdateResult({"n": 1, "nModified": 1}, True)
+            if upsert:
+                doc = self.get_upsert_document(filter, update)
+                self.storage.put(doc, session=session)
+                return UpdateResult({"n": 1, "nModified": 0, "upserted": doc["_id"]}, True)
+        return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+        with self.storage.lock:
+            found = self.storage.find(filter, limit=1)
+            if found:
+                before = found[0]
+                after = self.storage.put(apply_update(self.storage.copy(before), update), session=session)
+            elif upsert:
+                before = None
+                after = self.storage.put(self.get_upsert_document(filter, update), session=session)
+            else:
+                return None
+        result = after if return_document == ReturnDocument.AFTER else before
+        return None if result is None else self.output(result, projection)
+
+    @staticmethod
+    def get_upsert_document(filter, update):
+        doc = {name: value for name, value in filter.items() if get_equality(value) is not MISSING}
+        doc.setdefault("_id", uuid4().hex)
+        return apply_update(doc, update)
+
+    def delete_one(self, filter, session=None, **kwargs):
+        with self.storage.lock:
+            found = self.storage.find(filter, limit=1)
+            for doc in found:
+                self.storage.remove(doc["_id"], session=session)
+        return DeleteResult({"n": len(found)}, True)
+
+    def delete_many(self, filter, session=None, **kwargs):
+        with self.storage.lock:
+            found = self.storage.find(filter)
+            for doc in found:
+                self.storage.remove(doc["_id"], session=session)
+        return DeleteResult({"n": len(found)}, True)
+
+    def create_indexes(self, indexes, session=None, **kwargs):
+        names = []
+        for model in indexes:
+            document = model.document
+            self.storage.create_index(
+                document["name"], list(document["key"].items()), document.get("partialFilterExpression"),
+            )
+            names.append(document["name"])
+        return names
+
+    def list_indexes(self, session=None):
+        return iter([{"v": 2, "key": {"_id": 1}, "name": "_id_"}] + [
+            index.get_document() for index in self.storage.indexes.values()
+        ])
+
+    def drop_index(self, index_or_name, session=None, **kwargs):
+        with self.storage.lock:
+            self.storage.indexes.pop(index_or_name, None)
+
+    def watch(self, pipeline=None, full_document=None, max_await_time_ms=None, session=None, **kwargs):
+        return MemoryChangeStream(self.storage, pipeline, full_document, max_await_time_ms)
+
+
+class MemoryDatabase:
+
+    def __init__(self, client, name, storages, codec_options, read_preference):
+        self.client = client
+        self.name = name
+        self.storages = storages
+        self.codec_options = codec_options
+        self.read_preference = read_preference
+
+    def get_collection(self, name, codec_options=None, read_preference=None, **kwargs):
+        storage = self.storages.setdefault(name, MemoryStorage())
+        return MemoryCollection(
+            self, name, storage,
+            codec_options or self.codec_options,
+            read_preference or self.read_preference,
+        )
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def list_collection_names(self, session=None):
+        return list(self.storages)
+
+    def drop_collection(self, name, session=None):
+        self.storages.pop(getattr(name, "name", name), None)
+
+
+class MemorySession:
+    """
+    Sessions are accepted by every operation, but there is nothing to be consistent with in-process,
+    the times of the SESSION cookie are only passed through.
+    The writes of a transaction are recorded to be undone if it fails
+    """
+
+    def __init__(self):
+        self.cluster_time = None
+        self.operation_time = None
+        self.undo = None
+
+    @contextmanager
+    def start_transaction(self, **kwargs):
+        if self.undo is not None:
+            raise OperationFailure("Transaction already in progress")
+        self.undo = []
+        try:
+            yield
+        except BaseException:
+            for storage, uid, entry in reversed(self.undo):
+                storage.restore(uid, entry)
+            raise
+        finally:
+            self.undo = None
+
+    def record(self, storage, uid, entry):
+        if self.undo is not None:
+            self.undo.append((storage, uid, entry))
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+
+    def end_session(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_session()
+
+
+class MemoryClient:
+
+    def get_database(self, name, codec_options=None, read_preference=None, **kwargs):
+        return MemoryDatabase(
+            self, name, DATABASES.setdefault(name, {}),
+            codec_options or DEFAULT_CODEC_OPTIONS,
+            read_preference or ReadPreference.PRIMARY,
+        )
+
+    def start_session(self, causal_consistency=True, **kwargs):
+        return MemorySession()
+
+    def close(self):
+        pass
+
+
+class MemoryStore(MongodbStore):
+    """
+    MongodbStore on MemoryClient, see the module docstring
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        # building indexes costs nothing here, and listings without them would be unrealistically slow
+        for name in COLLECTION_CLASSES:
+            getattr(self, name).create_indexes()
+
+    @staticmethod
+    def connect(settings):
+        connection = MemoryClient()
+        db_name = os.environ.get("DB_NAME", settings["mongodb.db_name"])
+        return connection, connection.get_database(db_name, codec_options=codec_options)
+
+    def get_replication_lag(self):
+        return 0
+
+    def get_members_lag(self):
+        return {}
+
+    def kill_queries(self, comment):
+        # queries run in the greenlet of their request here, it stops before the next one
+        return 0
+
+    @timed("db")
+    def save_data(self, collection, data, insert=False, modified=True, src=None):
+        """
+        The same as MongodbStore.save_data, but the document is always replaced as a whole, so src isn't used
+        """
+        uid, revision, stored = self.prepare_data(data, modified=modified)
+        storage = collection.storage
+        with storage.lock:
+            current = storage.get(uid)
+            if current is None or not match(current, {"_rev": revision}):
+                if not insert:
+                    CONFLICTS.inc(collection.name)
+                    raise MongodbResourceConflict("Conflict while updating document. Please, retry")
+                if current is not None:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {collection.full_name}")
+            document = dict(stored)
+            if current is not None and "revisions" in current:
+                # the ones that haven't been moved to the revisions collection by the migration
+                document = {"revisions": current["revisions"], **document}
+            if modified:
+                # $$NOW has milliseconds precision
+                document["public_modified"] = int(time() * 1000) / 1000
+            storage.put(document, session=get_db_session())
+        return data
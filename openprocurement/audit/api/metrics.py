@@ -0,0 +1,592 @@
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from functools import wraps
+from math import isnan
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from uuid import uuid4
+
+from pymongo.common import MAX_POOL_SIZE
+from pymongo.monitoring import ConnectionPoolListener
+
+from openprocurement.audit.api.context import get_timings
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0, float("inf"))
+
+
+REGISTRY = []
+
+VALUES_HEADER = struct.Struct("<q")
+VALUES_KEY_SIZE = struct.Struct("<i")
+VALUES_VALUE = struct.Struct("<d")
+
+
+class ValuesFile:
+    """
+    The metric values of one process, every value has its own place in the mmapped file,
+    so a change is a write to memory (the layout of prometheus_client multiprocess mode):
+    the used size (8 bytes), then the entries of key size (4 bytes), utf-8 key padded to 8 bytes and value (double)
+    """
+    initial_size = 1 << 16
+
+    def __init__(self, path):
+        self.path = path
+        self.positions = {}
+        self.lock = Lock()
+        self.file = open(path, "w+b")
+        self.size = self.initial_size
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.used = VALUES_HEADER.size
+        VALUES_HEADER.pack_into(self.map, 0, self.used)
+
+    def write(self, key, value):
+        with self.lock:
+            position = self.positions.get(key)
+            if position is None:
+                position = self.positions[key] = self.add(key)
+            VALUES_VALUE.pack_into(self.map, position, value)
+
+    def add(self, key):
+        encoded = json.dumps(key).encode()
+        padded_size = get_padded_key_size(len(encoded))
+        entry_size = VALUES_KEY_SIZE.size + padded_size + VALUES_VALUE.size
+        if self.used + entry_size > self.size:
+            while self.used + entry_size > self.size:
+                self.size *= 2
+            self.file.truncate(self.size)
+            self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), self.size)
+        struct.pack_into(f"<i{padded_size}sd", self.map, self.used, len(encoded), encoded, 0.0)
+        position = self.used + VALUES_KEY_SIZE.size + padded_size
+        # readers see the entry only when it's complete
+        self.used += entry_size
+        VALUES_HEADER.pack_into(self.map, 0, self.used)
+        return position
+
+
+def get_padded_key_size(size):
+    """
+    :return: the size of a key, so its value starts at a multiple of 8
+    """
+    return size + (8 - (VALUES_KEY_SIZE.size + size) % 8) % 8
+
+
+def read_values_file(path):
+    """
+    :return: {metric name: [(label_values, part, value), ...]} of a ValuesFile (see Metric.store)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    used = VALUES_HEADER.unpack_from(data, 0)[0] if len(data) >= VALUES_HEADER.size else 0
+    position = VALUES_HEADER.size
+    values = {}
+    while position < used:
+        key_size = VALUES_KEY_SIZE.unpack_from(data, position)[0]
+        position += VALUES_KEY_SIZE.size
+        name, label_values, part = json.loads(data[position:position + key_size].decode())
+        position += get_padded_key_size(key_size)
+        value = VALUES_VALUE.unpack_from(data, position)[0]
+        position += VALUES_VALUE.size
+        values.setdefault(name, []).append((tuple(label_values), part, value))
+    return values
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MultiprocessValues:
+    """
+    The metric values of all the gunicorn workers sharing a directory (metrics_dir setting),
+    so /metrics shows the same series whatever worker gets the scrape (see generate_latest).
+    Every process writes its values to <pid>.db there. The counters and histograms of the processes
+    that have exited are kept in the totals, so they never go down, their gauges are dropped.
+    The files of the previous runs can be left there, their counters only continue the totals.
+    Gauges with func are written by every process every refresh_interval seconds
+    """
+    refresh_interval = 5
+
+    def __init__(self):
+        self.directory = None
+        self.pid = None
+        self.file = None
+        self.lock = Lock()
+
+    def set_directory(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.pid = self.file = None
+
+    def get_file(self):
+        pid = os.getpid()
+        if self.pid != pid:  # a worker forked after the directory has been set
+            with self.lock:
+                if self.pid != pid:
+                    path = os.path.join(self.directory, f"{pid}.db")
+                    if os.path.exists(path):  # left by an exited process with the same pid
+                        os.rename(path, os.path.join(self.directory, f"{pid}-{uuid4().hex}.db"))
+                    self.file = ValuesFile(path)
+                    self.pid = pid
+                    Thread(target=self.refresh_gauges, daemon=True).start()
+        return self.file
+
+    def write(self, key, value):
+        if self.directory is not None:
+            self.get_file().write(key, value)
+
+    def refresh_gauges(self, registry=REGISTRY):
+        pid = self.pid
+        while self.pid == pid:
+            for metric in registry:
+                if isinstance(metric, Gauge):
+                    metric.refresh()
+            sleep(self.refresh_interval)
+
+    def read(self):
+        """
+        :return: [(the process is alive, {metric name: [(label_values, part, value), ...]}), ...] of all the files
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".db"):
+                continue
+            pid = name[:-3]
+            live = pid.isdigit() and is_process_alive(int(pid))
+            try:
+                files.append((live, read_values_file(os.path.join(self.directory, name))))
+            except FileNotFoundError:  # renamed meanwhile
+                pass
+        return files
+
+
+MULTIPROCESS = MultiprocessValues()
+
+
+class Metric:
+    """
+    Prometheus-style metric kept in the worker memory,
+    and in the shared directory of the workers if there is one (see MultiprocessValues)
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = Lock()
+        if registry is not None:
+            registry.append(self)
+
+    def store(self, label_values, value, part=None):
+        """
+        Writes the value to the file of the process, called under the lock
+        """
+        MULTIPROCESS.write((self.name, label_values, part), value)
+
+    def samples(self, values=None):
+        """
+        :param values: the values of all the processes (see aggregate), the ones of this process by default
+        :return: (suffix, label_values, value) for every exported line
+        """
+        if values is None:
+            with self.lock:
+                values = dict(self.values)
+        for label_values, value in values.items():
+            yield "", label_values, value
+
+    def aggregate(self, files):
+        """
+        :param files: the values of all the processes, see MultiprocessValues.read
+        :return: their total values in the same form as self.values
+        """
+        values = {}
+        for live, file_values in files:
+            for label_values, part, value in file_values.get(self.name, ()):
+                values[label_values] = values.get(label_values, 0) + value
+        return values
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            value = self.values[label_values] = self.values.get(label_values, 0) + amount
+            self.store(label_values, value)
+
+
+class Gauge(Metric):
+    """
+    :param func: if set, values are taken from it on every export
+    as {label_values: value} (for the state that is kept somewhere else)
+    :param mode: how the values of the workers are aggregated, sum or max
+    (for the values they all see the same way)
+    """
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), func=None, mode="sum", registry=REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self.func = func
+        self.mode = mode
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            value = self.values[label_values] = self.values.get(label_values, 0) + amount
+            self.store(label_values, value)
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+            self.store(label_values, value)
+
+    def refresh(self):
+        """
+        Stores the current values of func, the ones it no longer returns are stored as NaN (not exported)
+        """
+        if self.func is None:
+            return
+        values = {tuple(k): v for k, v in self.func().items()}
+        with self.lock:
+            for label_values in self.values.keys() - values.keys():
+                self.store(label_values, float("nan"))
+            self.values = values
+            for label_values, value in values.items():
+                self.store(label_values, value)
+
+    def samples(self, values=None):
+        if values is None and self.func is not None:
+            values = self.func()
+        yield from super().samples(values)
+
+    def aggregate(self, files):
+        values = {}
+        for live, file_values in files:
+            if not live:
+                continue
+            for label_values, part, value in file_values.get(self.name, ()):
+                if isnan(value):
+                    continue
+                if label_values not in values:
+                    values[label_values] = value
+                elif self.mode == "max":
+                    values[label_values] = max(values[label_values], value)
+                else:
+                    values[label_values] += value
+        return values
+
+
+class Histogram(Metric):
+    """
+    Cumulative buckets are calculated only on export, so observe is a bisect and an increment
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [[0] * len(self.buckets), 0.0]
+            bucket = bisect_left(self.buckets, value)
+            counts[0][bucket] += 1
+            counts[1] += value
+            self.store(label_values, counts[0][bucket], bucket)
+            self.store(label_values, counts[1], "sum")
+
+    def aggregate(self, files):
+        values = {}
+        for live, file_values in files:
+            for label_values, part, value in file_values.get(self.name, ()):
+                counts = values.get(label_values)
+                if counts is None:
+                    counts = values[label_values] = [[0] * len(self.buckets), 0.0]
+                if part == "sum":
+                    counts[1] += value
+                else:
+                    counts[0][part] += int(value)
+        return values
+
+    def collect(self, values=None):
+        """
+        :param values: see Metric.samples
+        :return: (label_values, [(bucket, cumulative count), ...], sum, count) for every label values
+        """
+        if values is None:
+            with self.lock:
+                values = {k: (list(v[0]), v[1]) for k, v in self.values.items()}
+        for label_values, (counts, total) in values.items():
+            cumulative, buckets = 0, []
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                buckets.append((bucket, cumulative))
+            yield label_values, buckets, total, cumulative
+
+    def samples(self, values=None):
+        for label_values, buckets, total, count in self.collect(values):
+            for bucket, value in buckets:
+                yield "_bucket", label_values + (bucket,), value
+            yield "_sum", label_values, total
+            yield "_count", label_values, count
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def format_label(value):
+    if not isinstance(value, str):
+        value = format_value(value)
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def generate_latest(registry=REGISTRY, multiprocess=MULTIPROCESS):
+    """
+    Metrics in the Prometheus text exposition format
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+    They're the totals of all the workers if they share a directory (see MultiprocessValues),
+    otherwise the values of this process
+    """
+    files = None
+    if multiprocess.directory is not None:
+        for metric in registry:
+            if isinstance(metric, Gauge):
+                metric.refresh()
+        files = multiprocess.read()
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        values = None if files is None else metric.aggregate(files)
+        for suffix, label_values, value in metric.samples(values):
+            labels = metric.labels + ("le",) if suffix == "_bucket" else metric.labels
+            if labels:
+                label_str = ",".join(f'{k}="{format_label(v)}"' for k, v in zip(labels, label_values))
+                lines.append(f"{metric.name}{suffix}{{{label_str}}} {format_value(value)}")
+            else:
+                lines.append(f"{metric.name}{suffix} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_DURATION = Histogram(
+    "audit_api_request_duration_seconds",
+    "Request processing time",
+    labels=("route", "method"),
+)
+REQUEST_STAGE_DURATION = Histogram(
+    "audit_api_request_stage_duration_seconds",
+    "Time spent in a processing stage (db, serialize, validate, mask, render) per request",
+    labels=("route", "stage"),
+)
+RESPONSES = Counter(
+    "audit_api_responses_total",
+    "Responses by route and status code",
+    labels=("route", "method", "status"),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "audit_api_requests_in_progress",
+    "Requests being processed by the worker (every request is handled by its own greenlet)",
+)
+CONFLICTS = Counter(
+    "audit_api_conflicts_total",
+    "Concurrent updates rejected because of _rev mismatch or a transaction write conflict (returned as 409)",
+    labels=("collection",),
+)
+COALESCED_REQUESTS = Counter(
+    "audit_api_coalesced_requests_total",
+    "GETs that got a copy of the response of an identical concurrent request",
+)
+REPLICATION_LAG = Gauge(
+    "audit_api_mongodb_replication_lag_seconds",
+    "Seconds a secondary is behind the primary by the last heartbeats of the worker's client",
+    labels=("address",),
+    func=dict,  # set by MongodbStore
+    mode="max",
+)
+HEDGED_READS = Counter(
+    "audit_api_mongodb_hedged_reads_total",
+    "Listing reads also sent to another member after mongodb.hedge_delay (sent)"
+    " and the ones it answered first (won)",
+    labels=("result",),
+)
+DOCUMENT_CACHE_READS = Counter(
+    "audit_api_document_cache_reads_total",
+    "Document cache lookups by collection and result: hit, miss or bypass (the session is newer than the cache)",
+    labels=("collection", "result"),
+)
+# DocumentCache by collection, set by BaseCollection
+DOCUMENT_CACHES = {}
+DOCUMENT_CACHE_ENTRIES = Gauge(
+    "audit_api_document_cache_entries",
+    "Documents kept in the document cache by collection",
+    labels=("collection",),
+    func=lambda: {(name,): len(cache) for name, cache in list(DOCUMENT_CACHES.items())},
+)
+DOCSERVICE_UPLOAD_RETRIES = Counter(
+    "audit_api_docservice_upload_retries_total",
+    "Failed document service upload attempts",
+    labels=("reason",),
+)
+DOCSERVICE_UPLOAD_FAILURES = Counter(
+    "audit_api_docservice_upload_failures_total",
+    "Document uploads failed after all the attempts",
+)
+
+
+class ConnectionPoolMetrics(ConnectionPoolListener):
+    """
+    Keeps the state of MongodbStore.connection pools, as pymongo doesn't expose it
+    """
+
+    def __init__(self):
+        self.max_pool_size = Gauge(
+            "audit_api_mongodb_pool_max_size",
+            "Max size of the mongodb connection pool of a worker",
+            mode="max",
+        )
+        self.connections = Gauge(
+            "audit_api_mongodb_pool_connections",
+            "Open mongodb connections by server",
+            labels=("address",),
+        )
+        self.checked_out = Gauge(
+            "audit_api_mongodb_pool_checked_out_connections",
+            "Mongodb connections in use by server",
+            labels=("address",),
+        )
+        self.checkout_failures = Counter(
+            "audit_api_mongodb_pool_checkout_failures_total",
+            "Failed mongodb connection checkouts by server and reason",
+            labels=("address", "reason"),
+        )
+
+    @staticmethod
+    def address(event):
+        return "{}:{}".format(*event.address)
+
+    def pool_created(self, event):
+        self.max_pool_size.set(event.options.get("maxPoolSize", MAX_POOL_SIZE))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.connections.inc(self.address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.connections.dec(self.address(event))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures.inc(self.address(event), str(event.reason))
+
+    def connection_checked_out(self, event):
+        self.checked_out.inc(self.address(event))
+
+    def connection_checked_in(self, event):
+        self.checked_out.dec(self.address(event))
+
+
+CONNECTION_POOL_METRICS = ConnectionPoolMetrics()
+
+
+def get_hub_stats():
+    try:
+        from gevent import get_hub
+    except ImportError:  # pragma: no cover
+        return {}
+    loop = get_hub().loop
+    return {("active",): loop.activecnt, ("pending",): loop.pendingcnt}
+
+
+GREENLETS = Gauge(
+    "audit_api_greenlets",
+    "Greenlets spawned by the workers (hedged reads, disconnect watchers) that haven't exited yet,"
+    " the request handlers are audit_api_requests_in_progress",
+)
+
+
+def spawn(func, *args, **kwargs):
+    """
+    gevent.spawn counted by GREENLETS until the greenlet exits
+    """
+    from gevent import spawn as gevent_spawn
+    GREENLETS.inc()
+    greenlet = gevent_spawn(func, *args, **kwargs)
+    greenlet.rawlink(lambda g: GREENLETS.dec())
+    return greenlet
+GEVENT_LOOP_WATCHERS = Gauge(
+    "audit_api_gevent_loop_watchers",
+    "Active watchers and pending callbacks of the gevent loop of the worker",
+    labels=("state",),
+    func=get_hub_stats,
+)
+
+
+class RequestTimings:
+    """
+    Durations of the processing stages of the current request
+    """
+    __slots__ = ("durations", "active")
+
+    def __init__(self):
+        self.durations = {}
+        self.active = set()
+
+    def add(self, stage, duration):
+        self.durations[stage] = self.durations.get(stage, 0.0) + duration
+
+
+def timed(stage):
+    """
+    Adds the call duration to the stage of the current request timings.
+    Nested calls of the same stage are not counted twice,
+    calls outside of a request (no timings in the context) are not timed at all
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = get_timings()
+            if timings is None or stage in timings.active:
+                return func(*args, **kwargs)
+            timings.active.add(stage)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.add(stage, perf_counter() - start)
+                timings.active.discard(stage)
+        return wrapper
+    return decorator
@@ -1,5 +1,19 @@
-from openprocurement.audit.api.context import set_db_session
+from openprocurement.audit.api.context import get_db_session, set_db_session, set_query_deadline, set_timings
+from openprocurement.audit.api.metrics import (
+    COALESCED_REQUESTS, REQUEST_DURATION, REQUEST_STAGE_DURATION, REQUESTS_IN_PROGRESS, RESPONSES, RequestTimings,
+    spawn,
+)
+from openprocurement.audit.api.timeouts import CLIENT_DISCONNECTED, ClientDisconnected, get_query_comment
+from collections import deque
+from gevent.socket import wait_read
+from itertools import islice
 from logging import getLogger
+from pymongo.errors import PyMongoError
+from pyramid.interfaces import IRoutesMapper
+from pyramid.response import Response
+from socket import MSG_PEEK
+from threading import Condition, Event, Lock
+from time import monotonic, perf_counter
 from bson.json_util import dumps, loads
 from base64 import b64encode, b64decode
 
@@ -49,3 +63,373 @@ class DBSessionCookieMiddleware:
             value=b64encode(dumps(session_data).encode()),
         )
         return response
+
+
+class ServerTimingMiddleware:
+    """
+    Measures the request processing time and the time spent in db calls, serialization,
+    validation, masking and rendering (see metrics.timed).
+    Durations are observed by the metrics histograms (see views/metrics.py) and sent in the Server-Timing header
+    https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing
+    Only the first chunk of a streamed listing body is rendered before the response is returned
+    (see utils.stream_json_response), the rest of it is not included
+    """
+    def __init__(self, handler, registry):
+        self.handler = handler
+        self.registry = registry
+        self.header_enabled = getattr(registry, "server_timing", True)
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        set_timings(timings)
+        REQUESTS_IN_PROGRESS.inc()
+        start = perf_counter()
+        response = None
+        try:
+            response = self.handler(request)
+        finally:
+            total = perf_counter() - start
+            set_timings(None)
+            REQUESTS_IN_PROGRESS.dec()
+            route = request.matched_route.name if request.matched_route else ""
+            REQUEST_DURATION.observe(total, route, request.method)
+            RESPONSES.inc(route, request.method, response.status_code if response else 500)
+            for stage, duration in timings.durations.items():
+                REQUEST_STAGE_DURATION.observe(duration, route, stage)
+
+        if self.header_enabled:
+            metrics = [f"{stage};dur={duration * 1000:.2f}" for stage, duration in timings.durations.items()]
+            metrics.append(f"total;dur={total * 1000:.2f}")
+            response.headers["Server-Timing"] = ", ".join(metrics)
+        return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Rejects the requests of a client that has spent its token bucket (429)
+    and the costly requests that don't fit the worker capacity in time (503), see admission.AdmissionController
+    """
+    def __init__(self, handler, registry):
+        self.handler = handler
+        self.registry = registry
+        self.mapper = registry.queryUtility(IRoutesMapper)
+
+    def __call__(self, request):
+        admission = getattr(self.registry, "admission", None)
+        if admission is None:
+            return self.handler(request)
+        route = self.mapper(request)["route"] if self.mapper is not None else None
+        cost = admission.estimate_cost(route.name if route else None, request.GET)
+        if not cost:
+            return self.handler(request)
+
+        retry_after = admission.take_tokens(self.get_client(request, admission), cost)
+        if retry_after is not None:
+            return self.error_response(429, "client", "Too many requests", retry_after)
+        if not admission.acquire(cost):
+            return self.error_response(503, "capacity", "Server is busy", 1)
+        try:
+            return self.handler(request)
+        finally:
+            admission.release(cost)
+
+    @staticmethod
+    def get_client(request, admission):
+        try:
+            userid = request.authenticated_userid
+        except Exception as exc:  # the request will fail later the usual way
+            LOGGER.debug(f"Can't get the user of the request: {exc}")
+            userid = None
+        return userid or admission.get_client_address(request.remote_addr, request.headers.get("X-Forwarded-For"))
+
+    @staticmethod
+    def error_response(status, name, description, retry_after):
+        response = Response(
+            json_body={
+                "status": "error",
+                "errors": [{"location": "url", "name": name, "description": description}],
+            },
+            status=status,
+        )
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+
+class QueryBudgetMiddleware:
+    """
+    Sets the query time budget of the request by its route (query_timeouts, query_timeout for the other routes),
+    the read queries get the rest of it as maxTimeMS (see timeouts.get_query_options).
+    When the client of a read disconnects, its running queries are killed and the next ones aren't started
+    (see timeouts.ClientDisconnected), it gets 499 that nobody reads (only under gunicorn,
+    that provides the client socket)
+    """
+    def __init__(self, handler, registry):
+        self.handler = handler
+        self.default_timeout = getattr(registry, "query_timeout", 0)
+        self.timeouts = getattr(registry, "query_timeouts", {})
+        self.mapper = registry.queryUtility(IRoutesMapper)
+
+    def get_timeout(self, request):
+        if self.timeouts and self.mapper is not None:
+            route = self.mapper(request)["route"]
+            if route is not None and route.name in self.timeouts:
+                return self.timeouts[route.name]
+        return self.default_timeout
+
+    def __call__(self, request):
+        timeout = self.get_timeout(request)
+        set_query_deadline(monotonic() + timeout if timeout else None)
+        watcher = self.watch_disconnect(request)
+        try:
+            return self.handler(request)
+        except ClientDisconnected:
+            # nobody is going to read it
+            return Response(status=499)
+        except PyMongoError:
+            if request.environ.get(CLIENT_DISCONNECTED):  # killed by wait_disconnect
+                return Response(status=499)
+            raise
+        finally:
+            set_query_deadline(None)
+            # the one that has found the client gone finishes killing its queries
+            if watcher is not None and not request.environ.get(CLIENT_DISCONNECTED):
+                watcher.kill(block=False)
+
+    @staticmethod
+    def watch_disconnect(request):
+        sock = request.environ.get("gunicorn.socket")
+        if sock is None or request.method not in ("GET", "HEAD"):
+            return None
+        return spawn(wait_disconnect, sock, request)
+
+
+def wait_disconnect(sock, request):
+    try:
+        wait_read(sock.fileno())
+        # a read request has no body, so the socket is readable only if it's closed
+        # or the next request of the connection has come (then the client is still there)
+        disconnected = sock.recv(1, MSG_PEEK) == b""
+    except OSError:
+        disconnected = True
+    if disconnected:
+        request.environ[CLIENT_DISCONNECTED] = True
+        killed = request.registry.mongodb.kill_queries(get_query_comment(request))
+        LOGGER.info(f"Client disconnected, {killed} running queries are killed, the next ones aren't started")
+
+
+class FlightAborted(Exception):
+    pass
+
+
+class Flight:
+    """
+    A request being processed and the requests waiting for it (followers).
+    The chunks of the shared response body are kept only until every follower has read them
+    """
+    __slots__ = ("operation_time", "done", "response", "followers", "chunks", "dropped", "finished", "condition")
+
+    def __init__(self, operation_time):
+        self.operation_time = operation_time
+        self.done = Event()
+        self.response = None
+        self.followers = 0
+        # [chunk, followers that haven't read it]
+        self.chunks = deque()
+        self.dropped = 0
+        # None while the body is being produced, then whether it's complete
+        self.finished = None
+        self.condition = Condition()
+
+    def put(self, chunk):
+        with self.condition:
+            if self.followers:
+                self.chunks.append([chunk, self.followers])
+                self.condition.notify_all()
+
+    def finish(self, complete):
+        with self.condition:
+            if self.finished is None:
+                self.finished = complete
+                self.condition.notify_all()
+
+    def get(self, position, timeout):
+        """
+        :return: the chunk at the position, None if the body has ended
+        """
+        with self.condition:
+            while position - self.dropped >= len(self.chunks):
+                if self.finished:
+                    return None
+                if self.finished is False:
+                    raise FlightAborted("The response body of the coalesced request has been aborted")
+                if not self.condition.wait(timeout):
+                    raise FlightAborted("The response body of the coalesced request hasn't been produced in time")
+            item = self.chunks[position - self.dropped]
+            item[1] -= 1
+            self.drop_read()
+            return item[0]
+
+    def leave(self, position):
+        """
+        A follower stops reading at the position
+        """
+        with self.condition:
+            self.followers -= 1
+            for item in islice(self.chunks, max(0, position - self.dropped), None):
+                item[1] -= 1
+            self.drop_read()
+
+    def drop_read(self):
+        while self.chunks and self.chunks[0][1] <= 0:
+            self.chunks.popleft()
+            self.dropped += 1
+
+
+class LeaderBody:
+    """
+    Body of the first request, its chunks are shared with the followers as they are produced
+    """
+
+    def __init__(self, flight, app_iter):
+        self.flight = flight
+        self.app_iter = app_iter
+        self.iterator = iter(app_iter)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            self.flight.finish(True)
+            raise
+        except BaseException:
+            self.flight.finish(False)
+            raise
+        self.flight.put(chunk)
+        return chunk
+
+    def close(self):
+        # the body that hasn't been read to the end is aborted for the followers as well
+        self.flight.finish(False)
+        if hasattr(self.app_iter, "close"):
+            self.app_iter.close()
+
+
+class FollowerBody:
+    """
+    Body of a waiting request, reads the chunks of the first request as they come
+    """
+
+    def __init__(self, flight, timeout):
+        self.flight = flight
+        self.timeout = timeout
+        self.position = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            chunk = self.flight.get(self.position, self.timeout)
+        except FlightAborted:
+            LOGGER.info("The coalesced response is aborted")
+            self.close()
+            raise
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        self.position += 1
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.leave(self.position)
+
+
+class SingleFlightMiddleware:
+    """
+    Identical GETs that come while the first one is being processed wait for it and get a copy of its response
+    instead of loading, masking and rendering the same data again.
+    Requests are identical if they have the same url, Accept header and principals (so the same role,
+    accreditation and masking), except the user name.
+    A request with the SESSION cookie only joins a request that reads at least as fresh data (see DBSessionCookieMiddleware)
+    and only successful responses are shared. It's the innermost tween, so the requests that wait are still admitted,
+    timed and limited by their query budget as usual.
+    The body isn't buffered: streamed listings are rendered once, while the first request is sent,
+    and every chunk is passed to the waiting requests as it's produced (see Flight).
+    If the first response is aborted, the others are aborted as well
+    """
+    ignored_principals = ("system.Everyone", "system.Authenticated")
+
+    def __init__(self, handler, registry):
+        self.handler = handler
+        self.enabled = getattr(registry, "single_flight", False)
+        self.timeout = getattr(registry, "single_flight_timeout", 30)
+        self.flights = {}
+        self.lock = Lock()
+
+    def get_key(self, request):
+        userid = request.unauthenticated_userid
+        principals = tuple(sorted(
+            p for p in request.effective_principals
+            if p != userid and p not in self.ignored_principals
+        ))
+        return request.path_qs, request.headers.get("Accept"), principals
+
+    def __call__(self, request):
+        if not self.enabled or request.method != "GET":
+            return self.handler(request)
+        key = self.get_key(request)
+        session = get_db_session()
+        operation_time = getattr(session, "operation_time", None)
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight(operation_time)
+                leader = True
+            elif operation_time is None or (
+                flight.operation_time is not None and flight.operation_time >= operation_time
+            ):
+                leader = False
+                flight.followers += 1
+            else:
+                return self.handler(request)
+
+        if leader:
+            return self.lead(request, key, flight)
+        if flight.done.wait(self.timeout) and flight.response is not None:
+            COALESCED_REQUESTS.inc()
+            return self.copy_response(flight.response, FollowerBody(flight, self.timeout))
+        # the first request has failed or takes too long
+        flight.leave(0)
+        return self.handler(request)
+
+    def lead(self, request, key, flight):
+        try:
+            response = self.handler(request)
+            if response.status_code == 200:
+                # errors aren't shared, the waiting requests are processed on their own then
+                content_length = response.content_length
+                response.app_iter = LeaderBody(flight, response.app_iter)
+                response.content_length = content_length
+                flight.response = response
+            return response
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    @staticmethod
+    def copy_response(response, app_iter):
+        return Response(
+            app_iter=app_iter,
+            status=response.status,
+            # every request gets its own cookies (SESSION)
+            headerlist=[(k, v) for k, v in response.headerlist if k.lower() != "set-cookie"],
+        )
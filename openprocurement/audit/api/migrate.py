@@ -0,0 +1,50 @@
+# pylint: disable=wrong-import-position
+
+if __name__ == "__main__":
+    from gevent import monkey
+
+    monkey.patch_all(thread=False, select=False)
+
+# Data migrations of the plugins (openprocurement.audit.api.migrations entry points),
+# run once per release next to the index builds instead of at every worker start
+#
+#     python -m openprocurement.audit.api.migrate -p etc/service.ini [name ...]
+#
+# every entry point is called with the app registry (registry.mongodb is the store)
+import argparse
+import logging
+
+from pkg_resources import iter_entry_points
+from pyramid.paster import bootstrap
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+def run(registry, names=()):
+    for entry_point in iter_entry_points("openprocurement.audit.api.migrations"):
+        if names and entry_point.name not in names:
+            continue
+        logger.info(f"Migration {entry_point.name}")
+        plugin = entry_point.load()
+        plugin(registry)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data migrations of the plugins")
+    parser.add_argument(
+        "-p",
+        required=True,
+        help="Path to service.ini file",
+    )
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="Entry point names of the migrations to run, all of them by default",
+    )
+    args = parser.parse_args()
+    env = bootstrap(args.p)
+    try:
+        run(env["registry"], args.names)
+    finally:
+        env['closer']()
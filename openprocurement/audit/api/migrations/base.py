@@ -0,0 +1,228 @@
+"""
+Runner for data migrations
+
+Collections are split into _id ranges that are processed by worker processes,
+documents are read in batches sorted by _id and written with bulk_write.
+Progress of every range is saved to the migrations collection after every batch,
+so a restarted migration continues from the last saved _id of every range.
+Batches are not started while secondaries are lagging behind more than --max-lag seconds.
+
+A migration is a BaseMigration subclass with get_update (or process_batch) and a main call:
+
+    class Migration(BaseMigration):
+        name = "add_field"
+        filter = {"field": {"$exists": False}}
+
+        def get_update(self, collection_name, document):
+            return UpdateOne({"_id": document["_id"]}, {"$set": {"field": 1}})
+
+    if __name__ == "__main__":
+        main(Migration)
+"""
+import argparse
+import logging
+import multiprocessing
+from functools import partial
+
+from pyramid.paster import bootstrap
+
+from openprocurement.audit.api.database import wait_for_replication
+
+logger = logging.getLogger(__name__)
+
+WORKER_ENV = {}
+
+
+class BaseMigration:
+    name = None
+    collections = ("monitoring", "inspection", "request")
+    filter = {}
+    projection = None
+
+    def __init__(self, args):
+        self.args = args
+
+    def get_update(self, collection_name, document):
+        """
+        :return: a pymongo write operation for the document or None to skip it
+        """
+        raise NotImplementedError
+
+    def process_batch(self, mongodb, collection_name, documents):
+        """
+        :return: number of updated documents
+        """
+        operations = []
+        for document in documents:
+            operation = self.get_update(collection_name, document)
+            if operation is not None:
+                operations.append(operation)
+        if operations:
+            getattr(mongodb, collection_name).collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+
+def get_checkpoints_collection(mongodb):
+    return mongodb.database.migrations
+
+
+def get_id_ranges(parts):
+    """
+    Splits the _id space into ranges by hex prefixes, as ids are uuid4 hex strings.
+    The first and the last ranges are open, so ids of any other format are processed too
+    """
+    prefix_length = 1
+    while 16 ** prefix_length < parts:
+        prefix_length += 1
+    total = 16 ** prefix_length
+    bounds = [format(total * i // parts, f"0{prefix_length}x") for i in range(1, parts)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def get_range_filter(checkpoint):
+    id_filter = {}
+    if checkpoint.get("last_id") is not None:
+        id_filter["$gt"] = checkpoint["last_id"]
+    elif checkpoint["start"] is not None:
+        id_filter["$gte"] = checkpoint["start"]
+    if checkpoint["end"] is not None:
+        id_filter["$lt"] = checkpoint["end"]
+    return {"_id": id_filter} if id_filter else {}
+
+
+def init_worker(config_uri):
+    WORKER_ENV.update(bootstrap(config_uri))
+
+
+def process_range(migration, checkpoint_id):
+    mongodb = WORKER_ENV["registry"].mongodb
+    checkpoints = get_checkpoints_collection(mongodb)
+    checkpoint = checkpoints.find_one({"_id": checkpoint_id})
+    collection_name = checkpoint["collection"]
+    collection = getattr(mongodb, collection_name).collection
+    count = checkpoint.get("count", 0)
+    while True:
+        wait_for_replication(mongodb, migration.args.max_lag)
+        documents = list(
+            collection.find(
+                {**migration.filter, **get_range_filter(checkpoint)},
+                projection=migration.projection,
+            ).sort("_id", 1).limit(migration.args.b)
+        )
+        if not documents:
+            break
+        count += migration.process_batch(mongodb, collection_name, documents)
+        checkpoint["last_id"] = documents[-1]["_id"]
+        checkpoints.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": checkpoint["last_id"], "count": count}},
+        )
+    checkpoints.update_one({"_id": checkpoint_id}, {"$set": {"done": True}})
+    return collection_name, count
+
+
+def get_pending_checkpoints(migration, mongodb):
+    checkpoints = get_checkpoints_collection(mongodb)
+    if migration.args.restart:
+        checkpoints.delete_many({"migration": migration.name})
+    pending = []
+    for collection_name in migration.collections:
+        if not getattr(mongodb, collection_name, None):  # plugins are optional
+            continue
+        # ranges are saved on the first run, so a restart with a different --parts continues the same ranges
+        if not checkpoints.count_documents({"migration": migration.name, "collection": collection_name}):
+            checkpoints.insert_many([
+                {
+                    "_id": f"{migration.name}.{collection_name}.{i}",
+                    "migration": migration.name,
+                    "collection": collection_name,
+                    "start": start,
+                    "end": end,
+                    "done": False,
+                }
+                for i, (start, end) in enumerate(get_id_ranges(migration.args.parts))
+            ])
+        pending.extend(
+            checkpoint["_id"]
+            for checkpoint in checkpoints.find(
+                {"migration": migration.name, "collection": collection_name, "done": False},
+                projection={"_id": 1},
+            ).sort("_id", 1)
+        )
+    return pending
+
+
+def run(migration, env):
+    logger.info("Starting migration: %s", migration.name)
+    args = migration.args
+    pending = get_pending_checkpoints(migration, env["registry"].mongodb)
+    logger.info(f"{len(pending)} ranges to process")
+
+    counts = {}
+    if args.w > 1:
+        # spawned workers don't share the parent's mongodb connections (and its gevent patching)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.w, initializer=init_worker, initargs=(args.p,)) as pool:
+            results = pool.imap_unordered(partial(process_range, migration), pending)
+            for i, (collection_name, count) in enumerate(results, start=1):
+                counts[collection_name] = counts.get(collection_name, 0) + count
+                logger.info(f"Processed {i}/{len(pending)} ranges: updated {counts}")
+    else:
+        WORKER_ENV.update(env)
+        for i, checkpoint_id in enumerate(pending, start=1):
+            collection_name, count = process_range(migration, checkpoint_id)
+            counts[collection_name] = counts.get(collection_name, 0) + count
+            logger.info(f"Processed {i}/{len(pending)} ranges: updated {counts}")
+
+    logger.info(f"Total documents updated: {sum(counts.values())}")
+    logger.info(f"Successful migration: {migration.name}")
+    return counts
+
+
+def get_parser(description=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-p",
+        required=True,
+        help="Path to service.ini file",
+    )
+    parser.add_argument(
+        "-b",
+        type=int,
+        default=1000,
+        help="Number of documents read and written in one batch",
+    )
+    parser.add_argument(
+        "-w",
+        type=int,
+        default=4,
+        help="Number of worker processes",
+    )
+    parser.add_argument(
+        "--parts",
+        type=int,
+        default=64,
+        help="Number of _id ranges every collection is split into",
+    )
+    parser.add_argument(
+        "--max-lag",
+        type=float,
+        default=10,
+        help="Replication lag in seconds to wait for before reading the next batch",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Drop the saved progress and start from the beginning",
+    )
+    return parser
+
+
+def main(migration_class, parser=None):
+    parser = parser or get_parser()
+    args = parser.parse_args()
+    env = bootstrap(args.p)
+    try:
+        run(migration_class(args), env)
+    finally:
+        env['closer']()
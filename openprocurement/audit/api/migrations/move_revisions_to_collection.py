@@ -0,0 +1,53 @@
+# pylint: disable=wrong-import-position
+
+if __name__ == "__main__":
+    from gevent import monkey
+
+    monkey.patch_all(thread=False, select=False)
+
+import logging
+import os
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from openprocurement.audit.api.migrations.base import BaseMigration, get_parser, main
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class Migration(BaseMigration):
+    name = os.path.basename(__file__).split(".")[0]
+    filter = {"revisions": {"$exists": True}}
+    projection = {"revisions": 1}
+
+    def process_batch(self, mongodb, collection_name, documents):
+        revisions = [
+            # ids depend on the position, so the documents are skipped if the batch is processed again
+            {
+                "_id": f"{document['_id']}-{i}",
+                "object_name": collection_name,
+                "object_id": document["_id"],
+                **revision,
+            }
+            for document in documents
+            for i, revision in enumerate(document["revisions"])
+        ]
+        if revisions:
+            try:
+                mongodb.revision.collection.insert_many(revisions, ordered=False)
+            except BulkWriteError as e:
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+                    raise
+        # _rev and public_modified are not changed, api saves keep the revisions that are still there
+        getattr(mongodb, collection_name).collection.bulk_write(
+            [UpdateOne({"_id": document["_id"]}, {"$unset": {"revisions": ""}}) for document in documents],
+            ordered=False,
+        )
+        return len(documents)
+
+
+if __name__ == "__main__":
+    main(Migration, get_parser())
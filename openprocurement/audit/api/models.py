@@ -13,6 +13,7 @@ from openprocurement.audit.api.constants import ORA_CODES
 from openprocurement.audit.api.types import IsoDateTimeType, ListType, HashType
 from openprocurement.audit.api.utils import set_parent
 from openprocurement.audit.api.context import get_now
+from openprocurement.audit.api.metrics import timed
 
 
 schematics_default_role = blacklist("__parent__")
@@ -96,6 +97,10 @@ class Model(SchematicsModel):
             return True
         return NotImplemented
 
+    @timed("serialize")
+    def serialize(self, *args, **kwargs):
+        return super(Model, self).serialize(*args, **kwargs)
+
     def convert(self, raw_data, **kw):
         """
         Converts the raw data into richer Python constructs according to the
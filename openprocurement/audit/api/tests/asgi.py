@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+from base64 import b64encode
+from urllib.parse import urlsplit
+
+from pyramid.paster import get_appsettings
+
+from openprocurement.audit.api.asgi import ReadOnlyApp
+from openprocurement.audit.api.constants import ROUTE_PREFIX
+
+
+class ASGITestMixin:
+    """
+    Runs the asgi app next to the WSGI app of a BaseWebTest with the same tests.ini,
+    so their responses can be compared
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(ASGITestMixin, cls).setUpClass()
+        cls.loop = asyncio.new_event_loop()
+        cls.asgi_app = ReadOnlyApp(get_appsettings(os.path.join(cls.relative_to, "tests.ini")))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(cls.asgi_app.mongodb.connection.close())
+        cls.loop.close()
+        super(ASGITestMixin, cls).tearDownClass()
+
+    def asgi_request(self, url, method="GET", auth=None):
+        url = urlsplit(url if url.startswith(ROUTE_PREFIX) else ROUTE_PREFIX + url)
+        headers = [(b"host", b"localhost")]
+        if auth:
+            headers.append((b"authorization", b"Basic " + b64encode("{}:{}".format(*auth).encode())))
+        scope = {
+            "type": "http",
+            "method": method,
+            "scheme": "http",
+            "server": ("localhost", 80),
+            "root_path": "",
+            "path": url.path,
+            "query_string": url.query.encode(),
+            "headers": headers,
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.asgi_app(scope, receive, send))
+        start, *body = messages
+        headers = {k.decode(): v.decode() for k, v in start["headers"]}
+        return start["status"], headers, b"".join(m["body"] for m in body)
+
+    def assert_same(self, url, auth=None):
+        self.app.authorization = ("Basic", auth) if auth else None
+        response = self.app.get(url, status="*")
+        status, headers, body = self.asgi_request(url, auth=auth)
+        self.assertEqual(status, response.status_code)
+        self.assertEqual(headers["content-type"], response.content_type)
+        self.assertEqual(json.loads(body), response.json)
+        return json.loads(body)
@@ -0,0 +1,99 @@
+import unittest
+
+from openprocurement.audit.api.admission import AdmissionController
+from openprocurement.audit.api.tests.base import BaseWebTest
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def test_estimate_cost(self):
+        admission = AdmissionController(capacity=10, route_costs={"health": 0, "Monitoring count": 5})
+        self.assertEqual(admission.estimate_cost("Monitoring", {}), 1)
+        self.assertEqual(admission.estimate_cost("health", {"limit": "1000"}), 0)
+        self.assertEqual(admission.estimate_cost("Monitoring count", {}), 5)
+        self.assertEqual(
+            admission.estimate_cost("Monitorings", {"limit": "1000", "opt_fields": "posts,documents,parties"}),
+            25,
+        )
+        self.assertEqual(admission.estimate_cost("Monitorings", {"limit": "a"}), 1)
+
+    def test_estimate_cost_capped(self):
+        admission = AdmissionController(
+            capacity=10,
+            max_limit=1000,
+            route_opt_fields={"Monitorings": {"posts", "documents"}},
+        )
+        self.assertEqual(admission.estimate_cost("Monitorings", {"limit": "10000000"}), 10)
+        self.assertEqual(
+            admission.estimate_cost("Monitorings", {"opt_fields": "posts,posts,posts,unknown,documents"}),
+            2,
+        )
+        self.assertEqual(admission.estimate_cost("Monitoring", {"opt_fields": "a,a,b"}), 2)
+
+    def test_take_tokens(self):
+        admission = AdmissionController(capacity=0, client_rate=10, client_burst=30)
+        self.assertIsNone(admission.take_tokens("broker", 25))
+        self.assertEqual(admission.take_tokens("broker", 25), 2)
+        self.assertIsNone(admission.take_tokens("sas", 1))
+
+    def test_expensive_request_with_full_bucket(self):
+        admission = AdmissionController(capacity=0, client_rate=1, client_burst=5)
+        self.assertIsNone(admission.take_tokens("broker", 50))
+        self.assertEqual(admission.take_tokens("broker", 1), 1)  # no debt beyond the burst
+
+    def test_client_address(self):
+        admission = AdmissionController(capacity=0, client_rate=1)
+        self.assertEqual(admission.get_client_address("10.0.0.1", "1.1.1.1"), "10.0.0.1")
+
+        admission = AdmissionController(capacity=0, client_rate=1, trusted_proxies=1)
+        self.assertEqual(admission.get_client_address("10.0.0.1", "spoofed, 1.1.1.1"), "1.1.1.1")
+        self.assertEqual(admission.get_client_address("10.0.0.1", None), "10.0.0.1")
+
+        admission = AdmissionController(capacity=0, client_rate=1, trusted_proxies=2)
+        self.assertEqual(admission.get_client_address("10.0.0.2", "spoofed, 1.1.1.1, 10.0.0.1"), "1.1.1.1")
+        self.assertEqual(admission.get_client_address("10.0.0.2", "10.0.0.1"), "10.0.0.2")
+
+    def test_capacity(self):
+        admission = AdmissionController(capacity=10, queue_timeout=0.01)
+        self.assertTrue(admission.acquire(8))
+        self.assertFalse(admission.acquire(5))
+        self.assertTrue(admission.acquire(1))  # cheap requests aren't queued
+        admission.release(8)
+        self.assertTrue(admission.acquire(50))  # runs alone
+        self.assertEqual(admission.in_progress, 10)
+        admission.release(50)
+        self.assertEqual(admission.in_progress, 0)
+
+
+class AdmissionControlMiddlewareTest(BaseWebTest):
+
+    def setUp(self):
+        super(AdmissionControlMiddlewareTest, self).setUp()
+        self.app.app.registry.admission = AdmissionController(
+            capacity=0, client_rate=0.1, client_burst=2, route_costs={"health": 0},
+        )
+
+    def tearDown(self):
+        self.app.app.registry.admission = None
+        super(AdmissionControlMiddlewareTest, self).tearDown()
+
+    def test_too_many_requests(self):
+        self.app.get('/spore')
+        self.app.get('/spore')
+        response = self.app.get('/spore', status=429)
+        self.assertEqual(response.headers["Retry-After"], "10")
+        self.assertEqual(
+            response.json["errors"],
+            [{"location": "url", "name": "client", "description": "Too many requests"}],
+        )
+
+        # other clients and the free routes aren't limited
+        self.app.authorization = ('Basic', ('broker', 'broker'))
+        self.app.get('/spore')
+        self.app.authorization = None
+        self.app.get('/health', status="*")
+
+    def test_forwarded_for_not_trusted(self):
+        self.app.get('/spore', headers={"X-Forwarded-For": "1.1.1.1"})
+        self.app.get('/spore', headers={"X-Forwarded-For": "1.1.1.2"})
+        self.app.get('/spore', headers={"X-Forwarded-For": "1.1.1.3"}, status=429)
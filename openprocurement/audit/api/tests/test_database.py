@@ -0,0 +1,437 @@
+import unittest
+from datetime import datetime
+from threading import Event
+from types import SimpleNamespace
+
+from bson import decode, encode
+from bson.binary import Binary
+from bson.timestamp import Timestamp
+from gevent import sleep
+from pymongo import ASCENDING, IndexModel, ReadPreference
+from pymongo.errors import OperationFailure
+from pymongo.hello import Hello
+from pymongo.server_description import ServerDescription
+from pymongo.topology_description import TOPOLOGY_TYPE, TopologyDescription
+
+from openprocurement.audit.api.database import (
+    COMPRESSED_TEXT_SUBTYPE, READ_SERVERS, SERVER_SELECTION, ChangeWaiters, CompressedText, CountCache, ListingQuery, MongodbStore,
+    QueryPlanError, change_matches, codec_options, get_listing_index, get_plan_stages, select_servers,
+)
+from openprocurement.audit.api.memory import DATABASES, MemoryClient
+from openprocurement.audit.api.metrics import HEDGED_READS
+
+
+class UpdatePipelineTest(unittest.TestCase):
+
+    def test_changed_fields(self):
+        src = {"_id": "a", "_rev": "1-a", "status": "active", "owner": "broker", "public_modified": 1.1}
+        data = {"_id": "a", "_rev": "2-b", "status": "addressed", "public_modified": 1.1}
+        self.assertEqual(
+            MongodbStore.get_update_pipeline(src, data),
+            [
+                {"$set": {"_rev": {"$literal": "2-b"}, "status": {"$literal": "addressed"}}},
+                {"$unset": ["owner"]},
+            ]
+        )
+
+    def test_appended_items(self):
+        src = {"posts": [{"id": "1"}]}
+        data = {"posts": [{"id": "1"}, {"id": "2"}]}
+        self.assertEqual(
+            MongodbStore.get_update_pipeline(src, data),
+            [{"$set": {"posts": {"$concatArrays": ["$posts", {"$literal": [{"id": "2"}]}]}}}]
+        )
+
+    def test_changed_items(self):
+        src = {"posts": [{"id": "1"}, {"id": "2"}, {"id": "3"}]}
+        data = {"posts": [{"id": "1"}, {"id": "2", "title": "changed"}, {"id": "3"}]}
+        self.assertEqual(
+            MongodbStore.get_update_pipeline(src, data),
+            [{"$set": {"posts": {"$map": {
+                "input": {"$range": [0, 3]},
+                "as": "i",
+                "in": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$$i", 1]}, "then": {"$literal": {"id": "2", "title": "changed"}}},
+                    ],
+                    "default": {"$arrayElemAt": ["$posts", "$$i"]},
+                }},
+            }}}}]
+        )
+
+    def test_removed_items(self):
+        src = {"posts": [{"id": "1"}, {"id": "2"}]}
+        data = {"posts": [{"id": "2"}]}
+        self.assertEqual(
+            MongodbStore.get_update_pipeline(src, data),
+            [{"$set": {"posts": {"$literal": [{"id": "2"}]}}}]
+        )
+
+
+class CompressedTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = MongodbStore.__new__(MongodbStore)
+        self.store.compressed_text_fields = {"description"}
+        self.store.compressed_text_min_size = 10
+
+    def test_compress_text(self):
+        data = {
+            "description": "Опис " * 10,
+            "title": "Назва " * 10,
+            "posts": [{"description": "short"}, {"description": "Текст " * 10}],
+        }
+        stored = self.store.compress_text(data)
+        self.assertIsInstance(stored["description"], CompressedText)
+        self.assertIsInstance(stored["title"], str)
+        self.assertIsInstance(stored["posts"][0]["description"], str)
+        self.assertIsInstance(stored["posts"][1]["description"], CompressedText)
+        self.assertEqual(stored, data)
+        self.assertIsInstance(data["description"], str)
+
+    def test_codec(self):
+        raw = encode(
+            {"description": CompressedText("Опис " * 10), "other": Binary(b"data", 5)},
+            codec_options=codec_options,
+        )
+        self.assertEqual(decode(raw)["description"].subtype, COMPRESSED_TEXT_SUBTYPE)
+        self.assertEqual(
+            decode(raw, codec_options=codec_options),
+            {"description": "Опис " * 10, "other": Binary(b"data", 5)},
+        )
+
+    def test_update_pipeline(self):
+        src = {"description": "Опис " * 10, "title": "a"}
+        data = self.store.compress_text({"description": "Опис " * 10, "title": "b"})
+        self.assertEqual(
+            MongodbStore.get_update_pipeline(src, data),
+            [{"$set": {"title": {"$literal": "b"}}}],
+        )
+
+
+class FakeCollection:
+
+    def __init__(self, read_preference):
+        self.read_preference = read_preference
+
+    def with_options(self, read_preference):
+        return FakeCollection(read_preference)
+
+
+def get_topology_description(hosts=("secondary1", "primary", "secondary2")):
+    members = [f"{host}:27017" for host in hosts]
+    servers = [
+        ServerDescription(
+            (host, 27017),
+            Hello({
+                "ok": 1,
+                "isWritablePrimary": host == "primary",
+                "secondary": host != "primary",
+                "setName": "rs",
+                "hosts": members,
+                "maxWireVersion": 21,
+                "lastWrite": {"lastWriteDate": datetime.utcnow()},
+            }),
+            round_trip_time=0.001,
+        )
+        for host in hosts
+    ]
+    return TopologyDescription(
+        TOPOLOGY_TYPE.ReplicaSetWithPrimary,
+        {server.address: server for server in servers},
+        "rs",
+        None,
+        None,
+        SimpleNamespace(heartbeat_frequency=10, local_threshold_ms=15),
+    )
+
+
+class ReplicaReadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = MongodbStore.__new__(MongodbStore)
+        self.store.connection = SimpleNamespace(topology_description=get_topology_description())
+        self.store.database = SimpleNamespace(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.store.max_staleness = {"object": 0, "listing": 120, "feed": 90}
+        self.store.hedge_delay = 0.01
+        self.secondary = FakeCollection(self.store.get_read_preference("listing"))
+        HEDGED_READS.values.clear()
+
+    def test_read_preference(self):
+        self.assertIs(self.store.get_read_preference("object"), ReadPreference.SECONDARY_PREFERRED)
+        read_preference = self.store.get_read_preference("feed")
+        self.assertEqual(read_preference.mode, ReadPreference.SECONDARY_PREFERRED.mode)
+        self.assertEqual(read_preference.max_staleness, 90)
+        self.store.database.read_preference = ReadPreference.PRIMARY
+        self.assertIs(self.store.get_read_preference("feed"), ReadPreference.PRIMARY)
+
+    def test_fast_read(self):
+        result = self.store.hedged_read(self.secondary, lambda c, session: c.read_preference.name)
+        self.assertEqual(result, "SecondaryPreferred")
+        self.assertEqual(HEDGED_READS.values, {})
+
+    def test_slow_secondary(self):
+        def read(collection, session):
+            if collection.read_preference.mode != ReadPreference.NEAREST.mode:
+                sleep(0.2)
+            return collection.read_preference
+
+        read_preference = self.store.hedged_read(self.secondary, read)
+        self.assertEqual(read_preference.name, "Nearest")
+        # the hedged read isn't staler than the first one
+        self.assertEqual(read_preference.max_staleness, 120)
+        self.assertEqual(HEDGED_READS.values, {("sent",): 1, ("won",): 1})
+
+    def select_server(self, collection):
+        """
+        Selects the server the way the client does and publishes the command sent to it
+        """
+        servers = self.store.connection.topology_description.apply_selector(
+            collection.read_preference, custom_selector=select_servers,
+        )
+        address = servers[0].address
+        READ_SERVERS.started(SimpleNamespace(connection_id=address))
+        return address
+
+    def test_hedge_to_another_member(self):
+        addresses = []
+
+        def read(collection, session):
+            addresses.append(self.select_server(collection))
+            if len(addresses) == 1:
+                sleep(0.2)
+            return addresses[-1]
+
+        result = self.store.hedged_read(self.secondary, read)
+        first, hedge = addresses
+        self.assertEqual(first, ("secondary1", 27017))
+        # the slow member is the first one Nearest picks as well, the hedged read is sent to another one
+        self.assertNotEqual(hedge, first)
+        self.assertEqual(result, hedge)
+        self.assertEqual(HEDGED_READS.values, {("sent",): 1, ("won",): 1})
+
+    def test_no_other_member(self):
+        self.store.connection.topology_description = get_topology_description(hosts=("primary",))
+        addresses = []
+
+        def read(collection, session):
+            addresses.append(self.select_server(collection))
+            sleep(0.05)
+            return addresses[-1]
+
+        self.assertEqual(self.store.hedged_read(self.secondary, read), ("primary", 27017))
+        self.assertEqual(len(addresses), 1)
+        self.assertEqual(HEDGED_READS.values, {})
+
+    def test_failed_secondary(self):
+        def read(collection, session):
+            if collection.read_preference.mode != ReadPreference.NEAREST.mode:
+                sleep(0.05)
+                raise ValueError
+            sleep(0.1)
+            return collection.read_preference.name
+
+        self.assertEqual(self.store.hedged_read(self.secondary, read), "Nearest")
+
+    def test_both_failed(self):
+        def read(collection, session):
+            sleep(0.05)
+            raise ValueError(collection.read_preference.name)
+
+        with self.assertRaisesRegex(ValueError, "SecondaryPreferred"):
+            self.store.hedged_read(self.secondary, read)
+
+    def test_primary(self):
+        self.store.hedge_delay = 0
+        self.assertEqual(self.store.hedged_read(self.secondary, lambda c, session: 1), 1)
+        self.store.hedge_delay = 0.01
+        primary = FakeCollection(ReadPreference.PRIMARY)
+        self.assertEqual(self.store.hedged_read(primary, lambda c, session: 1), 1)
+        self.assertEqual(HEDGED_READS.values, {})
+
+
+class FakeAdmin:
+    """
+    Operations by server of the $currentOp aggregation of MongodbStore.kill_queries
+    """
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.killed = []
+
+    def aggregate(self, pipeline):
+        address = SERVER_SELECTION.only
+        if address == ("c", 27017):
+            raise OperationFailure("not authorized")
+        comment = pipeline[1]["$match"]["$or"][0]["command.comment"]
+        return [op for op in self.operations.get(address, []) if op["comment"] == comment]
+
+    def command(self, name, op, read_preference):
+        self.killed.append((SERVER_SELECTION.only, op))
+
+
+class KillQueriesTest(unittest.TestCase):
+
+    def test_select_servers(self):
+        servers = [SimpleNamespace(address=("a", 27017)), SimpleNamespace(address=("b", 27017))]
+        self.assertEqual(select_servers(servers), servers)
+        SERVER_SELECTION.only = ("b", 27017)
+        try:
+            self.assertEqual(select_servers(servers), servers[1:])
+        finally:
+            SERVER_SELECTION.only = None
+
+    def test_kill_on_every_member(self):
+        admin = FakeAdmin({
+            ("a", 27017): [{"opid": 1, "comment": "req:1"}, {"opid": 2, "comment": "req:2"}],
+            ("b", 27017): [{"opid": 3, "comment": "req:1"}],
+        })
+        servers = {
+            address: SimpleNamespace(address=address, is_readable=address != ("d", 27017))
+            for address in (("a", 27017), ("b", 27017), ("c", 27017), ("d", 27017))
+        }
+        store = MongodbStore.__new__(MongodbStore)
+        store.connection = SimpleNamespace(
+            get_database=lambda name, read_preference: admin,
+            topology_description=SimpleNamespace(server_descriptions=lambda: servers),
+        )
+        with self.assertLogs("openprocurement.audit.api.database", "WARNING"):  # c has failed
+            self.assertEqual(store.kill_queries("req:1"), 2)
+        self.assertEqual(admin.killed, [(("a", 27017), 1), (("b", 27017), 3)])
+        self.assertIsNone(SERVER_SELECTION.only)
+
+
+class CountCacheTest(unittest.TestCase):
+
+    def test_stale(self):
+        cache = CountCache(60)
+        self.assertEqual(cache.get(False), (None, False))
+        cache.set(False, 1)
+        self.assertEqual(cache.get(False), (1, False))
+        self.assertEqual(cache.get(True), (None, False))
+
+        count, updated = cache.data[False]
+        cache.data[False] = (count, updated - 61)
+        self.assertEqual(cache.get(False), (1, True))
+        self.assertEqual(cache.get(False), (1, False))  # is being refreshed by the first one
+        cache.set(False, 2)
+        self.assertEqual(cache.get(False), (2, False))
+
+
+class ChangeWaitersTest(unittest.TestCase):
+    filters = {"is_test": False, "public_modified": {"$gt": 10}}
+
+    @staticmethod
+    def change(time, **fields):
+        return {"operationType": "insert", "clusterTime": Timestamp(time, 0), "fullDocument": fields}
+
+    def test_change_matches(self):
+        self.assertTrue(change_matches(self.change(1, is_test=False, public_modified=11), self.filters))
+        self.assertFalse(change_matches(self.change(1, is_test=True, public_modified=11), self.filters))
+        self.assertFalse(change_matches(self.change(1, is_test=False, public_modified=10), self.filters))
+        # the fields that aren't in the change don't rule it out
+        update = {"operationType": "update", "updateDescription": {"updatedFields": {"public_modified": 12}}}
+        self.assertTrue(change_matches(update, self.filters))
+        self.assertTrue(change_matches({"operationType": "replace"}, self.filters))
+
+    def test_notify(self):
+        waiters = ChangeWaiters(Event)
+        event = waiters.add(self.filters)
+        other = waiters.add({"is_test": True})
+        waiters.notify(self.change(1, is_test=False, public_modified=11))
+        self.assertTrue(event.is_set())
+        self.assertFalse(other.is_set())
+        waiters.remove(event)
+        waiters.remove(other)
+        self.assertEqual(len(waiters), 0)
+
+    def test_changes_before_added(self):
+        waiters = ChangeWaiters(Event, start_time=Timestamp(5, 0), size=2)
+        waiters.notify(self.change(6, is_test=False, public_modified=11))
+        self.assertTrue(waiters.add(self.filters, Timestamp(5, 1)).is_set())
+        self.assertFalse(waiters.add(self.filters, Timestamp(6, 0)).is_set())  # has read the change
+        self.assertFalse(waiters.add({"is_test": True}, Timestamp(5, 1)).is_set())
+        # older than the stream
+        self.assertTrue(waiters.add(self.filters, Timestamp(4, 0)).is_set())
+
+        # older than all the kept changes
+        waiters.notify(self.change(7, is_test=True))
+        waiters.notify(self.change(8, is_test=True))
+        self.assertTrue(waiters.add({"is_test": False}, Timestamp(6, 1)).is_set())
+        self.assertFalse(waiters.add({"is_test": False}, Timestamp(7, 0)).is_set())
+
+    def test_restart(self):
+        waiters = ChangeWaiters(Event)
+        event = waiters.add(self.filters)
+        waiters.restart(Timestamp(9, 0))
+        self.assertTrue(event.is_set())
+        self.assertEqual(waiters.start_time, Timestamp(9, 0))
+
+
+class ListingQueriesTest(unittest.TestCase):
+    listing_queries = (
+        ListingQuery("real_by_public_modified", "public_modified", {"is_test": False, "is_public": True}),
+        ListingQuery("all_by_public_modified", "public_modified", {"is_public": True}),
+        ListingQuery("by_tender_id", "dateCreated", fields={"tender_id"}, optional_fields={"is_test"}),
+        ListingQuery("by_date", "dateCreated"),
+    )
+
+    def setUp(self):
+        self.collection = MemoryClient().get_database("test_queries").items
+        self.addCleanup(DATABASES.pop, "test_queries", None)
+        self.collection.create_indexes([
+            IndexModel([("public_modified", ASCENDING)], name="real_by_public_modified",
+                       partialFilterExpression={"is_test": False, "is_public": True}),
+            IndexModel([("public_modified", ASCENDING), ("key", ASCENDING)], name="all_by_public_modified",
+                       partialFilterExpression={"is_public": True}),
+            IndexModel([("tender_id", ASCENDING), ("dateCreated", ASCENDING)], name="by_tender_id"),
+        ])
+
+    def test_get_listing_index(self):
+        def index(filters, sort="public_modified"):
+            return get_listing_index(self.listing_queries, filters, sort)
+
+        self.assertEqual(index({"is_test": False, "is_public": True}), "real_by_public_modified")
+        self.assertEqual(index({"is_test": False, "is_public": True, "public_modified": {"$gt": 1}}),
+                         "real_by_public_modified")
+        self.assertEqual(index({"is_public": True}), "all_by_public_modified")
+        self.assertIsNone(index({"is_test": True, "is_public": True}))
+        self.assertIsNone(index({"is_test": 0, "is_public": True}))
+        self.assertIsNone(index({"is_public": True, "status": "active"}))
+        self.assertIsNone(index({"is_public": True}, sort="dateCreated"))
+
+        self.assertEqual(index({"tender_id": "a"}, sort="dateCreated"), "by_tender_id")
+        self.assertEqual(index({"tender_id": "a", "is_test": True, "_id": {"$nin": []}}, sort="dateCreated"),
+                         "by_tender_id")
+        self.assertEqual(index({}, sort="dateCreated"), "by_date")
+
+    def test_plan_stages(self):
+        plan = {"queryPlan": {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {
+            "stage": "IXSCAN", "indexName": "by_tender_id",
+        }}}}
+        self.assertEqual(get_plan_stages(plan), [("LIMIT", None), ("FETCH", None), ("IXSCAN", "by_tender_id")])
+
+    def test_check_query(self):
+        filters = {"is_test": False, "is_public": True}
+        MongodbStore.check_query(self.collection, filters, "public_modified", "real_by_public_modified")
+        MongodbStore.check_query(
+            self.collection, filters, "public_modified", "all_by_public_modified", hint="all_by_public_modified",
+        )
+        MongodbStore.check_query(self.collection, {"tender_id": "a"}, "dateCreated", "by_tender_id")
+
+    def test_check_query_fails(self):
+        # not registered
+        with self.assertRaisesRegex(QueryPlanError, "isn't pinned to an index"):
+            MongodbStore.check_query(self.collection, {"is_test": True}, "public_modified", None)
+        # the partial filter isn't in the query
+        with self.assertRaisesRegex(QueryPlanError, "has failed"):
+            MongodbStore.check_query(
+                self.collection, {"is_test": False}, "public_modified", "real_by_public_modified",
+                hint="real_by_public_modified",
+            )
+        # the planner would scan the collection
+        with self.assertRaisesRegex(QueryPlanError, "doesn't use by_date"):
+            MongodbStore.check_query(self.collection, {}, "dateCreated", "by_date")
+        # the index doesn't give the sort
+        with self.assertRaisesRegex(QueryPlanError, "doesn't use by_tender_id"):
+            MongodbStore.check_query(self.collection, {"tender_id": "a"}, "status", "by_tender_id", hint="by_tender_id")
@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import Mock
+
+from pymongo import ASCENDING, IndexModel
+
+from openprocurement.audit.api.indexes import get_diff
+
+
+class IndexDiffTest(unittest.TestCase):
+
+    def collection(self, *indexes):
+        collection = Mock()
+        collection.list_indexes.return_value = [
+            {"v": 2, "key": {"_id": 1}, "name": "_id_"},
+        ] + [
+            {"v": 2, "key": dict(index.document["key"]), "name": index.document["name"], "background": True}
+            for index in indexes
+        ]
+        return collection
+
+    def test_up_to_date(self):
+        declared = [IndexModel([("dateModified", ASCENDING)], name="date_modified")]
+        self.assertEqual(get_diff(self.collection(*declared), declared), ([], [], []))
+
+    def test_missing_and_extra(self):
+        declared = [IndexModel([("dateModified", ASCENDING)], name="date_modified")]
+        extra = IndexModel([("status", ASCENDING)], name="status")
+        missing, changed, extra_live = get_diff(self.collection(extra), declared)
+        self.assertEqual(missing, declared)
+        self.assertEqual(changed, [])
+        self.assertEqual([index["name"] for index in extra_live], ["status"])
+
+    def test_changed(self):
+        live = IndexModel([("dateModified", ASCENDING)], name="date_modified")
+        declared = [
+            IndexModel(
+                [("dateModified", ASCENDING)],
+                name="date_modified",
+                partialFilterExpression={"is_public": True},
+            )
+        ]
+        missing, changed, extra = get_diff(self.collection(live), declared)
+        self.assertEqual(missing, [])
+        self.assertEqual([(model, index["name"]) for model, index in changed], [(declared[0], "date_modified")])
+        self.assertEqual(extra, [])
@@ -0,0 +1,59 @@
+import unittest
+from copy import deepcopy
+
+from openprocurement.audit.api.mask import compile_mask_mapping
+from openprocurement.audit.inspection.mask import INSPECTION_MASK_MAPPING
+from openprocurement.audit.monitoring.mask import MONITORING_MASK_MAPPING
+
+
+def document():
+    return {"id": "a" * 32, "title": "doc.txt", "title_en": "doc.txt", "url": "http://localhost/get/1", "format": "text"}
+
+
+class MaskTreeTest(unittest.TestCase):
+
+    def assert_same_as_jsonpath(self, mask_mapping, data):
+        expected = deepcopy(data)
+        mask_mapping.apply_jsonpath(expected)
+        mask_mapping.apply(data)
+        self.assertEqual(data, expected)
+        return data
+
+    def test_monitoring(self):
+        data = {
+            "restricted": True,
+            "decision": {"description": "text", "documents": [document(), document()]},
+            "conclusion": {"auditFinding": "text", "stringsAttached": "text", "documents": []},
+            "cancellation": None,
+            "posts": [
+                {"title": "text", "description": "text", "documents": [document()]},
+                {"title": "text", "description": "text"},
+            ],
+            "liabilities": [{"documents": [document()]}],
+            "eliminationResolution": {"documents": document()},
+            "documents": [document()],
+        }
+        data = self.assert_same_as_jsonpath(MONITORING_MASK_MAPPING, data)
+        self.assertEqual(data["decision"]["documents"][1]["title_en"], "Hidden")
+        self.assertEqual(data["posts"][0]["documents"][0]["url"], "Приховано")
+        self.assertEqual(data["posts"][1], {"title": "Приховано", "description": "Приховано"})
+        self.assertEqual(data["documents"][0]["format"], "text")
+
+    def test_inspection(self):
+        data = {"restricted": True, "description": "text", "documents": [document()]}
+        self.assert_same_as_jsonpath(INSPECTION_MASK_MAPPING, data)
+
+    def test_empty(self):
+        self.assert_same_as_jsonpath(MONITORING_MASK_MAPPING, {})
+        self.assert_same_as_jsonpath(MONITORING_MASK_MAPPING, {"posts": [], "decision": {}, "documents": None})
+
+    def test_unsupported_paths(self):
+        for path in ("$..title", "$.documents[0].title", "$.documents[*]", "$.*"):
+            with self.assertRaises(ValueError):
+                compile_mask_mapping({path: "Hidden"})
+
+    def test_overlapping_paths(self):
+        with self.assertRaises(ValueError):
+            compile_mask_mapping({"$.decision": "Hidden", "$.decision.description": "Hidden"})
+        with self.assertRaises(ValueError):
+            compile_mask_mapping({"$.decision.description": "Hidden", "$.decision": "Hidden"})
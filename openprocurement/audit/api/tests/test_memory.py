@@ -0,0 +1,204 @@
+import unittest
+from threading import Timer
+from unittest import mock
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from openprocurement.audit.api.context import set_now
+from openprocurement.audit.api.database import (
+    COLLECTION_CLASSES, BaseCollection, MongodbResourceConflict, RevisionCollection, get_store,
+)
+from openprocurement.audit.api.memory import DATABASES, MemoryStore
+
+
+class ItemCollection(BaseCollection):
+    object_name = "item"
+
+    def get_indexes(self):
+        return [
+            IndexModel(
+                [("public_modified", ASCENDING), ("existing_key", ASCENDING)],
+                name="test_by_public_modified",
+                partialFilterExpression={"is_test": True},
+            ),
+            IndexModel(
+                [("public_modified", ASCENDING)],
+                name="real_by_public_modified",
+                partialFilterExpression={"is_test": False},
+            ),
+            IndexModel(
+                [("public_modified", ASCENDING), ("surely_existing_key", ASCENDING)],
+                name="all_by_public_modified",
+            ),
+            IndexModel(
+                [("tender_ids", ASCENDING), ("dateCreated", ASCENDING)],
+                name="all_by_tender_ids",
+            ),
+        ]
+
+
+class MemoryStoreTest(unittest.TestCase):
+    settings = {
+        "mongodb.uri": "memory://",
+        "mongodb.db_name": "test_memory",
+        "mongodb.max_pool_size": 1,
+        "mongodb.min_pool_size": 0,
+        "mongodb.item_collection": "items",
+        "mongodb.revision_collection": "revisions",
+        "mongodb.sequence_block_size": 1,
+    }
+
+    def setUp(self):
+        patcher = mock.patch.dict(
+            COLLECTION_CLASSES, {"revision": RevisionCollection, "item": ItemCollection}, clear=True,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(DATABASES.pop, "test_memory", None)
+        self.store = get_store(self.settings)
+        set_now()
+
+    def create(self, uid, mode=None, **data):
+        set_now()  # saves are also made from other threads
+        data = {"id": uid, "dateCreated": uid, **data}
+        if mode:
+            data["mode"] = mode
+        return self.store.item.save_data(data, insert=True)
+
+    def test_uri(self):
+        self.assertIsInstance(self.store, MemoryStore)
+
+    def test_save(self):
+        saved = self.create("a", title="first")
+        self.assertEqual(saved["_rev"].split("-")[0], "2")
+
+        doc = self.store.item.get("a")
+        self.assertEqual(doc["title"], "first")
+        self.assertNotIn("is_test", doc)  # DEFAULT_PROJECTION
+        doc["title"] = "second"
+        updated = self.store.item.save_data(dict(doc))
+        self.assertNotEqual(updated["_rev"], doc["_rev"])
+        self.assertEqual(self.store.item.get("a")["title"], "second")
+
+        # doc has the previous _rev
+        with self.assertRaises(MongodbResourceConflict):
+            self.store.item.save_data(dict(doc))
+        with self.assertRaises(DuplicateKeyError):
+            self.create("a")
+
+    def test_reads_are_copies(self):
+        self.create("a", items=[{"id": "1"}])
+        self.store.item.get("a")["items"].append({"id": "2"})
+        self.assertEqual(self.store.item.get("a")["items"], [{"id": "1"}])
+
+    def test_list(self):
+        for uid in ("a", "b", "c"):
+            self.create(uid, title=uid)
+        self.create("d", mode="test", title="d")
+
+        results = self.store.item.list(fields={"title"}, offset_field="public_modified", filters={"is_test": False},
+                                       raw=True)
+        self.assertEqual([r["data"]["title"] for r in results], ["a", "b", "c"])
+        self.assertEqual(dict(results[0]["data"]), {"id": "a", "title": "a"})
+
+        results = self.store.item.list(fields={"title"}, offset_field="public_modified", filters={"is_test": False},
+                                       offset_value=results[0]["public_modified"], descending=True)
+        self.assertEqual(results, [])
+
+        results = self.store.item.list(fields={"title"}, offset_field="dateCreated", filters={},
+                                       offset_value="b", limit=1)
+        self.assertEqual(results, [{"id": "c", "title": "c", "dateCreated": "c"}])
+
+    def test_partial_indexes(self):
+        self.create("a")
+        self.create("b", mode="test")
+        collection = self.store.item.collection
+
+        def index_name(filters, sort=(("public_modified", 1),)):
+            plan = collection.find(filters, sort=sort).explain()["queryPlanner"]["winningPlan"]
+            return plan.get("inputStage", {}).get("indexName")
+
+        self.assertEqual(index_name({"is_test": True}), "test_by_public_modified")
+        self.assertEqual(index_name({"is_test": False, "public_modified": {"$gt": 0}}), "real_by_public_modified")
+        self.assertEqual(index_name({}), "all_by_public_modified")
+        self.assertEqual(index_name({"tender_ids": "t"}, sort=(("dateCreated", 1),)), "all_by_tender_ids")
+        self.assertIsNone(index_name({"title": "a"}, sort=None))
+
+        self.assertEqual([d["_id"] for d in collection.find({"is_test": True})], ["b"])
+        with self.assertRaises(OperationFailure):
+            list(collection.find({}, hint="test_by_public_modified"))
+
+    def test_missing_hint_index(self):
+        self.create("a", title="a")
+        collection = self.store.item.collection
+        with self.assertLogs("openprocurement.audit.api.database", "WARNING"):
+            results = self.store.list(collection, fields={"title"}, filters={}, hint="not_applied_yet")
+        self.assertEqual([r["title"] for r in results], ["a"])
+
+        with self.assertRaises(OperationFailure):  # the other errors aren't retried
+            self.store.list(collection, fields={"title"}, filters={"title": {"$where": "1"}}, hint="not_applied_yet")
+
+    def test_paging_list(self):
+        for uid in ("a", "b", "c"):
+            self.create(uid, tender_ids=["t", uid])
+
+        results, total = self.store.item.paging_list(
+            limit=2, fields={"dateCreated"}, filters={"tender_ids": "t"}, descending=True,
+        )
+        self.assertEqual([r["_id"] for r in results], ["c", "b"])
+        self.assertEqual(total, 3)
+
+        results, total = self.store.item.paging_list(
+            limit=2, filters={"tender_ids": "t"}, after=("b", ["b"]), count=False,
+        )
+        self.assertEqual([r["_id"] for r in results], ["c"])
+        self.assertIsNone(total)
+
+    def test_sequences(self):
+        self.assertEqual(self.store.get_next_sequence_value("x"), 1)
+        self.assertEqual(self.store.get_next_sequence_value("x"), 2)
+        self.assertEqual(self.store.get_next_sequence_value("y"), 1)
+        self.store.flush_sequences()
+        self.assertEqual(self.store.get_next_sequence_value("x"), 1)
+
+    def test_revisions(self):
+        self.store.item.save_data({"id": "a", "revisions": [{"date": "1", "changes": []}]}, insert=True)
+        results, total = self.store.revision.paging_list(filters={"object_id": "a"}, sort_by="date")
+        self.assertEqual(total, 1)
+        self.assertEqual(results[0]["object_name"], "item")
+
+    def test_revisions_transaction(self):
+        self.create("a", title="first")
+        doc = self.store.item.get("a")
+        with mock.patch.object(RevisionCollection, "insert", side_effect=OperationFailure("insert failed")):
+            with self.assertRaises(OperationFailure):
+                self.store.item.save_data({**doc, "title": "second", "revisions": [{"date": "1", "changes": []}]})
+            with self.assertRaises(OperationFailure):
+                self.store.item.save_data({"id": "b", "revisions": [{"date": "1", "changes": []}]}, insert=True)
+        self.assertEqual(self.store.item.get("a")["title"], "first")
+        self.assertIsNone(self.store.item.get("b"))
+
+        self.store.item.save_data({**doc, "title": "second", "revisions": [{"date": "1", "changes": []}]})
+        self.assertEqual(self.store.item.get("a")["title"], "second")
+
+    def test_wait_for_changes(self):
+        self.assertFalse(self.store.item.wait_for_changes(filters={"is_test": True}, timeout=0.1))
+
+        timer = Timer(0.1, self.create, args=("a",), kwargs={"mode": "test"})
+        timer.start()
+        self.assertTrue(self.store.item.wait_for_changes(filters={"is_test": True}, timeout=5))
+        timer.join()
+
+        # the changes of the other documents don't wake the waiter
+        timer = Timer(0.1, self.create, args=("b",))
+        timer.start()
+        self.assertFalse(self.store.item.wait_for_changes(filters={"is_test": True}, timeout=0.5))
+        timer.join()
+
+    def test_wait_for_changes_shared_stream(self):
+        with mock.patch.object(self.store.item.collection, "watch", wraps=self.store.item.collection.watch) as watch:
+            for _ in range(3):
+                self.assertFalse(self.store.item.wait_for_changes(filters={"is_test": True}, timeout=0.1))
+        self.assertEqual(watch.call_count, 1)
+        self.assertEqual(len(self.store.item.change_waiters), 0)
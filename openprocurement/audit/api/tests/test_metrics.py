@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from openprocurement.audit.api.context import set_timings
+from openprocurement.audit.api.metrics import (
+    Counter, Gauge, Histogram, MultiprocessValues, RequestTimings, ValuesFile, timed, generate_latest, spawn,
+    GREENLETS, REQUEST_DURATION,
+)
+from openprocurement.audit.api.tests.base import BaseWebTest
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_collect(self):
+        histogram = Histogram("test_seconds", "Test", labels=("stage",), buckets=(.1, 1, float("inf")), registry=None)
+        histogram.observe(.05, "db")
+        histogram.observe(.5, "db")
+        histogram.observe(5, "db")
+        histogram.observe(.1, "mask")
+
+        self.assertEqual(
+            sorted(histogram.collect()),
+            [
+                (("db",), [(.1, 1), (1, 2), (float("inf"), 3)], 5.55, 3),
+                (("mask",), [(.1, 1), (1, 1), (float("inf"), 1)], .1, 1),
+            ]
+        )
+
+
+class TimedTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_timings(None)
+
+    def test_outside_request(self):
+        @timed("db")
+        def func():
+            return 1
+        self.assertEqual(func(), 1)
+
+    def test_nested_calls(self):
+        @timed("db")
+        def func(depth):
+            if depth:
+                func(depth - 1)
+
+        timings = RequestTimings()
+        set_timings(timings)
+        func(3)
+        func(0)
+        self.assertEqual(list(timings.durations), ["db"])
+        self.assertEqual(timings.active, set())
+
+
+class ServerTimingTest(BaseWebTest):
+
+    def test_header(self):
+        response = self.app.get('/health', status=200)
+        stages = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+        self.assertEqual(stages[-1], "total")
+
+        labels = [label_values for label_values, *_ in REQUEST_DURATION.collect()]
+        self.assertIn(("health", "GET"), labels)
+
+
+class MetricsTest(BaseWebTest):
+
+    def test_metrics_view(self):
+        self.app.get('/health', status=200)
+        self.app.authorization = ('Basic', ('test', 'token'))
+        response = self.app.get('/metrics', status=200)
+        self.assertEqual(response.content_type, "text/plain")
+        self.assertIn('audit_api_responses_total{route="health",method="GET",status="200"}', response.text)
+        self.assertIn(
+            'audit_api_request_duration_seconds_bucket{route="health",method="GET",le="+Inf"}',
+            response.text,
+        )
+        self.assertIn("# TYPE audit_api_mongodb_pool_connections gauge", response.text)
+        self.assertIn("# TYPE audit_api_greenlets gauge", response.text)
+
+    def test_metrics_forbidden(self):
+        self.app.get('/metrics', status=403)
+        self.app.authorization = ('Basic', ('broker', 'broker'))
+        self.app.get('/metrics', status=403)
+
+
+class GenerateLatestTest(unittest.TestCase):
+
+    def test_format(self):
+        counter = Counter("test_total", "Test", labels=("path",), registry=None)
+        counter.inc('a"b')
+        gauge = Gauge("test_gauge", "Test", func=lambda: {(): 2.5}, registry=None)
+        histogram = Histogram("test_seconds", "Test", buckets=(1, float("inf")), registry=None)
+        histogram.observe(.5)
+        self.assertEqual(
+            generate_latest([counter, gauge, histogram]),
+            '# HELP test_total Test\n'
+            '# TYPE test_total counter\n'
+            'test_total{path="a\\"b"} 1\n'
+            '# HELP test_gauge Test\n'
+            '# TYPE test_gauge gauge\n'
+            'test_gauge 2.5\n'
+            '# HELP test_seconds Test\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{le="1"} 1\n'
+            'test_seconds_bucket{le="+Inf"} 1\n'
+            'test_seconds_sum 0.5\n'
+            'test_seconds_count 1\n'
+        )
+
+
+
+class MultiprocessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.values = MultiprocessValues()
+        self.values.set_directory(self.directory)
+        patcher = mock.patch("openprocurement.audit.api.metrics.MULTIPROCESS", self.values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_totals(self):
+        counter = Counter("test_total", "Test", labels=("path",), registry=None)
+        gauge = Gauge("test_gauge", "Test", registry=None)
+        lag = Gauge("test_lag", "Test", labels=("address",), func=lambda: {("x",): 1.0}, mode="max", registry=None)
+        histogram = Histogram("test_seconds", "Test", buckets=(1, float("inf")), registry=None)
+        counter.inc("a")
+        gauge.set(3)
+        histogram.observe(.5)
+
+        other = ValuesFile(os.path.join(self.directory, f"{os.getppid()}.db"))
+        other.write(("test_total", ("a",), None), 2)
+        other.write(("test_gauge", (), None), 4)
+        other.write(("test_lag", ("x",), None), 3.0)
+        other.write(("test_seconds", (), 1), 1)
+        other.write(("test_seconds", (), "sum"), 2.0)
+        # the gauges of the exited processes are dropped, their counters are kept
+        exited = ValuesFile(os.path.join(self.directory, "99999999.db"))
+        exited.write(("test_total", ("a",), None), 5)
+        exited.write(("test_gauge", (), None), 100)
+
+        self.assertEqual(
+            generate_latest([counter, gauge, lag, histogram], multiprocess=self.values),
+            '# HELP test_total Test\n'
+            '# TYPE test_total counter\n'
+            'test_total{path="a"} 8.0\n'
+            '# HELP test_gauge Test\n'
+            '# TYPE test_gauge gauge\n'
+            'test_gauge 7.0\n'
+            '# HELP test_lag Test\n'
+            '# TYPE test_lag gauge\n'
+            'test_lag{address="x"} 3.0\n'
+            '# HELP test_seconds Test\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{le="1"} 1\n'
+            'test_seconds_bucket{le="+Inf"} 2\n'
+            'test_seconds_sum 2.5\n'
+            'test_seconds_count 2\n'
+        )
+
+    def test_file_growth(self):
+        counter = Counter("test_total", "Test", labels=("path",), registry=None)
+        for i in range(3000):
+            counter.inc(str(i))
+        self.assertLess(ValuesFile.initial_size, os.path.getsize(os.path.join(self.directory, f"{os.getpid()}.db")))
+        values = dict(counter.aggregate(self.values.read()))
+        self.assertEqual(len(values), 3000)
+        self.assertEqual(values[("2999",)], 1)
+
+    def test_func_gauge_refresh(self):
+        state = {("a",): 1, ("b",): 2}
+        gauge = Gauge("test_gauge", "Test", labels=("name",), func=lambda: dict(state), registry=None)
+        gauge.refresh()
+        del state[("a",)]
+        gauge.refresh()
+        self.assertEqual(gauge.aggregate(self.values.read()), {("b",): 2})
+
+
+class GreenletsTest(unittest.TestCase):
+
+    def test_spawn(self):
+        before = GREENLETS.values.get((), 0)
+        greenlet = spawn(lambda: None)
+        self.assertEqual(GREENLETS.values[()], before + 1)
+        greenlet.join()
+        self.assertEqual(GREENLETS.values[()], before)
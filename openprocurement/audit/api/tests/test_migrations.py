@@ -0,0 +1,91 @@
+import unittest
+from argparse import Namespace
+from unittest import mock
+from uuid import uuid4
+
+from pymongo import UpdateOne
+
+from openprocurement.audit.api.migrations.base import (
+    BaseMigration,
+    get_checkpoints_collection,
+    get_id_ranges,
+    run,
+)
+from openprocurement.audit.api import migrate
+from openprocurement.audit.api.tests.base import BaseWebTest
+
+
+class MigrateTest(unittest.TestCase):
+
+    def test_entry_points(self):
+        registry = object()
+        entry_points = [mock.Mock(), mock.Mock()]
+        entry_points[0].name, entry_points[1].name = "first", "second"
+        with mock.patch.object(migrate, "iter_entry_points", return_value=entry_points):
+            migrate.run(registry, ["second"])
+            entry_points[0].load.assert_not_called()
+            entry_points[1].load.return_value.assert_called_once_with(registry)
+
+            migrate.run(registry)
+            entry_points[0].load.return_value.assert_called_once_with(registry)
+
+
+class IdRangesTest(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(
+            get_id_ranges(4),
+            [(None, "4"), ("4", "8"), ("8", "c"), ("c", None)],
+        )
+
+    def test_single_range(self):
+        self.assertEqual(get_id_ranges(1), [(None, None)])
+
+    def test_long_prefixes(self):
+        ranges = get_id_ranges(64)
+        self.assertEqual(len(ranges), 64)
+        self.assertEqual(ranges[1], ("04", "08"))
+        self.assertEqual([end for _, end in ranges[:-1]], [start for start, _ in ranges[1:]])
+
+
+class Migration(BaseMigration):
+    name = "test_migration"
+    collections = ("revision",)
+    filter = {"migrated": {"$exists": False}}
+
+    def get_update(self, collection_name, document):
+        return UpdateOne({"_id": document["_id"]}, {"$set": {"migrated": True}})
+
+
+class MigrationRunTest(BaseWebTest):
+
+    def setUp(self):
+        super().setUp()
+        self.collection = self.mongodb.revision.collection
+        self.collection.insert_many([{"_id": uuid4().hex} for _ in range(50)])
+
+    def tearDown(self):
+        get_checkpoints_collection(self.mongodb).delete_many({"migration": Migration.name})
+        super().tearDown()
+
+    def get_migration(self, **kwargs):
+        args = {"b": 7, "w": 1, "parts": 4, "max_lag": 10, "restart": False, "p": None}
+        args.update(kwargs)
+        return Migration(Namespace(**args))
+
+    def test_run(self):
+        counts = run(self.get_migration(), {"registry": self.app.app.registry})
+        self.assertEqual(counts, {"revision": 50})
+        self.assertEqual(self.collection.count_documents({"migrated": True}), 50)
+
+    def test_resume(self):
+        run(self.get_migration(), {"registry": self.app.app.registry})
+        self.collection.insert_many([{"_id": "0" * 32}, {"_id": "f" * 32}])
+
+        # done ranges are skipped
+        counts = run(self.get_migration(), {"registry": self.app.app.registry})
+        self.assertEqual(counts, {})
+
+        counts = run(self.get_migration(restart=True), {"registry": self.app.app.registry})
+        self.assertEqual(counts, {"revision": 2})
+        self.assertEqual(self.collection.count_documents({"migrated": True}), 52)
@@ -0,0 +1,267 @@
+import unittest
+from base64 import b64encode
+from threading import Event, Thread
+from types import SimpleNamespace
+
+from bson import Timestamp
+from bson.json_util import dumps
+from pyramid.interfaces import ITweens
+from pyramid.response import Response
+
+from openprocurement.audit.api.context import get_db_session
+from openprocurement.audit.api.memory import MemoryClient
+from openprocurement.audit.api.middlewares import DBSessionCookieMiddleware, FlightAborted, SingleFlightMiddleware
+from openprocurement.audit.api.tests.base import BaseWebTest
+
+
+def get_request(path_qs="/api/2.5/monitorings/1", principals=("g:brokers",), userid="broker", method="GET"):
+    return SimpleNamespace(
+        method=method,
+        path_qs=path_qs,
+        headers={},
+        cookies={},
+        unauthenticated_userid=userid,
+        effective_principals=["system.Everyone", "system.Authenticated", userid, *principals],
+    )
+
+
+class BaseSingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.started = Event()
+        self.release = Event()
+        self.single_flight = SingleFlightMiddleware(self.handler, SimpleNamespace(single_flight=True))
+        self.middleware = self.single_flight
+
+    def handler(self, request):
+        self.calls.append(request)
+        self.started.set()
+        self.release.wait(1)
+        response = Response(app_iter=iter([b'{"data": ', b'{}}']), content_type="application/json")
+        response.set_cookie("SESSION", "leader")
+        return response
+
+    def run_concurrently(self, first, second):
+        responses = {}
+        leader = Thread(target=lambda: responses.update(first=self.middleware(first)))
+        leader.start()
+        self.started.wait(1)
+        follower = Thread(target=lambda: responses.update(second=self.middleware(second)))
+        follower.start()
+        follower.join(0.05)
+        self.release.set()
+        leader.join()
+        follower.join()
+        return responses["first"], responses["second"]
+
+
+class SingleFlightMiddlewareTest(BaseSingleFlightTest):
+
+    def test_coalesced(self):
+        first, second = self.run_concurrently(get_request(), get_request(userid="another_broker"))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(first.body, b'{"data": {}}')
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(second.content_type, "application/json")
+        self.assertIsNone(second.headers.get("Set-Cookie"))
+        self.assertEqual(self.middleware.flights, {})
+
+    def test_different_principals(self):
+        self.run_concurrently(get_request(), get_request(principals=("g:brokers", "a:r")))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_different_url(self):
+        self.run_concurrently(get_request(), get_request(path_qs="/api/2.5/monitorings/1?opt_pretty=1"))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_error_not_shared(self):
+        def handler(request):
+            self.calls.append(request)
+            self.started.set()
+            self.release.wait(1)
+            return Response(status=404)
+
+        self.middleware.handler = handler
+        first, second = self.run_concurrently(get_request(), get_request())
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(second.status_code, 404)
+
+    def test_not_get(self):
+        self.release.set()
+        self.middleware(get_request(method="PATCH"))
+        self.middleware(get_request(method="PATCH"))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.middleware.flights, {})
+
+    def test_failed_leader(self):
+        def handler(request):
+            self.calls.append(request)
+            if len(self.calls) == 1:
+                self.started.set()
+                self.release.wait(1)
+                raise ValueError
+            return Response(body=b"ok")
+
+        self.middleware.handler = handler
+        responses = {}
+
+        def lead():
+            with self.assertRaises(ValueError):
+                self.middleware(get_request())
+
+        leader = Thread(target=lead)
+        leader.start()
+        self.started.wait(1)
+        follower = Thread(target=lambda: responses.update(second=self.middleware(get_request())))
+        follower.start()
+        follower.join(0.05)
+        self.release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(self.calls), 2)  # the follower runs its own request
+        self.assertEqual(responses["second"].body, b"ok")
+
+    def test_streamed(self):
+        produced = []
+
+        def chunks():
+            for chunk in (b'{"data": [', b'{}', b']}'):
+                produced.append(chunk)
+                yield chunk
+
+        def handler(request):
+            self.calls.append(request)
+            self.started.set()
+            self.release.wait(1)
+            return Response(app_iter=chunks(), content_type="application/json")
+
+        self.middleware.handler = handler
+        first, second = self.run_concurrently(get_request(), get_request())
+        self.assertEqual(produced, [])  # the body isn't buffered
+        first_body, second_body = iter(first.app_iter), iter(second.app_iter)
+        self.assertEqual(next(first_body), b'{"data": [')
+        # the follower gets the chunk as soon as it's produced
+        self.assertEqual(next(second_body), b'{"data": [')
+        self.assertEqual(len(produced), 1)
+        self.assertEqual(b"".join(first_body), b'{}]}')
+        self.assertEqual(b"".join(second_body), b'{}]}')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(produced, [b'{"data": [', b'{}', b']}'])
+
+    def test_read_chunks_dropped(self):
+        followers = [get_request() for _ in range(2)]
+        responses = {}
+        leader = Thread(target=lambda: responses.update(first=self.middleware(get_request())))
+        leader.start()
+        self.started.wait(1)
+        threads = [
+            Thread(target=lambda n=n, r=r: responses.update({n: self.middleware(r)}))
+            for n, r in enumerate(followers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(0.05)
+        self.release.set()
+        leader.join()
+        for thread in threads:
+            thread.join()
+
+        flight = responses[0].app_iter.flight
+        self.assertEqual(responses["first"].body, b'{"data": {}}')
+        self.assertEqual(len(flight.chunks), 2)
+        self.assertEqual(responses[0].body, b'{"data": {}}')
+        self.assertEqual(len(flight.chunks), 2)  # the other follower hasn't read them yet
+        body = iter(responses[1].app_iter)
+        next(body)
+        self.assertEqual(len(flight.chunks), 1)
+        responses[1].app_iter.close()
+        self.assertEqual(len(flight.chunks), 0)
+
+    def test_leader_aborted(self):
+        def chunks():
+            yield b'{"data": ['
+            raise ValueError
+
+        def handler(request):
+            self.calls.append(request)
+            self.started.set()
+            self.release.wait(1)
+            return Response(app_iter=chunks(), content_type="application/json")
+
+        self.middleware.handler = handler
+        first, second = self.run_concurrently(get_request(), get_request())
+        with self.assertRaises(ValueError):
+            first.body
+        second_body = iter(second.app_iter)
+        self.assertEqual(next(second_body), b'{"data": [')
+        with self.assertRaises(FlightAborted):
+            next(second_body)
+
+    def test_leader_closed(self):
+        first, second = self.run_concurrently(get_request(), get_request())
+        first.app_iter.close()  # the client has gone away
+        with self.assertRaises(FlightAborted):
+            second.body
+
+    def test_disabled(self):
+        self.middleware.enabled = False
+        self.release.set()
+        self.middleware(get_request())
+        self.assertEqual(self.middleware.flights, {})
+
+
+def get_session_request(operation_time=None, **kwargs):
+    request = get_request(**kwargs)
+    if operation_time is not None:
+        session = {"operation_time": Timestamp(operation_time, 0), "cluster_time": None}
+        request.cookies["SESSION"] = b64encode(dumps(session).encode())
+    return request
+
+
+class SingleFlightSessionTest(BaseSingleFlightTest):
+    """
+    Single flight under DBSessionCookieMiddleware, as the tweens are chained in the app
+    """
+
+    def setUp(self):
+        super(SingleFlightSessionTest, self).setUp()
+        self.sessions = []
+        registry = SimpleNamespace(mongodb=SimpleNamespace(connection=MemoryClient()))
+        self.middleware = DBSessionCookieMiddleware(self.single_flight, registry)
+
+    def handler(self, request):
+        self.sessions.append(get_db_session())
+        return super(SingleFlightSessionTest, self).handler(request)
+
+    def test_session(self):
+        first, second = self.run_concurrently(get_session_request(1), get_session_request())
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.sessions[0].operation_time, Timestamp(1, 0))
+        self.assertEqual(first.body, second.body)
+
+    def test_session_operation_time(self):
+        # the leader can't have read what the follower has written
+        self.run_concurrently(get_session_request(1), get_session_request(2))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([s.operation_time for s in self.sessions], [Timestamp(1, 0), Timestamp(2, 0)])
+
+    def test_session_older_operation_time(self):
+        first, second = self.run_concurrently(get_session_request(2), get_session_request(1))
+        self.assertEqual(len(self.calls), 1)
+        # the follower gets its own SESSION cookie
+        self.assertIn("SESSION=", second.headers["Set-Cookie"])
+        self.assertNotIn("leader", second.headers["Set-Cookie"])
+
+
+class SingleFlightTweenTest(BaseWebTest):
+
+    def test_innermost(self):
+        tweens = self.app.app.registry.queryUtility(ITweens)
+        # from the outermost one
+        names = [name.rsplit(".", 1)[-1] for name, _ in tweens.implicit()]
+        single_flight = names.index("SingleFlightMiddleware")
+        for name in ("QueryBudgetMiddleware", "AdmissionControlMiddleware",
+                     "ServerTimingMiddleware", "DBSessionCookieMiddleware"):
+            self.assertLess(names.index(name), single_flight)
@@ -0,0 +1,78 @@
+import unittest
+from socket import socketpair
+from time import monotonic
+from unittest import mock
+
+from openprocurement.audit.api.context import set_query_deadline
+from openprocurement.audit.api.middlewares import wait_disconnect
+from openprocurement.audit.api.timeouts import (
+    CLIENT_DISCONNECTED,
+    ClientDisconnected,
+    QueryBudgetExceeded,
+    get_query_comment,
+    get_query_options,
+)
+from openprocurement.audit.api.utils import parse_route_values
+
+
+class QueryOptionsTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_query_deadline(None)
+
+    def test_parse_timeouts(self):
+        self.assertEqual(
+            parse_route_values("\nMonitorings = 60\nMonitoring credentials=1.5\n"),
+            {"Monitorings": 60.0, "Monitoring credentials": 1.5},
+        )
+
+    def test_no_budget(self):
+        set_query_deadline(None)
+        self.assertEqual(get_query_options(), {})
+
+    def test_budget(self):
+        set_query_deadline(monotonic() + 2)
+        options = get_query_options(max_time_key="maxTimeMS")
+        self.assertGreater(options["maxTimeMS"], 1000)
+        self.assertLessEqual(options["maxTimeMS"], 2000)
+
+    def test_budget_exceeded(self):
+        set_query_deadline(monotonic() - 1)
+        with self.assertRaises(QueryBudgetExceeded):
+            get_query_options()
+
+    def test_request_id(self):
+        request = mock.Mock(environ={"REQUEST_ID": "req-1"})
+        with mock.patch("openprocurement.audit.api.timeouts.get_request", return_value=request):
+            comment = get_query_options()["comment"]
+            self.assertTrue(comment.startswith("req-1:"))
+            self.assertEqual(get_query_options(), {"comment": comment})
+        # the same id from another client
+        self.assertNotEqual(get_query_comment(mock.Mock(environ={"REQUEST_ID": "req-1"})), comment)
+
+    def test_client_disconnected(self):
+        request = mock.Mock(environ={CLIENT_DISCONNECTED: True})
+        with mock.patch("openprocurement.audit.api.timeouts.get_request", return_value=request):
+            with self.assertRaises(ClientDisconnected):
+                get_query_options()
+
+
+class WaitDisconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client, self.server = socketpair()
+        self.addCleanup(self.server.close)
+        self.request = mock.Mock(environ={})
+
+    def test_disconnected(self):
+        self.client.close()
+        wait_disconnect(self.server, self.request)
+        self.assertTrue(self.request.environ[CLIENT_DISCONNECTED])
+        self.request.registry.mongodb.kill_queries.assert_called_once_with(get_query_comment(self.request))
+
+    def test_next_request(self):
+        self.client.sendall(b"GET / HTTP/1.1\r\n")
+        wait_disconnect(self.server, self.request)
+        self.assertNotIn(CLIENT_DISCONNECTED, self.request.environ)
+        self.request.registry.mongodb.kill_queries.assert_not_called()
+        self.client.close()
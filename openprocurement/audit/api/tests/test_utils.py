@@ -0,0 +1,92 @@
+import unittest
+from decimal import Decimal
+from types import SimpleNamespace
+
+import simplejson
+from bson import encode
+from bson.raw_bson import RawBSONDocument
+from pyramid.response import Response
+
+from openprocurement.audit.api.context import get_request, set_now
+from openprocurement.audit.api.timeouts import CLIENT_DISCONNECTED, ClientDisconnected
+from openprocurement.audit.api.utils import STREAM_CHUNK_SIZE, iter_json_chunks, stream_json_response
+
+
+class IterJsonChunksTest(unittest.TestCase):
+
+    def assert_same_as_dumps(self, data, items, **kwargs):
+        body = b"".join(iter_json_chunks(dict(data), iter(items), "http://localhost", **kwargs))
+        self.assertEqual(
+            body,
+            simplejson.dumps(dict(data=items, **data), use_decimal=True).encode(),
+        )
+        return body
+
+    def test_empty(self):
+        self.assert_same_as_dumps({}, [])
+        self.assert_same_as_dumps({"next_page": {"offset": ""}}, [])
+
+    def test_items(self):
+        items = [{"id": str(i), "value": Decimal("1.10"), "title": "Приховано"} for i in range(10)]
+        self.assert_same_as_dumps({"count": 10, "page": 1}, items)
+
+    def test_chunks(self):
+        items = [{"id": "a" * 32}] * 10
+        chunks = list(iter_json_chunks({}, iter(items), "http://localhost", chunk_size=100))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(simplejson.loads(b"".join(chunks)), {"data": items})
+
+    def test_raw_documents(self):
+        doc = RawBSONDocument(encode({"id": "a", "documents": [{"title": "doc.txt"}]}))
+        body = b"".join(iter_json_chunks({}, iter([doc]), "http://localhost"))
+        self.assertEqual(
+            simplejson.loads(body),
+            {"data": [{"id": "a", "documents": [{"title": "doc.txt"}]}]},
+        )
+
+
+class StreamJsonResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        set_now()
+        self.request = SimpleNamespace(application_url="http://localhost", response=Response(), environ={})
+
+    def test_streamed_in_request_context(self):
+        requests = []
+
+        def items():
+            for i in range(3):
+                requests.append(get_request())
+                yield {"id": str(i), "title": "a" * STREAM_CHUNK_SIZE}
+
+        response = stream_json_response(self.request, {}, items())
+        self.assertEqual(len(requests), 1)  # the first chunk is rendered before the response is returned
+        self.assertEqual(len(simplejson.loads(response.body)["data"]), 3)
+        self.assertEqual(requests[1:], [self.request] * 2)
+
+    def test_first_chunk_error(self):
+        def items():
+            raise ValueError("masking failed")
+            yield
+
+        with self.assertRaises(ValueError):
+            stream_json_response(self.request, {}, items())
+
+    def test_error_aborts_stream(self):
+        def items():
+            yield {"id": "1", "title": "a" * STREAM_CHUNK_SIZE}
+            raise ValueError("masking failed")
+
+        response = stream_json_response(self.request, {}, items())
+        with self.assertRaises(ValueError):
+            response.body
+
+    def test_client_disconnected(self):
+        def items():
+            while True:
+                yield {"id": "1", "title": "a" * STREAM_CHUNK_SIZE}
+
+        response = stream_json_response(self.request, {}, items())
+        self.request.environ[CLIENT_DISCONNECTED] = True
+        with self.assertRaises(ClientDisconnected):
+            response.body
@@ -0,0 +1,75 @@
+from time import monotonic
+from uuid import uuid4
+
+from openprocurement.audit.api.context import get_query_deadline, get_request
+
+# request environ key set by middlewares.wait_disconnect when the client goes away
+CLIENT_DISCONNECTED = "openprocurement.audit.client_disconnected"
+# request environ key of the comment of its queries, see get_query_comment
+QUERY_COMMENT = "openprocurement.audit.query_comment"
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    The request has spent its query time budget before the next query,
+    that is shown to the User as 503 response code (see utils.query_timeout)
+    """
+
+
+class ClientDisconnected(Exception):
+    """
+    The client of the request has gone away (see middlewares.QueryBudgetMiddleware).
+    It's raised before the next query (and between the chunks of a streamed body). The queries running
+    at that moment are killed on the server by their comment (see MongodbStore.kill_queries) instead of
+    interrupting the greenlet inside pymongo, that can leave its pooled connection and session broken
+    """
+
+
+def check_client_disconnected():
+    """
+    Raises ClientDisconnected if the client of the current request has gone away
+    """
+    request = get_request()
+    if request is not None and request.environ.get(CLIENT_DISCONNECTED):
+        raise ClientDisconnected("Client disconnected")
+
+
+def get_remaining_time():
+    """
+    :return: seconds left of the query time budget of the current request, None if it has no budget
+    """
+    deadline = get_query_deadline()
+    if deadline is None:
+        return None
+    return deadline - monotonic()
+
+
+def get_query_comment(request):
+    """
+    The comment the queries of the request are sent with: its request id, so they can be found
+    in the mongodb logs and currentOp, and a suffix of its own, as the id can come from the client
+    """
+    comment = request.environ.get(QUERY_COMMENT)
+    if comment is None:
+        comment = request.environ[QUERY_COMMENT] = f"{request.environ.get('REQUEST_ID', '')}:{uuid4().hex[:12]}"
+    return comment
+
+
+def get_query_options(max_time_key="max_time_ms"):
+    """
+    Options for the read queries of the current request:
+     - maxTimeMS with the rest of the request budget
+     - comment of the request (see get_query_comment)
+    :param max_time_key: "maxTimeMS" for the methods that pass options to the command as is (count_documents)
+    """
+    check_client_disconnected()
+    options = {}
+    remaining = get_remaining_time()
+    if remaining is not None:
+        if remaining <= 0:
+            raise QueryBudgetExceeded("Request time budget exceeded")
+        options[max_time_key] = max(1, int(remaining * 1000))
+    request = get_request()
+    if request is not None:
+        options["comment"] = get_query_comment(request)
+    return options
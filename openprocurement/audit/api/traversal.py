@@ -11,6 +11,7 @@ class Root(object):
     __parent__ = None
     __acl__ = [
         (Allow, 'g:admins', ALL_PERMISSIONS),
+        (Allow, 'g:metrics', 'view_metrics'),
     ]
 
     def __init__(self, request):
@@ -1,7 +1,8 @@
 import decimal
 import json
 import pytz
-from base64 import b64encode, b64decode
+import simplejson
+from base64 import b64encode, b64decode, urlsafe_b64encode, urlsafe_b64decode
 from binascii import hexlify, unhexlify
 from email.header import decode_header
 from json import dumps
@@ -13,11 +14,13 @@ from Crypto.Cipher import AES
 from cornice.util import json_error
 from ciso8601 import parse_datetime
 from jsonpatch import make_patch, apply_patch as _apply_patch
-from time import time as ttime
+from itertools import chain
+from time import monotonic, time as ttime
 from contextlib import contextmanager
 from uuid import uuid4
 from webob.multidict import NestedMultiDict
 from pymongo.errors import DuplicateKeyError
+from bson.raw_bson import RawBSONDocument
 from jsonpointer import resolve_pointer
 from openprocurement.audit.api.constants import (
     DOCUMENT_BLACKLISTED_FIELDS,
@@ -30,7 +33,12 @@ from openprocurement.audit.api.rfc6266 import build_header
 from openprocurement.audit.api.events import ErrorDesctiptorEvent
 from openprocurement.audit.api.interfaces import IContentConfigurator
 from openprocurement.audit.api.interfaces import IOPContent
-from openprocurement.audit.api.database import MongodbResourceConflict
+from openprocurement.audit.api.context import get_now, get_query_deadline, set_now, set_query_deadline, set_request
+from openprocurement.audit.api.database import MongodbResourceConflict, decode_raw_document
+from openprocurement.audit.api.metrics import DOCSERVICE_UPLOAD_RETRIES, DOCSERVICE_UPLOAD_FAILURES, timed
+from openprocurement.audit.api.timeouts import ClientDisconnected, QueryBudgetExceeded, check_client_disconnected
+
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 def set_parent(item, parent):
@@ -174,6 +182,7 @@ def upload_file(request,
                     auth=(request.registry.docservice_username, request.registry.docservice_password))
                 json_data = r.json()
             except Exception as e:
+                DOCSERVICE_UPLOAD_RETRIES.inc("exception")
                 LOGGER.warning(
                     "Raised exception '{}' on uploading document "
                     "to document service': {}.".format(type(e), e),
@@ -186,6 +195,7 @@ def upload_file(request,
                     doc_hash = json_data['data']['hash']
                     break
                 else:
+                    DOCSERVICE_UPLOAD_RETRIES.inc(str(r.status_code))
                     LOGGER.warning(
                         "Error {} on uploading document "
                         "to document service '{}': {}".format(r.status_code, url, r.text),
@@ -195,6 +205,7 @@ def upload_file(request,
             in_file.seek(0)
             index -= 1
         else:
+            DOCSERVICE_UPLOAD_FAILURES.inc()
             request.errors.add('body', 'data', "Can't upload document to document service.")
             request.errors.status = 422
             raise error_handler(request)
@@ -431,12 +442,55 @@ def parse_offset(offset: str):
         return parse_date(offset.replace(" ", "+")).timestamp()
 
 
+def encode_cursor(value, ids):
+    return urlsafe_b64encode(simplejson.dumps([value, ids]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        value, ids = simplejson.loads(urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(str(e))
+    if not isinstance(ids, list):
+        raise ValueError("Invalid cursor ids")
+    return value, ids
+
+
 def forbidden(request):
     request.errors.add('url', 'permission', 'Forbidden')
     request.errors.status = 403
     return error_handler(request)
 
 
+def parse_route_values(value):
+    """
+    :param value: "route name = number" lines of a setting
+    :return: {route name: number}
+    """
+    values = {}
+    for line in value.splitlines():
+        if line.strip():
+            name, _, number = line.rpartition("=")
+            values[name.strip()] = float(number)
+    return values
+
+
+def query_timeout(request):
+    """
+    503 if the request has spent its query time budget before a query,
+    504 if a query has been stopped by its maxTimeMS
+    """
+    if isinstance(request.exception, QueryBudgetExceeded):
+        request.errors.add('url', 'timeout', 'Request time budget exceeded')
+        request.errors.status = 503
+    else:
+        request.errors.add('url', 'timeout', 'Database query timed out')
+        request.errors.status = 504
+    response = error_handler(request)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
 def update_logging_context(request, params):
     if not request.__dict__.get('logging_context'):
         request.logging_context = {}
@@ -480,6 +534,89 @@ def fix_url(item, app_url):
             ]
 
 
+def stream_json_default(obj):
+    if isinstance(obj, RawBSONDocument):
+        return decode_raw_document(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def iter_json_chunks(data, items, app_url, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields {"data": [*items], **data} json encoded by chunks of about chunk_size bytes.
+    Every item is encoded (and produced, if items is a generator) only when the previous chunk is sent.
+    The output is the same as simplejson.dumps of the whole page gives
+    """
+    encode = simplejson.JSONEncoder(use_decimal=True, default=stream_json_default).encode
+    tail = encode(data)[1:]
+    chunk = ['{"data": [']
+    size = 0
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            fix_url(item, app_url)  # the same as BeforeRender subscriber does
+        part = encode(item)
+        chunk.append(", " + part if i else part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(chunk).encode("utf-8")
+            chunk, size = [], 0
+    chunk.append("]}" if tail == "}" else "], " + tail)
+    yield "".join(chunk).encode("utf-8")
+
+
+@timed("render")
+def render_chunk(chunks):
+    return next(chunks, None)
+
+
+def iter_streamed_chunks(chunks, request, now, deadline):
+    """
+    Renders the rest of a streamed body after the tweens have returned.
+    Every chunk is rendered in the context of its request (serializers and masking use get_request and get_now)
+    and within the request query time budget.
+    An error is raised to the server, that closes the connection (gunicorn does),
+    so the client gets an incomplete response instead of a truncated page with 200
+    """
+    while True:
+        set_request(request)
+        set_now(now)
+        set_query_deadline(deadline)
+        try:
+            check_client_disconnected()
+            if deadline is not None and monotonic() > deadline:
+                raise QueryBudgetExceeded("Request time budget exceeded while streaming the response")
+            chunk = next(chunks, None)
+        except ClientDisconnected:
+            LOGGER.info("Client disconnected, streaming of the response body is stopped")
+            raise
+        except Exception:
+            LOGGER.exception("Streaming of the response body has failed, the response is aborted")
+            raise
+        finally:
+            set_request(None)
+            set_query_deadline(None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def stream_json_response(request, data, items):
+    """
+    Returns a response that encodes listing items one by one while the body is being sent
+    so the whole rendered page is never kept in memory.
+    The first chunk (the whole page unless it's large) is rendered here, inside the tweens,
+    so it's measured and limited as the rest of the request, and its errors get their status code.
+    Renderers with options (opt_pretty, opt_jsonp) are still used the regular way
+    """
+    if getattr(request, "override_renderer", None):
+        return dict(data=list(items), **data)
+    chunks = iter_json_chunks(data, items, request.application_url)
+    first = render_chunk(chunks)
+    response = request.response
+    response.content_type = "application/json"
+    response.app_iter = chain([first], iter_streamed_chunks(chunks, request, get_now(), get_query_deadline()))
+    return response
+
+
 def encrypt(uuid, name, key):
     iv = "{:^{}.{}}".format(name, AES.block_size, AES.block_size)
     text = "{:^{}}".format(key, AES.block_size)
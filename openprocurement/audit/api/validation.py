@@ -3,6 +3,7 @@ from schematics.exceptions import (
     ModelValidationError, ModelConversionError
 )
 
+from openprocurement.audit.api.metrics import timed
 from openprocurement.audit.api.utils import (
     apply_data_patch, update_logging_context, error_handler,
 )
@@ -24,6 +25,7 @@ def validate_json_data(request, **_):
     return json['data']
 
 
+@timed("validate")
 def validate_data(request, model, partial=False, data=None):
     if data is None:
         data = validate_json_data(request)
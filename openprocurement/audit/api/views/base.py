@@ -1,6 +1,16 @@
-from openprocurement.audit.api.mask import mask_object_data
+from openprocurement.audit.api.database import decode_raw_document
+from openprocurement.audit.api.mask import mask_object_data, is_masking_required
+from openprocurement.audit.api.mask_deprecated import EXCLUDED_ROLES as DEPRECATED_MASK_EXCLUDED_ROLES
 from openprocurement.audit.api.traversal import factory
-from openprocurement.audit.api.utils import error_handler, parse_offset, raise_operation_error
+from openprocurement.audit.api.utils import (
+    error_handler,
+    forbidden,
+    parse_offset,
+    raise_operation_error,
+    stream_json_response,
+    encode_cursor,
+    decode_cursor,
+)
 from cornice.resource import resource, view
 from functools import partial
 from logging import getLogger
@@ -29,6 +39,7 @@ class MongodbResourceListing(APIResource):
     max_limit = 1000
 
     db_listing_method: callable
+    db_wait_method: callable = None
     filter_key = None
 
     @staticmethod
@@ -40,6 +51,22 @@ class MongodbResourceListing(APIResource):
 
     @json_view(permission="view_listing")
     def get(self):
+        params, prev_params, keys, list_kwargs = self.get_listing_query()
+        results = self.db_listing_method(**list_kwargs)
+        if not results and params.get("feed") == "longpoll" and not params.get("descending"):
+            if self.db_wait_method(filters=list_kwargs["filters"], timeout=self.request.registry.longpoll_timeout):
+                results = self.db_listing_method(**list_kwargs)
+        data = self.get_listing_pages(results, keys, params, prev_params)
+        return stream_json_response(self.request, data, (self.prepare_result(r) for r in results))
+
+    def listing_error(self, message, status, name):
+        raise_operation_error(self.request, message, status=status, location="querystring", name=name)
+
+    def get_listing_query(self):
+        """
+        Parses the listing params, shared with the asgi app listings (see openprocurement.audit.api.asgi)
+        :return: page params, previous page params, route keys, db_listing_method kwargs
+        """
         params = {}
         filters = {}
         keys = {}
@@ -63,10 +90,7 @@ class MongodbResourceListing(APIResource):
             try:
                 offset = parse_offset(offset_param)
             except ValueError:
-                raise_operation_error(
-                    self.request, f"Invalid offset provided: {offset_param}",
-                    status=404, location="querystring", name="offset"
-                )
+                self.listing_error(f"Invalid offset provided: {offset_param}", status=404, name="offset")
             params["offset"] = offset
 
         # limit param
@@ -75,10 +99,7 @@ class MongodbResourceListing(APIResource):
             try:
                 limit = int(limit_param)
             except ValueError as e:
-                raise_operation_error(
-                    self.request, e.args[0],
-                    status=400, location="querystring", name="limit"
-                )
+                self.listing_error(e.args[0], status=400, name="limit")
             else:
                 params["limit"] = min(limit, self.max_limit)
 
@@ -86,6 +107,11 @@ class MongodbResourceListing(APIResource):
         if self.request.params.get("descending"):
             params["descending"] = 1
 
+        # feed param
+        # "longpoll" holds an empty ascending page until new documents cross the offset
+        if self.request.params.get("feed") == "longpoll" and self.db_wait_method:
+            params["feed"] = "longpoll"
+
         # opt_fields param
         if self.request.params.get("opt_fields"):
             opt_fields = set(self.request.params.get("opt_fields", "").split(",")) & self.listing_allowed_fields
@@ -103,32 +129,27 @@ class MongodbResourceListing(APIResource):
             prev_params["descending"] = 1
 
         data_fields = opt_fields | self.listing_default_fields
-        db_fields = self.db_fields(data_fields)
 
-        # call db method
-        results = self.db_listing_method(
+        list_kwargs = dict(
             offset_field=self.offset_field,
             offset_value=offset,
-            fields=db_fields,
+            fields=data_fields,
             descending=params.get("descending"),
             limit=params.get("limit", self.default_limit),
             filters=filters,
+            raw=True,
         )
+        return params, prev_params, keys, list_kwargs
 
-        # prepare response
+    def get_listing_pages(self, results, keys, params, prev_params):
         if results:
             params["offset"] = results[-1][self.offset_field]
             prev_params["offset"] = results[0][self.offset_field]
-            if self.offset_field not in self.listing_allowed_fields:
-                for r in results:
-                    r.pop(self.offset_field)
         data = {
-            "data": self.filter_results_fields(results, data_fields),
             "next_page": self.get_page(keys, params)
         }
         if self.request.params.get("descending") or self.request.params.get("offset"):
             data["prev_page"] = self.get_page(keys, prev_params)
-
         return data
 
     def get_page(self, keys, params):
@@ -138,13 +159,22 @@ class MongodbResourceListing(APIResource):
             "uri": self.request.route_url(self.listing_name, _query=params, **keys)
         }
 
-    def filter_results_fields(self, results, fields):
-        all_fields = fields | {"id"}
-        for r in results:
-            for k in list(r.keys()):
-                if k not in all_fields:
-                    del r[k]
-        return results
+    def prepare_result(self, result):
+        # "data" is projected by db exactly as it should be shown
+        # and stays encoded RawBSONDocument until rendering
+        return result["data"]
+
+
+def get_listing_opt_fields(cls=MongodbResourceListing):
+    """
+    :return: {route name: opt_fields allowed by its listing} of the registered listing resources
+    """
+    routes = {}
+    for subclass in cls.__subclasses__():
+        for name in subclass.__dict__.get("_services", ()):
+            routes[name] = subclass.listing_allowed_fields
+        routes.update(get_listing_opt_fields(subclass))
+    return routes
 
 
 class RestrictedResourceListingMixin:
@@ -155,11 +185,15 @@ class RestrictedResourceListingMixin:
         fields = super().db_fields(fields)
         return fields | {"restricted"}
 
-    def filter_results_fields(self, results, fields):
-        for r in results:
-            mask_object_data(self.request, r, mask_mapping=self.mask_mapping)
-        results = super().filter_results_fields(results, fields)
-        return results
+    def prepare_result(self, result):
+        data = super().prepare_result(result)
+        if result.get("restricted"):
+            # only restricted rows are decoded, as masking works with dicts
+            data = decode_raw_document(data)
+            data["restricted"] = True
+            mask_object_data(self.request, data, mask_mapping=self.mask_mapping)
+            del data["restricted"]
+        return data
 
 
 DEFAULT_PAGE = 1
@@ -204,11 +238,16 @@ class APIResourcePaginatedListing(APIResource):
 
         descending = bool(self.request.params.get('descending', DEFAULT_DESCENDING))
         limit = int(self.request.params.get('limit', DEFAULT_LIMIT))
-        page = int(self.request.params.get('page', DEFAULT_PAGE))
-        skip = page * limit - limit
 
         db_fields = self.db_fields(opt_fields)
 
+        cursor = self.request.params.get('cursor')
+        if cursor is not None:
+            return self.get_by_cursor(cursor, filters, db_fields, opt_fields, descending, limit)
+
+        page = int(self.request.params.get('page', DEFAULT_PAGE))
+        skip = page * limit - limit
+
         results, total = self.db_listing_method(
             skip=skip,
             limit=limit,
@@ -218,10 +257,88 @@ class APIResourcePaginatedListing(APIResource):
             filters=filters,
         )
         data = {
-            'data': [self.serialize_method(r, opt_fields) for r in results],
             'count': len(results),
             'page': page,
             'limit': limit,
             'total': total,
         }
-        return data
+        return stream_json_response(self.request, data, (self.serialize_method(r, opt_fields) for r in results))
+
+    def get_by_cursor(self, cursor, filters, db_fields, opt_fields, descending, limit):
+        """
+        Keyset pagination: ?cursor= starts the listing, next_page.cursor continues it.
+        Unlike page, it doesn't get slower for the last pages.
+        The total is only calculated if ?total=1 is passed
+        """
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except ValueError:
+                raise_operation_error(
+                    self.request, f"Invalid cursor provided: {cursor}",
+                    status=400, location="querystring", name="cursor"
+                )
+        with_total = bool(self.request.params.get('total'))
+
+        results, total = self.db_listing_method(
+            limit=limit,
+            fields=db_fields | {self.sort_by},
+            sort_by=self.sort_by,
+            descending=descending,
+            filters=filters,
+            after=after,
+            count=with_total,
+        )
+        data = {
+            'count': len(results),
+            'limit': limit,
+        }
+        if with_total:
+            data['total'] = total
+        if results and len(results) == limit:
+            last_value = results[-1][self.sort_by]
+            ids = [r["_id"] for r in results if r[self.sort_by] == last_value]
+            if after and after[0] == last_value:
+                ids = after[1] + ids
+            next_cursor = encode_cursor(last_value, ids)
+            params = dict(self.request.GET)
+            params['cursor'] = next_cursor
+            data['next_page'] = {
+                'cursor': next_cursor,
+                'path': self.request.current_route_path(_query=params),
+                'uri': self.request.current_route_url(_query=params),
+            }
+        return stream_json_response(self.request, data, (self.serialize_method(r, opt_fields) for r in results))
+
+
+def revision_serialize(data, fields):
+    return {i: j for i, j in data.items() if i in fields}
+
+
+class RevisionsResourceListing(APIResourcePaginatedListing):
+    """
+    Revisions of the object in the context, from the revisions collection.
+    Changes can't be masked, so they aren't shown to those who get the object masked
+    """
+    sort_by = "date"
+
+    def __init__(self, request, context):
+        super(RevisionsResourceListing, self).__init__(request, context)
+        self.db_listing_method = request.registry.mongodb.revision.paging_list
+        self.default_fields = {"author", "date", "changes", "rev"}
+        self.serialize_method = revision_serialize
+        self.obj_id_key_filter = "object_id"
+
+    @staticmethod
+    def add_mode_filters(filters: dict, mode: str):
+        pass
+
+    def get(self):
+        data = {
+            "restricted": self.context.get("restricted"),
+        }
+        is_masked = self.context.get("is_masked") and self.request.authenticated_role not in DEPRECATED_MASK_EXCLUDED_ROLES
+        if is_masked or is_masking_required(self.request, data):
+            return forbidden(self.request)
+        return super(RevisionsResourceListing, self).get()
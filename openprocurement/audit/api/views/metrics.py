@@ -0,0 +1,20 @@
+from cornice.service import Service
+from pyramid.response import Response
+
+from openprocurement.audit.api.metrics import generate_latest
+from openprocurement.audit.api.traversal import factory
+
+metrics = Service(name='metrics', path='/metrics', renderer='json', factory=factory)
+
+
+@metrics.get(permission='view_metrics')
+def get_metrics(request):
+    """
+    Metrics in the Prometheus text format, the totals of all the workers if they share metrics_dir
+    (see MultiprocessValues), otherwise the ones of the worker that handles the request.
+    They show the db servers, so only the metrics group (and admins) can see them
+    """
+    return Response(
+        text=generate_latest(),
+        content_type="text/plain", charset="utf-8", status=200,
+    )
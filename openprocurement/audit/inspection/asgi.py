@@ -0,0 +1,16 @@
+from openprocurement.audit.api.asgi import AsyncListingMixin, get_listing
+from openprocurement.audit.inspection.database import InspectionCollection
+from openprocurement.audit.inspection.views.inspection import InspectionsResource
+
+
+class InspectionsListing(AsyncListingMixin, InspectionsResource):
+    pass
+
+
+async def get_inspections(request):
+    return await get_listing(InspectionsListing(request, None))
+
+
+def includeme(app):
+    app.mongodb.add_collection("inspection", InspectionCollection)
+    app.add_route("Inspections", "/inspections", get_inspections)
@@ -1,4 +1,4 @@
-from openprocurement.audit.api.database import BaseCollection
+from openprocurement.audit.api.database import BaseCollection, ListingQuery
 from pymongo import ASCENDING, IndexModel
 import logging
 
@@ -8,6 +8,17 @@ logger = logging.getLogger(__name__)
 
 class InspectionCollection(BaseCollection):
     object_name = "inspection"
+    listing_queries = (
+        # /inspections feed modes: "", test, all
+        ListingQuery("ins_real_by_public_modified", "public_modified", {"is_test": False}),
+        ListingQuery("ins_test_by_public_modified", "public_modified", {"is_test": True}),
+        ListingQuery("ins_all_by_public_modified", "public_modified"),
+        # /monitorings/{monitoring_id}/inspections
+        ListingQuery(
+            "ins_all_by_monitoring_ids", "dateCreated",
+            fields={"monitoring_ids"}, optional_fields={"is_test"},
+        ),
+    )
 
     def get_indexes(self):
         # Making multiple indexes with the same unique key is supposed to be impossible
@@ -0,0 +1,23 @@
+from openprocurement.audit.api.tests.asgi import ASGITestMixin
+from openprocurement.audit.inspection.tests.base import BaseWebTest
+
+
+class ASGIInspectionsTest(ASGITestMixin, BaseWebTest):
+    """
+    The asgi app listing responses are compared with the ones of the WSGI app
+    """
+
+    def test_listing(self):
+        for _ in range(3):
+            self.create_inspection()
+        self.create_inspection(restricted_config=True)
+
+        data = self.assert_same("/inspections?opt_fields=description,documents&limit=2")
+        self.assertEqual(len(data["data"]), 2)
+        self.assert_same(data["next_page"]["path"])
+        self.assert_same("/inspections?descending=1&opt_pretty=1")
+        self.assert_same("/inspections?opt_fields=description", auth=(self.broker_name_r, self.broker_pass_r))
+
+    def test_listing_errors(self):
+        self.assert_same("/inspections?offset=latest")
+        self.assert_same("/inspections?limit=a")
@@ -27,21 +27,22 @@ LOGGER = getLogger(__name__)
 
 @op_resource(name='Inspections', path='/inspections')
 class InspectionsResource(RestrictedResourceListingMixin, MongodbResourceListing):
+    listing_allowed_fields = {
+        "dateCreated",
+        "dateModified",
+        "inspection_id",
+        "monitoring_ids",
+        "description",
+        "documents",
+        "owner",
+    }
 
     def __init__(self, request, context):
         super(InspectionsResource, self).__init__(request, context)
         self.listing_name = "Inspections"
         self.listing_default_fields = {"dateModified"}
-        self.listing_allowed_fields = {
-            "dateCreated",
-            "dateModified",
-            "inspection_id",
-            "monitoring_ids",
-            "description",
-            "documents",
-            "owner",
-        }
         self.db_listing_method = request.registry.mongodb.inspection.list
+        self.db_wait_method = request.registry.mongodb.inspection.wait_for_changes
         self.mask_mapping = INSPECTION_MASK_MAPPING
 
     @json_view(content_type='application/json',
@@ -0,0 +1,19 @@
+from openprocurement.audit.api.views.base import RevisionsResourceListing, json_view
+from openprocurement.audit.inspection.utils import op_resource
+
+
+@op_resource(name='Inspection Revisions',
+             path='/inspections/{inspection_id}/revisions',
+             description='Inspection Revisions')
+class InspectionRevisionsResource(RevisionsResourceListing):
+
+    def __init__(self, request, context):
+        super(InspectionRevisionsResource, self).__init__(request, context)
+        self.obj_id_key = "inspection_id"
+
+    @json_view(permission='revision_inspection')
+    def get(self):
+        """
+        Inspection revisions
+        """
+        return super(InspectionRevisionsResource, self).get()
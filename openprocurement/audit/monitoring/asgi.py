@@ -0,0 +1,83 @@
+from asyncio import create_task
+
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.settings import asbool
+
+from openprocurement.audit.api.asgi import DB_SESSION, AsyncListingMixin, HTTPError, get_listing
+from openprocurement.audit.api.database import CountCache
+from openprocurement.audit.monitoring.database import MonitoringCollection, get_count_cache_ttl
+from openprocurement.audit.monitoring.traversal import Root
+from openprocurement.audit.monitoring.utils import monitoring_from_data
+from openprocurement.audit.monitoring.views.monitoring import ESTIMATED_COUNT_ERROR, MonitoringsResource
+
+AUTHORIZATION_POLICY = ACLAuthorizationPolicy()
+
+
+class MonitoringsListing(AsyncListingMixin, MonitoringsResource):
+    pass
+
+
+async def get_monitorings(request):
+    if request.params.get("mode") in ("real_draft", "all_draft"):
+        if not AUTHORIZATION_POLICY.permits(Root(request), request.effective_principals, "view_draft_monitoring"):
+            raise HTTPError(403, "url", "permission", "Forbidden")
+    return await get_listing(MonitoringsListing(request, None))
+
+
+async def get_monitoring_count(request):
+    collection = request.registry.mongodb.monitoring
+    mode = request.params.get("mode", "")
+    estimated = asbool(request.params.get("estimated"))
+    try:
+        filters = MonitoringCollection.get_count_filters(mode, estimated=estimated)
+    except ValueError:
+        raise HTTPError(400, "querystring", "estimated", ESTIMATED_COUNT_ERROR)
+    if estimated:
+        count = await collection.estimated_document_count()
+    elif not request.registry.count_cache.ttl:
+        count = await collection.count_documents(filters)
+    else:
+        count = await get_cached_count(request.registry, collection, filters)
+    return {"data": count}, None
+
+
+async def get_cached_count(app, collection, filters):
+    """
+    MonitoringCollection.count with the async collection: the stale count is refreshed by a task
+    """
+    key = filters.get("is_test")
+    count, refresh = app.count_cache.get(key)
+    if count is None:
+        return await refresh_count(app, collection, key, filters)
+    if refresh:
+        task = create_task(refresh_count(app, collection, key, filters, background=True))
+        app.count_tasks.add(task)  # the loop keeps only weak references to the tasks
+        task.add_done_callback(app.count_tasks.discard)
+    return count
+
+
+async def refresh_count(app, collection, key, filters, background=False):
+    if background:
+        DB_SESSION.set(None)  # the session of the request is ended before the task is run
+    count = await collection.count_documents(filters)
+    app.count_cache.set(key, count)
+    return count
+
+
+async def get_monitoring(request):
+    monitoring_id = request.matchdict["monitoring_id"]
+    data = await request.registry.mongodb.monitoring.get(monitoring_id)
+    if data is None:
+        raise HTTPError(404, "url", "monitoring_id", "Not Found")
+    monitoring = monitoring_from_data(request, data)
+    monitoring.__parent__ = Root(request)
+    return {"data": monitoring.serialize("view")}, None
+
+
+def includeme(app):
+    app.mongodb.add_collection("monitoring", MonitoringCollection)
+    app.count_cache = CountCache(get_count_cache_ttl(app.settings))
+    app.count_tasks = set()
+    app.add_route("Monitorings", "/monitorings", get_monitorings)
+    app.add_route("Monitoring count", "/monitorings/count", get_monitoring_count)
+    app.add_route("Monitoring", "/monitorings/{monitoring_id}", get_monitoring)
@@ -1,14 +1,43 @@
-from openprocurement.audit.api.database import BaseCollection
+from openprocurement.audit.api.database import BaseCollection, CountCache, ListingQuery
 from openprocurement.audit.api.context import get_db_session
+from openprocurement.audit.api.metrics import timed
+from openprocurement.audit.api.timeouts import get_query_options
 from pymongo import DESCENDING, ASCENDING, IndexModel
+from threading import Thread
 import logging
+import os
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_count_cache_ttl(settings):
+    """
+    Seconds the /monitorings/count values are cached per process, 0 disables the cache
+    """
+    return float(os.environ.get("COUNT_CACHE_TTL", settings.get("count_cache_ttl", 0)))
+
+
 class MonitoringCollection(BaseCollection):
     object_name = "monitoring"
+    listing_queries = (
+        # /monitorings feed modes: "", test, all, real_draft, all_draft
+        ListingQuery("real_by_public_modified", "public_modified", {"is_test": False, "is_public": True}),
+        ListingQuery("test_by_public_modified", "public_modified", {"is_test": True, "is_public": True}),
+        ListingQuery("all_by_public_modified", "public_modified", {"is_public": True}),
+        ListingQuery("real_draft_by_public_modified", "public_modified", {"is_test": False}),
+        ListingQuery("all_draft_by_public_modified", "public_modified"),
+        # /tenders/{tender_id}/monitorings
+        ListingQuery(
+            "all_by_tender_id_created", "dateCreated",
+            fields={"tender_id"}, optional_fields={"is_test", "is_public"},
+        ),
+    )
+
+    def __init__(self, store, settings):
+        super().__init__(store, settings)
+        # counts are cached per process for count_cache_ttl seconds (0 disables the cache)
+        self.count_cache = CountCache(get_count_cache_ttl(settings))
 
     def get_indexes(self):
         # Making multiple indexes with the same unique key is supposed to be impossible
@@ -76,18 +105,56 @@ class MonitoringCollection(BaseCollection):
 
         data["is_public"] = data.get("status") not in ("draft", "cancelled")
 
-        updated = self.store.save_data(self.collection, data, insert=insert, modified=modified)
+        updated = self.save_data(data, insert=insert, modified=modified)
         o.import_data(updated)
 
-    def count(self, mode=""):
+    @staticmethod
+    def get_count_filters(mode, estimated=False):
+        """
+        :param estimated: the count is going to be taken from the collection metadata,
+        that is only possible for the modes that have no filters (all)
+        """
         filters = {}
         if mode == "test":
             filters["is_test"] = True
         elif "all" not in mode:
             filters["is_test"] = False
-        count = self.collection.count_documents(
+        if estimated and filters:
+            raise ValueError(f"Estimated count is not available for mode={mode!r}")
+        return filters
+
+    def count(self, mode="", estimated=False):
+        """
+        :param estimated: the total from the collection metadata instead of scanning the index,
+        only for the modes that have no filters (all)
+        """
+        filters = self.get_count_filters(mode, estimated=estimated)
+
+        if estimated:
+            return self.collection.estimated_document_count()
+
+        if not self.count_cache.ttl:
+            return self.count_documents(filters)
+
+        key = filters.get("is_test")
+        count, refresh = self.count_cache.get(key)
+        if count is None:
+            return self.refresh_count(key, filters)
+        if refresh:
+            Thread(target=self.refresh_count, args=(key, filters), daemon=True).start()
+        return count
+
+    def refresh_count(self, key, filters):
+        count = self.count_documents(filters)
+        self.count_cache.set(key, count)
+        return count
+
+    @timed("db")
+    def count_documents(self, filters):
+        count = self.read_collections["listing"].count_documents(
             filter=filters,
             session=get_db_session(),
+            **get_query_options(max_time_key="maxTimeMS")
         )
         return count
 
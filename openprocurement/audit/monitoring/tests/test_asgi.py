@@ -0,0 +1,77 @@
+import json
+
+from openprocurement.audit.api.tests.asgi import ASGITestMixin
+from openprocurement.audit.monitoring.tests.base import BaseWebTest
+
+
+class ASGIResourceTest(ASGITestMixin, BaseWebTest):
+    """
+    The asgi app responses are compared with the ones of the WSGI app
+    """
+
+    def test_health(self):
+        status, headers, body = self.asgi_request("/health")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {})
+
+    def test_not_found(self):
+        status, headers, body = self.asgi_request("/monitorings/{}/posts".format("a" * 32))
+        self.assertEqual(status, 404)
+        self.assert_same("/monitorings/{}".format("a" * 32))
+
+    def test_method_not_allowed(self):
+        status, headers, body = self.asgi_request("/monitorings", method="POST")
+        self.assertEqual(status, 405)
+
+    def test_head(self):
+        self.create_monitoring()
+        status, headers, body = self.asgi_request("/monitorings/{}".format(self.monitoring_id), method="HEAD")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"")
+
+    def test_listing(self):
+        for _ in range(3):
+            self.create_active_monitoring()
+        self.create_active_monitoring(restricted_config=True)
+
+        data = self.assert_same("/monitorings?opt_fields=status,tender_id,parties&limit=2")
+        self.assertEqual(len(data["data"]), 2)
+        self.assert_same(data["next_page"]["path"])
+        self.assert_same("/monitorings?descending=1&opt_pretty=1")
+        self.assert_same("/monitorings?opt_fields=parties&mode=test")
+        self.assert_same("/monitorings?opt_fields=parties", auth=(self.broker_name_r, self.broker_pass_r))
+
+    def test_listing_errors(self):
+        self.assert_same("/monitorings?offset=latest")
+        self.assert_same("/monitorings?limit=a")
+        self.assert_same("/monitorings?mode=real_draft")
+        self.assert_same("/monitorings?mode=real_draft", auth=(self.broker_name, self.broker_pass))
+        self.assert_same("/monitorings?mode=real_draft", auth=(self.sas_name, self.sas_pass))
+
+    def test_monitoring(self):
+        self.create_active_monitoring(restricted_config=True)
+        url = "/monitorings/{}".format(self.monitoring_id)
+        masked = self.assert_same(url)
+        self.assert_same(url, auth=(self.broker_name, self.broker_pass))
+        not_masked = self.assert_same(url, auth=(self.broker_name_r, self.broker_pass_r))
+        self.assertNotEqual(masked, not_masked)
+        self.assert_same(url, auth=(self.sas_name, self.sas_pass))
+
+        response = self.app.get(url + "?opt_jsonp=callback")
+        status, headers, body = self.asgi_request(url + "?opt_jsonp=callback")
+        self.assertEqual(headers["content-type"], response.content_type)
+        self.assertEqual(body, response.body)
+
+    def test_count(self):
+        self.create_monitoring()
+        self.create_monitoring(mode="test")
+        self.assert_same("/monitorings/count")
+        self.assert_same("/monitorings/count?mode=test")
+        self.assert_same("/monitorings/count?mode=all&estimated=1")
+        self.assert_same("/monitorings/count?estimated=1")
+        self.assert_same("/monitorings/count?mode=test&estimated=false")
+
+    def test_session_cookie(self):
+        self.create_monitoring()
+        status, headers, body = self.asgi_request("/monitorings/{}".format(self.monitoring_id))
+        self.assertTrue(headers["set-cookie"].startswith("SESSION="))
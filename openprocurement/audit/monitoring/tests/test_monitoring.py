@@ -2,13 +2,20 @@ import unittest
 
 from dateorro import calc_working_datetime, calc_datetime
 from datetime import datetime, timedelta
+from time import sleep, time
+from unittest import mock
+from bson.binary import Binary
+from bson.codec_options import CodecOptions
+from bson.timestamp import Timestamp
 from freezegun import freeze_time
 from parameterized import parameterized
 
+from openprocurement.audit.api.database import DocumentCache
+from openprocurement.audit.api.metrics import DOCUMENT_CACHE_READS
 from openprocurement.audit.api.constants import MONITORING_TIME, TZ, SANDBOX_MODE, WORKING_DAYS
 from openprocurement.audit.monitoring.tests.base import BaseWebTest
 from openprocurement.audit.monitoring.tests.utils import get_errors_field_names
-from openprocurement.audit.monitoring.utils import get_monitoring_accelerator
+from openprocurement.audit.monitoring.utils import get_monitoring_accelerator, get_monitoring_projection
 
 
 def masking_monitoring(self):
@@ -223,6 +230,281 @@ class MonitoringResourceTest(BaseWebTest):
     test_masking_monitoring = masking_monitoring
 
 
+@freeze_time('2018-01-01T09:00:00+02:00')
+class MonitoringSequenceBlockTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringSequenceBlockTest, self).setUp()
+        self.mongodb.sequence_block_size = 3
+
+    def tearDown(self):
+        self.mongodb.sequence_block_size = 1
+        super(MonitoringSequenceBlockTest, self).tearDown()
+
+    def test_block_allocation(self):
+        ids = [self.create_monitoring()["monitoring_id"] for _ in range(4)]
+        self.assertEqual(ids, ["UA-M-2018-01-01-00000{}".format(i) for i in range(1, 5)])
+
+        sequence = self.mongodb.get_sequences_collection().find_one({"_id": "monitoring_2018-01-01"})
+        self.assertEqual(sequence["value"], 6)
+
+
+@freeze_time('2018-01-01T09:00:00+02:00')
+class MonitoringPartialUpdateTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringPartialUpdateTest, self).setUp()
+        self.mongodb.partial_updates = True
+        self.create_active_monitoring()
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+
+    def tearDown(self):
+        self.mongodb.partial_updates = False
+        super(MonitoringPartialUpdateTest, self).tearDown()
+
+    def test_patch(self):
+        doc = self.mongodb.monitoring.collection.find_one({"_id": self.monitoring_id})
+        response = self.app.patch_json(
+            '/monitorings/{}'.format(self.monitoring_id),
+            {"data": {"reasons": ["public", "fiscal"]}},
+        )
+        self.assertEqual(response.json["data"]["reasons"], ["public", "fiscal"])
+
+        updated = self.mongodb.monitoring.collection.find_one({"_id": self.monitoring_id})
+        self.assertEqual(updated["reasons"], ["public", "fiscal"])
+        self.assertEqual(updated["dateModified"], response.json["data"]["dateModified"])
+        self.assertNotEqual(updated["_rev"], doc["_rev"])
+        changed = ("reasons", "_rev", "dateModified", "public_modified")
+        self.assertEqual(
+            {k: v for k, v in updated.items() if k not in changed},
+            {k: v for k, v in doc.items() if k not in changed},
+        )
+
+    def test_append_posts(self):
+        for i in range(2):
+            self.app.post_json(
+                '/monitorings/{}/posts'.format(self.monitoring_id),
+                {"data": {"title": "Lorem ipsum {}".format(i), "description": "Lorem ipsum dolor sit amet"}},
+            )
+        response = self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertEqual(
+            [post["title"] for post in response.json["data"]["posts"]],
+            ["Lorem ipsum 0", "Lorem ipsum 1"],
+        )
+
+
+class MonitoringSubtreeProjectionTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringSubtreeProjectionTest, self).setUp()
+        self.create_active_monitoring()
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+        self.post_ids = [
+            self.app.post_json(
+                '/monitorings/{}/posts'.format(self.monitoring_id),
+                {"data": {"title": "Lorem ipsum {}".format(i), "description": "Lorem ipsum dolor sit amet"}},
+            ).json["data"]["id"]
+            for i in range(2)
+        ]
+
+    def test_projection(self):
+        request = mock.Mock(method="GET", matchdict={"monitoring_id": self.monitoring_id, "post_id": "a" * 32})
+        request.path = '/api/2.5/monitorings/{}/posts/{}'.format(self.monitoring_id, "a" * 32)
+        projection = get_monitoring_projection(request, self.monitoring_id)
+        self.assertEqual(projection["posts"], {"$elemMatch": {"id": "a" * 32}})
+        self.assertNotIn("decision", projection)
+
+        request.path = '/api/2.5/monitorings/{}/decision/documents'.format(self.monitoring_id)
+        self.assertIs(get_monitoring_projection(request, self.monitoring_id)["decision"], True)
+
+        request.path = '/api/2.5/monitorings/{}'.format(self.monitoring_id)
+        self.assertIsNone(get_monitoring_projection(request, self.monitoring_id))
+
+        request.method = "PATCH"
+        request.path = '/api/2.5/monitorings/{}/posts/{}'.format(self.monitoring_id, "a" * 32)
+        self.assertIsNone(get_monitoring_projection(request, self.monitoring_id))
+
+    def test_get_post(self):
+        monitoring = self.app.get('/monitorings/{}'.format(self.monitoring_id)).json["data"]
+        for post in monitoring["posts"]:
+            response = self.app.get('/monitorings/{}/posts/{}'.format(self.monitoring_id, post["id"]))
+            self.assertEqual(response.json["data"], post)
+
+        response = self.app.get('/monitorings/{}/posts'.format(self.monitoring_id))
+        self.assertEqual(response.json["data"], monitoring["posts"])
+
+    def test_get_decision(self):
+        monitoring = self.app.get('/monitorings/{}'.format(self.monitoring_id)).json["data"]
+        response = self.app.get('/monitorings/{}/decision'.format(self.monitoring_id))
+        self.assertEqual(response.json["data"], monitoring["decision"])
+
+    def test_post_not_found(self):
+        self.app.get('/monitorings/{}/posts/{}'.format(self.monitoring_id, "a" * 32), status=404)
+
+
+class MonitoringCompressedTextTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringCompressedTextTest, self).setUp()
+        self.mongodb.compressed_text_fields = {"description"}
+        self.mongodb.compressed_text_min_size = 100
+        self.create_active_monitoring()
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+
+    def tearDown(self):
+        self.mongodb.compressed_text_fields = set()
+        super(MonitoringCompressedTextTest, self).tearDown()
+
+    def test_post_description(self):
+        description = "Текст запиту " * 100
+        response = self.app.post_json(
+            '/monitorings/{}/posts'.format(self.monitoring_id),
+            {"data": {"title": "Lorem ipsum", "description": description}},
+        )
+        self.assertEqual(response.json["data"]["description"], description)
+
+        stored = self.mongodb.monitoring.collection.with_options(
+            codec_options=CodecOptions()
+        ).find_one({"_id": self.monitoring_id})
+        self.assertIsInstance(stored["posts"][0]["description"], Binary)
+
+        response = self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertEqual(response.json["data"]["posts"][0]["description"], description)
+
+        response = self.app.get('/monitorings?opt_fields=posts')
+        self.assertEqual(response.json["data"][0]["posts"][0]["description"], description)
+
+
+class MonitoringSecondaryReadsForWritesTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringSecondaryReadsForWritesTest, self).setUp()
+        self.mongodb.secondary_reads_for_writes = True
+        self.create_active_monitoring()
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+
+    def tearDown(self):
+        self.mongodb.secondary_reads_for_writes = False
+        super(MonitoringSecondaryReadsForWritesTest, self).tearDown()
+
+    def test_patch(self):
+        response = self.app.patch_json(
+            '/monitorings/{}'.format(self.monitoring_id),
+            {"data": {"reasons": ["public", "fiscal"]}},
+        )
+        self.assertEqual(response.json["data"]["reasons"], ["public", "fiscal"])
+
+    def test_stale_read(self):
+        collection = self.mongodb.monitoring
+        stale = self.mongodb.get(collection.collection_primary, self.monitoring_id)
+        self.app.patch_json(
+            '/monitorings/{}'.format(self.monitoring_id),
+            {"data": {"reasons": ["public"]}},
+        )
+        with mock.patch.object(collection, "get_from", side_effect=lambda c, uid: dict(stale)):
+            response = self.app.patch_json(
+                '/monitorings/{}'.format(self.monitoring_id),
+                {"data": {"reasons": ["fiscal"]}},
+                status=409,
+            )
+        self.assertIn("SESSION", response.headers["Set-Cookie"])
+
+        response = self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertEqual(response.json["data"]["reasons"], ["public"])
+
+    def test_not_replicated(self):
+        collection = self.mongodb.monitoring
+        get_from = collection.get_from
+
+        def get_from_primary_only(c, uid):
+            return get_from(c, uid) if c is collection.collection_primary else None
+
+        with mock.patch.object(collection, "get_from", side_effect=get_from_primary_only):
+            response = self.app.patch_json(
+                '/monitorings/{}'.format(self.monitoring_id),
+                {"data": {"reasons": ["public"]}},
+            )
+        self.assertEqual(response.json["data"]["reasons"], ["public"])
+
+
+class MonitoringDocumentCacheTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringDocumentCacheTest, self).setUp()
+        self.collection = self.mongodb.monitoring
+        self.collection.start_cache(DocumentCache(2, "monitoring"))
+        self.wait_for(lambda: self.collection.cache.active)
+        self.create_monitoring()
+
+    def tearDown(self):
+        self.collection.stop_cache()
+        super(MonitoringDocumentCacheTest, self).tearDown()
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time() + timeout
+        while not condition():
+            self.assertLess(time(), deadline, "Timed out waiting for the invalidation stream")
+            sleep(.05)
+
+    def get_reads(self):
+        return {
+            result: DOCUMENT_CACHE_READS.values.get(("monitoring", result), 0)
+            for result in ("hit", "miss", "bypass")
+        }
+
+    def test_get_from_cache(self):
+        before = self.get_reads()
+        for _ in range(3):
+            self.app.reset()  # no SESSION cookie, a fresh session can't be newer than the cache
+            self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        after = self.get_reads()
+        self.assertEqual(after["miss"] - before["miss"], 1)
+        self.assertEqual(after["hit"] - before["hit"], 2)
+        self.assertEqual(len(self.collection.cache), 1)
+        self.app.authorization = ('Basic', (self.admin_name, self.admin_pass))
+        self.assertIn('collection="monitoring",result="hit"}', self.app.get('/metrics').text)
+
+    def test_changed_in_db(self):
+        self.app.reset()
+        self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertIn(self.monitoring_id, self.collection.cache.data)
+        self.collection.collection.update_one(
+            {"_id": self.monitoring_id},
+            {"$set": {"_rev": "3-fake", "monitoringDetails": "changed"}},
+        )
+        # evicted by the change stream, no read checks the document in db
+        self.wait_for(lambda: self.monitoring_id not in self.collection.cache.data)
+        response = self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertEqual(response.json["data"]["monitoringDetails"], "changed")
+
+    def test_newer_session(self):
+        self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.collection.cache.stream_time = Timestamp(1, 0)  # the stream is behind the SESSION cookie
+        before = self.get_reads()
+        self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertEqual(self.get_reads()["bypass"] - before["bypass"], 1)
+
+    def test_invalidated_on_save(self):
+        self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+        self.app.patch_json(
+            '/monitorings/{}'.format(self.monitoring_id),
+            {"data": {"reasons": ["public"]}},
+        )
+        self.assertNotIn(self.monitoring_id, self.collection.cache.data)
+        response = self.app.get('/monitorings/{}'.format(self.monitoring_id))
+        self.assertEqual(response.json["data"]["reasons"], ["public"])
+
+    def test_lru_size(self):
+        ids = [self.monitoring_id]
+        for _ in range(2):
+            ids.append(self.create_monitoring()["id"])
+        for uid in ids:
+            self.app.reset()
+            self.app.get('/monitorings/{}'.format(uid))
+        self.assertEqual(list(self.collection.cache.data), ids[1:])
+
+
 class ActiveMonitoringResourceTest(BaseWebTest):
     def setUp(self):
         super(ActiveMonitoringResourceTest, self).setUp()
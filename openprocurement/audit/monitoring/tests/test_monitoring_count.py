@@ -62,3 +62,68 @@ class MonitoringCountResourceTest(BaseWebTest):
         self.assertEqual(response.content_type, 'application/json')
         self.assertEqual(response.json["data"], 13)
 
+    def test_get_estimated_all(self):
+        self.create_monitoring()
+        self.create_monitoring(mode="test")
+        response = self.app.get('/monitorings/count?mode=all&estimated=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["data"], 2)
+
+    def test_get_estimated_filtered(self):
+        response = self.app.get('/monitorings/count?mode=test&estimated=1', status=400)
+        self.assertEqual(
+            response.json["errors"],
+            [{"location": "querystring", "name": "estimated",
+              "description": "Estimated count is only available with mode=all"}]
+        )
+
+    def test_get_not_estimated(self):
+        self.create_monitoring()
+        self.create_monitoring(mode="test")
+        for value in ("0", "false"):
+            response = self.app.get('/monitorings/count?mode=test&estimated={}'.format(value))
+            self.assertEqual(response.json["data"], 1)
+
+
+class MonitoringCountCacheTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringCountCacheTest, self).setUp()
+        self.mongodb.monitoring.count_cache.ttl = 60
+        self.mongodb.monitoring.count_cache.clear()
+
+    def tearDown(self):
+        self.mongodb.monitoring.count_cache.ttl = 0
+        self.mongodb.monitoring.count_cache.clear()
+        super(MonitoringCountCacheTest, self).tearDown()
+
+    def test_cached_per_mode(self):
+        self.create_monitoring()
+        response = self.app.get('/monitorings/count')
+        self.assertEqual(response.json["data"], 1)
+        response = self.app.get('/monitorings/count?mode=test')
+        self.assertEqual(response.json["data"], 0)
+
+        self.create_monitoring()
+        self.create_monitoring(mode="test")
+        response = self.app.get('/monitorings/count')
+        self.assertEqual(response.json["data"], 1)
+        response = self.app.get('/monitorings/count?mode=test')
+        self.assertEqual(response.json["data"], 0)
+        response = self.app.get('/monitorings/count?mode=all')
+        self.assertEqual(response.json["data"], 3)
+
+    def test_refreshed_after_ttl(self):
+        self.create_monitoring()
+        response = self.app.get('/monitorings/count')
+        self.assertEqual(response.json["data"], 1)
+
+        self.create_monitoring()
+        count, updated = self.mongodb.monitoring.count_cache.data[False]
+        self.mongodb.monitoring.count_cache.data[False] = (count, updated - 61)
+        response = self.app.get('/monitorings/count')  # stale value, refresh is started
+        self.assertEqual(response.json["data"], 1)
+
+        self.mongodb.monitoring.refresh_count(False, {"is_test": False})
+        response = self.app.get('/monitorings/count')
+        self.assertEqual(response.json["data"], 2)
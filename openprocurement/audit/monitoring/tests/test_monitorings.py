@@ -1,4 +1,6 @@
 from math import ceil
+from threading import Timer
+from time import time
 from unittest import mock
 
 from openprocurement.audit.api.constants import CANCELLED_STATUS, ACTIVE_STATUS
@@ -191,6 +193,13 @@ class BaseFeedResourceTest(BaseWebTest):
         self.assertIn("procuringStages", response.json["data"][0])
         self.assertNotIn("conclusion", response.json["data"][0])
 
+    def test_opt_pretty(self):
+        response = self.app.get("/monitorings?opt_fields=status")
+        pretty_response = self.app.get("/monitorings?opt_fields=status&opt_pretty=1")
+        self.assertEqual(pretty_response.content_type, 'application/json')
+        self.assertEqual(response.json, pretty_response.json)
+        self.assertNotEqual(response.body, pretty_response.body)
+
 
 class DescendingFeedResourceTest(BaseFeedResourceTest):
     limit = 2
@@ -216,6 +225,56 @@ class ChangesDescFeedResourceTest(BaseFeedResourceTest):
         self.expected_ids = list(reversed(self.expected_ids))
 
 
+class LongPollFeedResourceTest(BaseWebTest):
+
+    def setUp(self):
+        super(LongPollFeedResourceTest, self).setUp()
+        self.app.app.registry.longpoll_timeout = 0.5
+        self.create_active_monitoring()
+
+    def tearDown(self):
+        self.app.app.registry.longpoll_timeout = 25
+        super(LongPollFeedResourceTest, self).tearDown()
+
+    def test_next_page_keeps_feed(self):
+        response = self.app.get('/monitorings?feed=longpoll')
+        self.assertEqual([e["id"] for e in response.json["data"]], [self.monitoring_id])
+        self.assertIn("feed=longpoll", response.json["next_page"]["path"])
+
+        start = time()
+        response = self.app.get(response.json["next_page"]["path"])
+        self.assertEqual(response.json["data"], [])
+        self.assertGreaterEqual(time() - start, 0.5)
+        self.assertIn("feed=longpoll", response.json["next_page"]["path"])
+
+    def test_returns_on_change(self):
+        self.app.app.registry.longpoll_timeout = 10
+        response = self.app.get('/monitorings?feed=longpoll')
+        next_path = response.json["next_page"]["path"]
+
+        def touch():
+            self.mongodb.monitoring.collection.update_one(
+                {"_id": self.monitoring_id},
+                {"$set": {"public_modified": time() + 60}},
+            )
+
+        timer = Timer(0.5, touch)
+        timer.start()
+        start = time()
+        response = self.app.get(next_path)
+        timer.join()
+        self.assertLess(time() - start, 10)
+        self.assertEqual([e["id"] for e in response.json["data"]], [self.monitoring_id])
+
+    def test_descending_is_not_held(self):
+        self.app.app.registry.longpoll_timeout = 10
+        response = self.app.get('/monitorings?feed=longpoll&descending=1')
+        start = time()
+        response = self.app.get(response.json["next_page"]["path"])
+        self.assertEqual(response.json["data"], [])
+        self.assertLess(time() - start, 10)
+
+
 class DraftChangesFeedTestCase(BaseWebTest):
 
     def setUp(self):
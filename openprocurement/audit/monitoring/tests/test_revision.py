@@ -0,0 +1,72 @@
+from freezegun import freeze_time
+
+from openprocurement.audit.monitoring.tests.base import BaseWebTest
+
+
+@freeze_time('2018-01-01T09:00:00+02:00')
+class MonitoringRevisionsResourceTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringRevisionsResourceTest, self).setUp()
+        self.create_monitoring()
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+        self.app.patch_json(
+            '/monitorings/{}'.format(self.monitoring_id),
+            {"data": {"reasons": ["public"]}},
+        )
+        self.app.authorization = None
+
+    def test_revisions_not_in_document(self):
+        doc = self.mongodb.monitoring.collection.find_one({"_id": self.monitoring_id})
+        self.assertNotIn("revisions", doc)
+
+    def test_get_revisions(self):
+        response = self.app.get('/monitorings/{}/revisions'.format(self.monitoring_id))
+        self.assertEqual(response.json["count"], 2)
+        self.assertEqual(
+            set(response.json["data"][0].keys()),
+            {"author", "date", "changes", "rev"},
+        )
+        self.assertEqual(response.json["data"][1]["author"], self.sas_name)
+        self.assertIn("/reasons/0", [change["path"] for change in response.json["data"][1]["changes"]])
+
+    def test_get_revisions_paging(self):
+        response = self.app.get('/monitorings/{}/revisions?limit=1&page=2'.format(self.monitoring_id))
+        self.assertEqual(response.json["count"], 1)
+        self.assertEqual(response.json["total"], 2)
+        self.assertEqual(response.json["data"][0]["author"], self.sas_name)
+
+    def test_legacy_revisions_kept_on_save(self):
+        legacy = [{"author": "legacy", "date": "2017-01-01T00:00:00+02:00", "changes": [], "rev": None}]
+        self.mongodb.monitoring.collection.update_one(
+            {"_id": self.monitoring_id},
+            {"$set": {"revisions": legacy}},
+        )
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+        self.app.patch_json(
+            '/monitorings/{}'.format(self.monitoring_id),
+            {"data": {"reasons": ["fiscal"]}},
+        )
+        doc = self.mongodb.monitoring.collection.find_one({"_id": self.monitoring_id})
+        self.assertEqual(doc["revisions"], legacy)
+        self.assertEqual(doc["reasons"], ["fiscal"])
+
+        response = self.app.get('/monitorings/{}/revisions'.format(self.monitoring_id))
+        self.assertEqual(response.json["count"], 3)
+
+
+@freeze_time('2018-01-01T09:00:00+02:00')
+class RestrictedMonitoringRevisionsResourceTest(BaseWebTest):
+
+    def setUp(self):
+        super(RestrictedMonitoringRevisionsResourceTest, self).setUp()
+        self.create_monitoring(restricted_config=True)
+
+    def test_get_revisions_masked(self):
+        self.app.authorization = ('Basic', (self.broker_name, self.broker_pass))
+        self.app.get('/monitorings/{}/revisions'.format(self.monitoring_id), status=403)
+
+    def test_get_revisions_sas(self):
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+        response = self.app.get('/monitorings/{}/revisions'.format(self.monitoring_id))
+        self.assertEqual(response.json["count"], 1)
@@ -203,6 +203,39 @@ class TenderMonitoringsResourceTest(BaseWebTest):
         self.assertEqual(response.json['page'], 4)
         self.assertEqual(len(response.json['data']), 0)
 
+    def test_get_with_cursor(self):
+        tender_id = "a" * 32
+        self.app.authorization = ('Basic', (self.sas_name, self.sas_pass))
+        ids = []
+        for i in range(5):
+            ids.append(self.create_monitoring(tender_id=tender_id)["id"])
+
+        url = '/tenders/{}/monitorings?mode=draft&limit=2&cursor='.format(tender_id)
+        response = self.app.get(url)
+        self.assertEqual(response.content_type, 'application/json')
+        self.assertNotIn('total', response.json)
+        self.assertEqual(response.json['count'], 2)
+        self.assertEqual(response.json['limit'], 2)
+
+        result_ids = [e["id"] for e in response.json['data']]
+        while "next_page" in response.json:
+            response = self.app.get(response.json["next_page"]["path"])
+            result_ids.extend(e["id"] for e in response.json['data'])
+        self.assertEqual(result_ids, ids)
+
+        response = self.app.get(
+            '/tenders/{}/monitorings?mode=draft&limit=2&cursor=&descending=1&total=1'.format(tender_id)
+        )
+        self.assertEqual(response.json['total'], 5)
+        self.assertEqual([e["id"] for e in response.json['data']], ids[:-3:-1])
+
+    def test_get_with_invalid_cursor(self):
+        response = self.app.get('/tenders/{}/monitorings?cursor=invalid'.format("a" * 32), status=400)
+        self.assertEqual(
+            response.json["errors"],
+            [{"location": "querystring", "name": "cursor", "description": "Invalid cursor provided: invalid"}]
+        )
+
     def test_restricted_visibility(self):
         tender_id = "f" * 32
         self.create_monitoring(tender_id=tender_id, restricted_config=True)
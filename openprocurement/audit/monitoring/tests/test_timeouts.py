@@ -0,0 +1,38 @@
+from unittest import mock
+
+from pymongo.errors import ExecutionTimeout
+
+from openprocurement.audit.monitoring.tests.base import BaseWebTest
+
+
+class MonitoringQueryTimeoutTest(BaseWebTest):
+
+    def setUp(self):
+        super(MonitoringQueryTimeoutTest, self).setUp()
+        self.create_monitoring()
+
+    def test_budget_exceeded(self):
+        with mock.patch("openprocurement.audit.api.timeouts.get_remaining_time", return_value=-1):
+            response = self.app.get('/monitorings/{}'.format(self.monitoring_id), status=503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(
+            response.json["errors"],
+            [{"location": "url", "name": "timeout", "description": "Request time budget exceeded"}],
+        )
+
+    def test_query_timeout(self):
+        with mock.patch.object(
+            self.mongodb.monitoring.collection.__class__, "find",
+            side_effect=ExecutionTimeout("operation exceeded time limit", 50),
+        ):
+            response = self.app.get('/monitorings', status=504)
+        self.assertEqual(
+            response.json["errors"],
+            [{"location": "url", "name": "timeout", "description": "Database query timed out"}],
+        )
+
+    def test_longpoll_wait_is_limited(self):
+        with mock.patch("openprocurement.audit.api.database.get_remaining_time", return_value=0.2):
+            with mock.patch("openprocurement.audit.api.timeouts.get_remaining_time", return_value=0.2):
+                response = self.app.get('/monitorings?feed=longpoll&offset=9999999999')
+        self.assertEqual(response.json["data"], [])
@@ -101,8 +101,49 @@ def monitoring_from_data(request, data):
     return Monitoring(data)
 
 
+# fields the sub-resource views, masking and the monitoring __acl__ use
+MONITORING_PROJECTION_FIELDS = (
+    "_rev", "status", "restricted", "is_masked", "mode", "tender_id", "tender_owner", "tender_owner_token",
+)
+MONITORING_SUBTREE_FIELDS = (
+    "decision", "cancellation", "conclusion", "eliminationReport", "eliminationResolution", "appeal", "documents",
+)
+MONITORING_SUBTREE_ITEMS = {
+    "liabilities": "liability_id",
+    "posts": "post_id",
+    "parties": "party_id",
+}
+
+
+def get_monitoring_projection(request, monitoring_id):
+    """
+    Projection of the monitoring part a sub-resource GET needs (see traversal.factory),
+    None for the monitoring itself and other routes, those load the whole monitoring
+    """
+    if request.method not in ("GET", "HEAD"):
+        return None
+    path = request.path.split('/')
+    try:
+        field = path[path.index(monitoring_id) + 1]
+    except (ValueError, IndexError):
+        return None
+    projection = dict.fromkeys(MONITORING_PROJECTION_FIELDS, True)
+    if field in MONITORING_SUBTREE_FIELDS:
+        # documents versions have the same id, so all of them are loaded
+        projection[field] = True
+    elif field in MONITORING_SUBTREE_ITEMS:
+        item_id = request.matchdict.get(MONITORING_SUBTREE_ITEMS[field])
+        projection[field] = {"$elemMatch": {"id": item_id}} if item_id else True
+    else:
+        return None
+    return projection
+
+
 def extract_monitoring_adapter(request, monitoring_id):
-    data = request.registry.mongodb.monitoring.get(monitoring_id)
+    data = request.registry.mongodb.monitoring.get(
+        monitoring_id,
+        projection=get_monitoring_projection(request, monitoring_id),
+    )
     if data is None:
         request.errors.add('url', 'monitoring_id', 'Not Found')
         request.errors.status = 404
@@ -1,6 +1,7 @@
 from logging import getLogger
 
 from pyramid.security import ACLAllowed
+from pyramid.settings import asbool
 from openprocurement.audit.api.constants import (
     MONITORING_TIME,
     ELIMINATION_PERIOD_TIME,
@@ -26,6 +27,7 @@ from openprocurement.audit.api.utils import (
     context_unpack,
     forbidden,
     generate_id,
+    raise_operation_error,
     set_ownership
 )
 from openprocurement.audit.monitoring.mask import MONITORING_MASK_MAPPING
@@ -54,39 +56,42 @@ from openprocurement.audit.monitoring.validation import (
 )
 LOGGER = getLogger(__name__)
 
+ESTIMATED_COUNT_ERROR = 'Estimated count is only available with mode=all'
+
 
 @op_resource(name='Monitorings', path='/monitorings')
 class MonitoringsResource(RestrictedResourceListingMixin, MongodbResourceListing):
+    listing_allowed_fields = {
+        "dateCreated",
+        "dateModified",
+        "tender_id",
+        "status",
+        "monitoring_id",
+        "reasons",
+        "procuringStages",
+        "monitoringPeriod",
+        "documents",
+        "riskIndicators",
+        "riskIndicatorsTotalImpact",
+        "riskIndicatorsRegion",
+        "eliminationReport",
+        "eliminationResolution",
+        "eliminationPeriod",
+        "posts",
+        "appeal",
+        "liabilities",
+        "parties",
+        "endDate",
+        "tender_owner",
+        "owner",
+    }
 
     def __init__(self, request, context):
         super(MonitoringsResource, self).__init__(request, context)
         self.listing_name = "Monitorings"
         self.listing_default_fields = {"dateModified"}
-        self.listing_allowed_fields = {
-            "dateCreated",
-            "dateModified",
-            "tender_id",
-            "status",
-            "monitoring_id",
-            "reasons",
-            "procuringStages",
-            "monitoringPeriod",
-            "documents",
-            "riskIndicators",
-            "riskIndicatorsTotalImpact",
-            "riskIndicatorsRegion",
-            "eliminationReport",
-            "eliminationResolution",
-            "eliminationPeriod",
-            "posts",
-            "appeal",
-            "liabilities",
-            "parties",
-            "endDate",
-            "tender_owner",
-            "owner",
-        }
         self.db_listing_method = request.registry.mongodb.monitoring.list
+        self.db_wait_method = request.registry.mongodb.monitoring.wait_for_changes
         self.mask_mapping = MONITORING_MASK_MAPPING
 
     @staticmethod
@@ -229,6 +234,13 @@ class MonitoringCountResource(APIResource):
     @json_view(permission='view_listing')
     def get(self):
         mode = self.request.params.get('mode', '')
-        count = self.request.registry.mongodb.monitoring.count(mode)
+        estimated = asbool(self.request.params.get('estimated'))
+        collection = self.request.registry.mongodb.monitoring
+        try:
+            count = collection.count(mode, estimated=estimated)
+        except ValueError:
+            # collection metadata has only the total, filtered counts are always exact
+            raise_operation_error(self.request, ESTIMATED_COUNT_ERROR,
+                                  status=400, location='querystring', name='estimated')
         data = {'data': count}
         return data
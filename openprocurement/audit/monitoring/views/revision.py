@@ -0,0 +1,19 @@
+from openprocurement.audit.api.views.base import RevisionsResourceListing, json_view
+from openprocurement.audit.monitoring.utils import op_resource
+
+
+@op_resource(name='Monitoring Revisions',
+             path='/monitorings/{monitoring_id}/revisions',
+             description='Monitoring Revisions')
+class MonitoringRevisionsResource(RevisionsResourceListing):
+
+    def __init__(self, request, context):
+        super(MonitoringRevisionsResource, self).__init__(request, context)
+        self.obj_id_key = "monitoring_id"
+
+    @json_view(permission='revision_monitoring')
+    def get(self):
+        """
+        Monitoring revisions
+        """
+        return super(MonitoringRevisionsResource, self).get()
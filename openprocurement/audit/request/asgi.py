@@ -0,0 +1,16 @@
+from openprocurement.audit.api.asgi import AsyncListingMixin, get_listing
+from openprocurement.audit.request.database import RequestCollection
+from openprocurement.audit.request.views.request import RequestsResource
+
+
+class RequestsListing(AsyncListingMixin, RequestsResource):
+    pass
+
+
+async def get_requests(request):
+    return await get_listing(RequestsListing(request, None))
+
+
+def includeme(app):
+    app.mongodb.add_collection("request", RequestCollection)
+    app.add_route("Requests", "/requests", get_requests)
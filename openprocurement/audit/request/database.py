@@ -1,4 +1,4 @@
-from openprocurement.audit.api.database import BaseCollection
+from openprocurement.audit.api.database import BaseCollection, ListingQuery
 from pymongo import IndexModel, ASCENDING
 import logging
 
@@ -8,6 +8,18 @@ logger = logging.getLogger(__name__)
 
 class RequestCollection(BaseCollection):
     object_name = "request"
+    listing_queries = (
+        # /requests feed modes: "", test, all, answered, not_answered
+        ListingQuery("real_by_public_modified", "public_modified", {"is_test": False}),
+        ListingQuery("test_by_public_modified", "public_modified", {"is_test": True}),
+        ListingQuery("all_by_public_modified", "public_modified"),
+        ListingQuery("real_is_answered_by_public_modified", "public_modified", {"is_test": False, "is_answered": True}),
+        ListingQuery(
+            "real_not_is_answered_by_public_modified", "public_modified", {"is_test": False, "is_answered": False},
+        ),
+        # /tenders/{tender_id}/requests
+        ListingQuery("all_by_tenderId_created", "dateCreated", fields={"tenderId"}, optional_fields={"is_test"}),
+    )
 
     def get_indexes(self):
         # Making multiple indexes with the same unique key is supposed to be impossible
@@ -79,7 +91,7 @@ class RequestCollection(BaseCollection):
 
         data["is_answered"] = "answer" in data  # <- this added
 
-        updated = self.store.save_data(self.collection, data, insert=insert, modified=modified)
+        updated = self.save_data(data, insert=insert, modified=modified)
         o.import_data(updated)
 
     def get(self, uid):
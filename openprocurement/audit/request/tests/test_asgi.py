@@ -0,0 +1,22 @@
+from openprocurement.audit.api.tests.asgi import ASGITestMixin
+from openprocurement.audit.request.tests.base import BaseWebTest
+
+
+class ASGIRequestsTest(ASGITestMixin, BaseWebTest):
+    """
+    The asgi app listing responses are compared with the ones of the WSGI app
+    """
+
+    def test_listing(self):
+        for _ in range(3):
+            self.create_request()
+
+        data = self.assert_same("/requests?opt_fields=description,violationType&limit=2")
+        self.assertEqual(len(data["data"]), 2)
+        self.assert_same(data["next_page"]["path"])
+        self.assert_same("/requests?descending=1&opt_pretty=1")
+        self.assert_same("/requests?mode=not_answered", auth=(self.sas_name, self.sas_pass))
+
+    def test_listing_errors(self):
+        self.assert_same("/requests?offset=latest")
+        self.assert_same("/requests?limit=a")
@@ -0,0 +1,58 @@
+from unittest import mock
+
+from freezegun import freeze_time
+from pymongo.errors import OperationFailure
+
+from openprocurement.audit.api.database import RevisionCollection
+from openprocurement.audit.request.tests.base import BaseWebTest
+
+
+@freeze_time("2018-01-01T11:00:00+02:00")
+class RequestRevisionsResourceTest(BaseWebTest):
+
+    def setUp(self):
+        super(RequestRevisionsResourceTest, self).setUp()
+        self.create_request()
+        self.app.authorization = ("Basic", (self.sas_name, self.sas_pass))
+        self.app.patch_json(
+            "/requests/{}".format(self.request_id),
+            {"data": {"answer": "monitoringCreated", "reason": "Because"}},
+        )
+        self.app.authorization = None
+
+    def test_revisions_not_in_document(self):
+        doc = self.mongodb.request.collection.find_one({"_id": self.request_id})
+        self.assertNotIn("revisions", doc)
+
+    def test_get_revisions(self):
+        self.app.authorization = ("Basic", (self.sas_name, self.sas_pass))
+        response = self.app.get("/requests/{}/revisions".format(self.request_id))
+        self.assertEqual(response.json["count"], 2)
+        self.assertEqual(
+            set(response.json["data"][0].keys()),
+            {"author", "date", "changes", "rev"},
+        )
+        self.assertEqual(response.json["data"][1]["author"], self.sas_name)
+        self.assertIn("/answer", [change["path"] for change in response.json["data"][1]["changes"]])
+
+    def test_get_revisions_forbidden(self):
+        self.app.get("/requests/{}/revisions".format(self.request_id), status=403)
+        for auth in ((self.broker_name, self.broker_pass), (self.public_name, self.public_pass)):
+            self.app.authorization = ("Basic", auth)
+            self.app.get("/requests/{}/revisions".format(self.request_id), status=403)
+
+    def test_failed_revision_insert(self):
+        self.create_request()
+        self.app.authorization = ("Basic", (self.sas_name, self.sas_pass))
+        with mock.patch.object(RevisionCollection, "insert", side_effect=OperationFailure("insert failed")):
+            self.app.patch_json(
+                "/requests/{}".format(self.request_id),
+                {"data": {"answer": "monitoringCreated", "reason": "Because"}},
+                status="*",
+            )
+        doc = self.mongodb.request.collection.find_one({"_id": self.request_id})
+        self.assertNotIn("answer", doc)
+
+        self.app.authorization = ("Basic", (self.sas_name, self.sas_pass))
+        response = self.app.get("/requests/{}/revisions".format(self.request_id))
+        self.assertEqual(response.json["count"], 1)
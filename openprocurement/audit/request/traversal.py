@@ -18,6 +18,8 @@ class Root(object):
         (Allow, "g:%s" % PUBLIC_ROLE, "create_request_document"),
         (Allow, "g:%s" % SAS_ROLE, "edit_request"),
         (Allow, "g:%s" % SAS_ROLE, "create_request_document"),
+        # changes show the parties contacts, that are only in the sas view of a request
+        (Allow, "g:%s" % SAS_ROLE, "revision_request"),
     ]
 
     def __init__(self, request):
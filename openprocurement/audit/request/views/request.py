@@ -29,21 +29,23 @@ LOGGER = getLogger(__name__)
 
 @op_resource(name="Requests", path="/requests")
 class RequestsResource(MongodbResourceListing):
+    listing_allowed_fields = {
+        "dateCreated",
+        "dateModified",
+        "requestId",
+        "description",
+        "violationType",
+        "answer",
+        "dateAnswered",
+        "owner",
+    }
+
     def __init__(self, request, context):
         super(RequestsResource, self).__init__(request, context)
         self.listing_name = "Requests"
         self.listing_default_fields = {"dateModified"}
-        self.listing_allowed_fields = {
-            "dateCreated",
-            "dateModified",
-            "requestId",
-            "description",
-            "violationType",
-            "answer",
-            "dateAnswered",
-            "owner",
-        }
         self.db_listing_method = request.registry.mongodb.request.list
+        self.db_wait_method = request.registry.mongodb.request.wait_for_changes
 
     @staticmethod
     def add_mode_filters(filters: dict, mode: str):
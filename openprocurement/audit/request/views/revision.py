@@ -0,0 +1,19 @@
+from openprocurement.audit.api.views.base import RevisionsResourceListing, json_view
+from openprocurement.audit.request.utils import op_resource
+
+
+@op_resource(name="Request Revisions",
+             path="/requests/{request_id}/revisions",
+             description="Request Revisions")
+class RequestRevisionsResource(RevisionsResourceListing):
+
+    def __init__(self, request, context):
+        super(RequestRevisionsResource, self).__init__(request, context)
+        self.obj_id_key = "request_id"
+
+    @json_view(permission="revision_request")
+    def get(self):
+        """
+        Request revisions
+        """
+        return super(RequestRevisionsResource, self).get()
@@ -35,6 +35,11 @@ entry_points = {
     'paste.app_factory': [
         'main = openprocurement.audit.api.app:main'
     ],
+    'openprocurement.audit.api.asgi_plugins': [
+        'monitoring = openprocurement.audit.monitoring.asgi:includeme',
+        'inspection = openprocurement.audit.inspection.asgi:includeme',
+        'request = openprocurement.audit.request.asgi:includeme',
+    ],
     'openprocurement.audit.api.plugins': [
         'api = openprocurement.audit.api:includeme',
         'monitoring = openprocurement.audit.monitoring:includeme',
@@ -61,5 +66,13 @@ setup(name='openprocurement.audit.api',
       install_requires=requires,
       setup_requires=setup_requires,
       tests_require=test_requires,
-      extras_require={'test': test_requires},
+      extras_require={
+          'test': test_requires,
+          # openprocurement.audit.api.benchmark
+          'benchmark': ['webtest'],
+          # zstd and snappy wire compression (mongodb.compressors)
+          'compression': ['pymongo[snappy,zstd]'],
+          # read-only asgi app (openprocurement.audit.api.asgi)
+          'asgi': ['pymongo>=4.13', 'uvicorn'],
+      },
       entry_points=entry_points)